@@ -0,0 +1,250 @@
+"""Archives finished BRER iterations.
+
+Once a member has moved on to iteration i, the directories for iterations
+< i are never written again, but they keep thousands of small files (logs,
+checkpoints, GROMACS backups) around. The IterationArchiver packs each finished
+``mem_<n>/<iteration>/`` directory into a single ``mem_<n>/<iteration>.zip`` and
+removes the directory. Zip archives have a central index and compress each
+member separately, so a single log can be read without unpacking anything:
+``open_log`` opens a log from the filesystem if it is still there, and from the
+archive otherwise.
+"""
+
+import io
+import os
+import glob
+import logging
+import shutil
+import zipfile
+import threading
+import contextlib
+from wzm_wzt.run_params import State
+from wzm_wzt.checkpoints import CheckpointStore, PRUNE_AGE
+
+# Files that do not compress (checkpoints) are stored as they are
+STORED_EXTENSIONS = ['.cpt', '.tpr', '.trr', '.xtc', '.edr']
+
+
+def get_archive_name(iteration_dir):
+    """The archive that replaces an iteration directory."""
+    return "{}.zip".format(os.path.abspath(str(iteration_dir)).rstrip(os.sep))
+
+
+def find_archive(path):
+    """Find the archive that holds ``path`` (if any).
+
+    Returns
+    -------
+    tuple
+        (archive path, name of the file inside the archive), or (None, None).
+    """
+    path = os.path.abspath(str(path))
+    parent = os.path.dirname(path)
+    while parent != os.path.dirname(parent):
+        archive = get_archive_name(parent)
+        if os.path.isfile(archive):
+            return archive, os.path.relpath(path, parent)
+        parent = os.path.dirname(parent)
+    return None, None
+
+
+def list_iterations(member_dir):
+    """The iterations of a member that have a directory or an archive."""
+    iterations = set()
+    for path in glob.glob(os.path.join(str(member_dir), '[0-9]*')):
+        name = os.path.basename(path)
+        if name.endswith('.zip'):
+            name = name[:-len('.zip')]
+        if name.isdigit():
+            iterations.add(int(name))
+    return sorted(iterations)
+
+
+def list_files(iteration_dir):
+    """The files of an iteration directory, whether it is still on disk or
+    has been archived.
+
+    Returns
+    -------
+    list
+        sorted paths relative to ``iteration_dir`` ('/'-separated); open them with open_log after joining them
+        to ``iteration_dir``.
+    """
+    iteration_dir = os.path.abspath(str(iteration_dir))
+    names = set()
+    for root, _, files in os.walk(iteration_dir):
+        names.update(os.path.relpath(os.path.join(root, fnm), iteration_dir).replace(os.sep, "/") for fnm in files)
+    archive = get_archive_name(iteration_dir)
+    if os.path.isfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            names.update(name for name in zf.namelist() if not name.endswith("/"))
+    return sorted(names)
+
+
+@contextlib.contextmanager
+def open_log(path):
+    """Open a log file for reading (as text), whether it is still on disk or
+    has been archived.
+
+    Parameters
+    ----------
+    path : str
+        the path the log file had before it was archived.
+
+    Example
+    -------
+    >>> with open_log('mem_0/3/num_test_sites_6/3673_5636/convergence/3673_5636.log') as fh:
+    ...     header = fh.readline()
+    """
+    if os.path.exists(str(path)):
+        with open(str(path)) as fh:
+            yield fh
+        return
+    archive, name = find_archive(path)
+    if archive is None:
+        raise FileNotFoundError("The log file {} does not exist and has not been archived".format(path))
+    with zipfile.ZipFile(archive) as zf:
+        try:
+            member = zf.open(name)
+        except KeyError:
+            raise FileNotFoundError("The log file {} is not in the archive {}".format(name, archive))
+        with io.TextIOWrapper(member) as fh:
+            yield fh
+
+
+class IterationArchiver():
+    def __init__(self, ensemble_dir, include_checkpoints=False):
+        """Archive finished iterations of every member of an ensemble.
+
+        Parameters
+        ----------
+        ensemble_dir : str
+            the top-level ensemble directory.
+        include_checkpoints : bool, optional
+            keep checkpoints in the archive, by default False. Checkpoints of finished iterations are not
+            needed to continue the run, and each one is a full copy of a (possibly multi-GB) file that the
+            checkpoint store only kept once.
+        """
+        self.ensemble_dir = os.path.abspath(str(ensemble_dir))
+        self.include_checkpoints = include_checkpoints
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_completed(self):
+        """Iteration directories that are finished according to each member's
+        state but have not been archived yet.
+
+        Returns
+        -------
+        list
+            list of (ensemble_num, iteration) tuples.
+        """
+        completed = []
+        for state_json in sorted(glob.glob(os.path.join(self.ensemble_dir, 'mem_*', 'state.json'))):
+            member_dir = os.path.dirname(state_json)
+            ensemble_num = int(os.path.basename(member_dir)[len('mem_'):])
+            state = State(state_json)
+            state.load_from_json(state_json)
+            current = state.get('iteration')
+            for iteration_dir in glob.glob(os.path.join(member_dir, '[0-9]*')):
+                name = os.path.basename(iteration_dir)
+                if os.path.isdir(iteration_dir) and name.isdigit() and int(name) < current:
+                    completed.append((ensemble_num, int(name)))
+        return sorted(completed)
+
+    def archive(self, ensemble_num, iteration):
+        """Pack one iteration directory into a zip archive and remove the
+        directory.
+
+        Parameters
+        ----------
+        ensemble_num : int
+            the ensemble member.
+        iteration : int
+            the (finished) iteration.
+
+        Returns
+        -------
+        str
+            path to the archive.
+        """
+        iteration_dir = os.path.join(self.ensemble_dir, 'mem_{}'.format(ensemble_num), '{}'.format(iteration))
+        archive = get_archive_name(iteration_dir)
+        tmp = "{}.{}.tmp".format(archive, os.getpid())
+
+        expected = {}
+        with zipfile.ZipFile(tmp, 'w') as zf:
+            for root, _, files in os.walk(iteration_dir):
+                for fnm in sorted(files):
+                    path = os.path.join(root, fnm)
+                    extension = os.path.splitext(fnm)[1]
+                    if extension == '.cpt' and not self.include_checkpoints:
+                        continue
+                    compression = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                    name = os.path.relpath(path, iteration_dir)
+                    zf.write(path, arcname=name, compress_type=compression)
+                    expected[name] = os.path.getsize(path)
+
+        # Only remove the directory once the index is known to be complete
+        with zipfile.ZipFile(tmp) as zf:
+            archived = {info.filename: info.file_size for info in zf.infolist()}
+        if archived != expected:
+            os.remove(tmp)
+            raise IOError("The archive for {} is incomplete; leaving the directory in place".format(iteration_dir))
+        os.replace(tmp, archive)
+        shutil.rmtree(iteration_dir)
+        return archive
+
+    def archive_completed(self):
+        """Archive every finished iteration of every member, and then remove the
+        checkpoints that only they used from the store.
+
+        Returns
+        -------
+        list
+            paths of the new archives.
+        """
+        archives = [self.archive(ensemble_num, iteration) for ensemble_num, iteration in self.get_completed()]
+        if archives:
+            # The checkpoints in the archived directories no longer hold on to their blobs
+            self.prune_checkpoints()
+        return archives
+
+    def prune_checkpoints(self):
+        """Remove the checkpoints of the ensemble's store
+        (``<ensemble_dir>/checkpoints``) that are no longer used (see
+        checkpoints.CheckpointStore.prune).
+
+        Returns
+        -------
+        list
+            digests of the removed checkpoints.
+        """
+        store = CheckpointStore(os.path.join(self.ensemble_dir, 'checkpoints'))
+        return store.prune(min_age=PRUNE_AGE)
+
+    def start(self, interval=600.):
+        """Archive finished iterations in a background thread every ``interval``
+        seconds until ``stop`` is called."""
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.archive_completed()
+                except Exception:
+                    logging.getLogger("WZM-WZT").exception("Archiving finished iterations failed")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name="IterationArchiver", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Stop the background thread (after the current pass finishes)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
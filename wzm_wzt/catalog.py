@@ -0,0 +1,297 @@
+"""SQLite catalog of an ensemble's runs.
+
+Finding out where an ensemble stands otherwise means walking every
+``mem_*/<iteration>/num_test_sites_*/<site>/<phase>`` directory and opening
+each state.json. The catalog is a single SQLite file in the ensemble directory
+that is updated incrementally whenever a member writes its state, computes work
+values or registers a checkpoint, so status queries are a single SELECT. It is
+kept only if asked for (run_md.Simulation's ``catalog``); the state and log
+files stay the record of the run, and ``rebuild`` recovers the catalog from them.
+
+Tables:
+    - members      one row per ensemble member: current iteration, start time and state file.
+    - pairs        one row per (member, iteration, pair): phase, alpha, target, on, testing.
+    - work         one row per (member, iteration, num_test_sites, pair): work and Boltzmann probability.
+    - checkpoints  one row per checkpoint file: where it is and its digest in the CheckpointStore.
+    - throughput   one row per run: ns/day, wall time, steps and the host it ran on (see throughput).
+
+SQLite's locking is not reliable on every parallel filesystem; only rank 0 of
+each member writes, every write is a short transaction with a generous busy
+timeout, and a write that fails anyway is logged without stopping the run.
+"""
+
+import os
+import glob
+import json
+import time
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    ensemble_num INTEGER PRIMARY KEY,
+    iteration INTEGER,
+    start_time REAL,
+    state_json TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    ensemble_num INTEGER,
+    iteration INTEGER,
+    site_name TEXT,
+    phase TEXT,
+    alpha REAL,
+    target REAL,
+    is_on INTEGER,
+    testing INTEGER,
+    updated REAL,
+    PRIMARY KEY (ensemble_num, iteration, site_name)
+);
+CREATE TABLE IF NOT EXISTS work (
+    ensemble_num INTEGER,
+    iteration INTEGER,
+    num_test_sites INTEGER,
+    site_name TEXT,
+    work REAL,
+    probability REAL,
+    updated REAL,
+    PRIMARY KEY (ensemble_num, iteration, num_test_sites, site_name)
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    path TEXT PRIMARY KEY,
+    ensemble_num INTEGER,
+    iteration INTEGER,
+    phase TEXT,
+    digest TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS throughput (
+    workdir TEXT PRIMARY KEY,
+    ensemble_num INTEGER,
+    iteration INTEGER,
+    num_test_sites INTEGER,
+    phase TEXT,
+    site_name TEXT,
+    host TEXT,
+    ns_per_day REAL,
+    wall_time REAL,
+    steps INTEGER,
+    updated REAL
+);
+"""
+
+
+class RunCatalog():
+    def __init__(self, filename, timeout=60.):
+        """Catalog of all the runs in an ensemble.
+
+        Parameters
+        ----------
+        filename : str
+            path to the SQLite file, usually ``<ensemble_dir>/catalog.sqlite``.
+        timeout : float, optional
+            how long (in seconds) to wait for another member's write to finish, by default 60.
+        """
+        self.filename = str(filename)
+        self.timeout = timeout
+        self._connection = None
+
+    def connect(self):
+        """Open the catalog (creating the tables if necessary). Called lazily by
+        all the other methods."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.filename, timeout=self.timeout, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            with self._connection:
+                self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def record_state(self, state):
+        """Record a member's State (general and pair parameters).
+
+        Parameters
+        ----------
+        state : run_params.State
+            the state; its 'ensemble_num' general parameter identifies the member.
+        """
+        now = time.time()
+        ensemble_num = state.get('ensemble_num')
+        iteration = state.get('iteration')
+        rows = []
+        for site_name in sorted(state.pair_params):
+            pair_params = state.pair_params[site_name]
+            rows.append((ensemble_num, iteration, site_name, pair_params.get('phase'), pair_params.get('alpha'),
+                         pair_params.get('target'), int(pair_params.get('on')), int(pair_params.get('testing')),
+                         now))
+        with self.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)",
+                               (ensemble_num, iteration, state.get('start_time'), os.path.abspath(state.json), now))
+            connection.executemany("INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def record_work(self, ensemble_num, iteration, num_test_sites, work, probs):
+        """Record the work values and probabilities from run_md.work_calculation.
+
+        Parameters
+        ----------
+        ensemble_num : int
+            the ensemble member.
+        iteration : int
+            the BRER iteration.
+        num_test_sites : int
+            the number of test sites in this round.
+        work : dict
+            {site_name: work}
+        probs : dict
+            {site_name: probability}
+        """
+        now = time.time()
+        rows = [(ensemble_num, iteration, num_test_sites, site_name, float(work[site_name]),
+                 float(probs[site_name]), now) for site_name in work]
+        with self.connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO work VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def record_checkpoints(self, ensemble_num, iteration, paths, digest=None, phase=None):
+        """Record where checkpoints were written.
+
+        Parameters
+        ----------
+        ensemble_num : int
+            the ensemble member.
+        iteration : int
+            the BRER iteration.
+        paths : list
+            paths of the checkpoint files.
+        digest : str, optional
+            the digest of the checkpoint in the CheckpointStore, by default None
+        phase : str, optional
+            the phase the checkpoints are for; by default taken from the name of the enclosing directory.
+        """
+        now = time.time()
+        rows = [(os.path.abspath(str(path)), ensemble_num, iteration, phase or os.path.basename(
+            os.path.dirname(os.path.abspath(str(path)))), digest, now) for path in paths]
+        with self.connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def record_throughput(self, ensemble_num, iteration, num_test_sites, phase, rows):
+        """Record the throughput of a phase's runs.
+
+        Parameters
+        ----------
+        ensemble_num : int
+            the ensemble member.
+        iteration : int
+            the BRER iteration.
+        num_test_sites : int
+            the number of test sites in this round.
+        phase : str
+            the phase.
+        rows : list
+            the result of throughput.collect.
+        """
+        now = time.time()
+        values = [(row["workdir"], ensemble_num, iteration, num_test_sites, phase, row["site_name"], row["host"],
+                   row["ns_per_day"], row["wall_time"], row["steps"], now) for row in rows]
+        with self.connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO throughput VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   values)
+
+    def get_throughput_ranking(self, by="ensemble_num", phase=None, limit=None):
+        """Rank members, sites or hosts by throughput, slowest first.
+
+        Parameters
+        ----------
+        by : str, optional
+            'ensemble_num', 'site_name' or 'host', by default 'ensemble_num'
+        phase : str, optional
+            only look at runs of this phase, by default all of them
+        limit : int, optional
+            only return the slowest ``limit``, by default all
+
+        Returns
+        -------
+        list
+            dictionaries with ``by``, mean_ns_per_day, min_ns_per_day, wall_time (total, in seconds) and runs.
+        """
+        if by not in ["ensemble_num", "site_name", "host"]:
+            raise ValueError("Cannot rank throughput by {}".format(by))
+        where, parameters = "", []
+        if phase is not None:
+            where = "WHERE phase = ?"
+            parameters.append(phase)
+        sql = """
+            SELECT {by}, AVG(ns_per_day) AS mean_ns_per_day, MIN(ns_per_day) AS min_ns_per_day,
+                   SUM(wall_time) AS wall_time, COUNT(*) AS runs
+            FROM throughput {where} GROUP BY {by} ORDER BY mean_ns_per_day""".format(by=by, where=where)
+        if limit is not None:
+            sql += " LIMIT {:d}".format(limit)
+        return self.query(sql, parameters)
+
+    def query(self, sql, parameters=()):
+        """Run an arbitrary SELECT against the catalog.
+
+        Returns
+        -------
+        list
+            list of dictionaries, one per row.
+        """
+        return [dict(row) for row in self.connect().execute(sql, parameters)]
+
+    def get_status(self):
+        """Ensemble-wide status: for every member, the current iteration, the
+        production start time and the number of pairs in each phase.
+
+        Returns
+        -------
+        list
+            list of dictionaries sorted by ensemble member.
+        """
+        return self.query("""
+            SELECT m.ensemble_num, m.iteration, m.start_time, m.updated,
+                   SUM(p.phase = 'training' AND p.testing) AS training,
+                   SUM(p.phase = 'convergence' AND p.testing) AS convergence,
+                   SUM(p.phase = 'production' AND p.is_on) AS production
+            FROM members m LEFT JOIN pairs p
+                ON p.ensemble_num = m.ensemble_num AND p.iteration = m.iteration
+            GROUP BY m.ensemble_num ORDER BY m.ensemble_num""")
+
+    def get_work(self, ensemble_num=None, iteration=None):
+        """Work values, optionally for a single member and/or iteration."""
+        conditions, parameters = [], []
+        for column, value in [('ensemble_num', ensemble_num), ('iteration', iteration)]:
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                parameters.append(value)
+        where = "WHERE {}".format(" AND ".join(conditions)) if conditions else ""
+        return self.query(
+            "SELECT * FROM work {} ORDER BY ensemble_num, iteration, num_test_sites DESC, site_name".format(where),
+            parameters)
+
+    def rebuild(self, ensemble_dir):
+        """Index an existing ensemble by reading every ``mem_*/state.json``
+        once. Only needed for ensembles that were run without a catalog.
+
+        Parameters
+        ----------
+        ensemble_dir : str
+            the top-level ensemble directory.
+
+        Returns
+        -------
+        int
+            the number of members indexed.
+        """
+        from wzm_wzt.run_params import State
+
+        members = 0
+        for state_json in sorted(glob.glob(os.path.join(str(ensemble_dir), 'mem_*', 'state.json'))):
+            state = State(state_json)
+            state.set_from_dictionary(json.load(open(state_json)))
+            # Older state files do not know which member they belong to
+            state.set(ensemble_num=int(os.path.basename(os.path.dirname(state_json))[len('mem_'):]))
+            self.record_state(state)
+            members += 1
+        return members
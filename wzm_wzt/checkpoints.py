@@ -0,0 +1,289 @@
+"""Copies a checkpoint into many working directories at once.
+
+At the end of production (and convergence) the same state.cpt is needed in
+every training and convergence directory of the next round. Instead of copying
+the bytes N times, ``fan_out`` tries, in order:
+
+    1. reflinks (``FICLONE``): copy-on-write clones that share data blocks, on
+       filesystems that support them (btrfs, XFS, ...).
+    2. hardlinks: the destinations share the source inode. GROMACS replaces
+       state.cpt rather than rewriting it in place, so this is safe for mdrun;
+       anything that wants to modify a checkpoint in place should call
+       ``unshare`` first (copy-on-open).
+    3. a chunked copy that reads the source once and writes each chunk to all
+       destinations in parallel.
+
+Every destination is written to a temporary file and then renamed, so a
+destination is never seen half-written.
+
+A CheckpointStore goes one step further and keeps a single content-addressed
+copy of every distinct checkpoint under the ensemble directory; phase
+directories only hold links to the stored blobs, so identical checkpoints in
+training, convergence and production (and across iterations) are stored once.
+"""
+
+import os
+import time
+import fcntl
+import errno
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+CHUNK_SIZE = 64 * 1024 * 1024
+METHODS = ['reflink', 'hardlink', 'copy']
+PRUNE_AGE = 3600.  # s, how old an unused blob must be before it is pruned during a run
+
+# errnos meaning "this filesystem cannot do that", as opposed to real errors
+_UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.ENOSYS, errno.EMLINK}
+
+
+def _temporary_name(destination):
+    return "{}.{}.tmp".format(destination, os.getpid())
+
+
+def _reflink(source, destination):
+    tmp = _temporary_name(destination)
+    with open(source, 'rb') as src, open(tmp, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(tmp)
+            raise
+    os.replace(tmp, destination)
+
+
+def _hardlink(source, destination):
+    tmp = _temporary_name(destination)
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.link(source, tmp)
+    os.replace(tmp, destination)
+
+
+def _chunked_copy(source, destinations, chunk_size=CHUNK_SIZE, max_workers=None):
+    tmps = [_temporary_name(destination) for destination in destinations]
+    files = [open(tmp, 'wb') for tmp in tmps]
+    try:
+        with open(source, 'rb') as src, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                # file.write releases the GIL, so the destinations are written concurrently
+                list(executor.map(lambda fh: fh.write(chunk), files))
+    finally:
+        for fh in files:
+            fh.close()
+    for tmp, destination in zip(tmps, destinations):
+        shutil.copymode(source, tmp)
+        os.replace(tmp, destination)
+
+
+def fan_out(source, destinations, methods=METHODS, chunk_size=CHUNK_SIZE, max_workers=None):
+    """Copy a (checkpoint) file to many destinations as cheaply as the
+    filesystem allows.
+
+    Parameters
+    ----------
+    source : str
+        path to the file to copy.
+    destinations : list
+        paths to copy the file to. Existing files are replaced.
+    methods : list, optional
+        the methods to try, in order, by default ['reflink', 'hardlink', 'copy']
+    chunk_size : int, optional
+        chunk size in bytes for the 'copy' method, by default 64 MiB
+    max_workers : int, optional
+        number of threads for the 'copy' method, by default chosen by ThreadPoolExecutor
+
+    Returns
+    -------
+    dict
+        {destination: method used}
+    """
+    for method in methods:
+        if method not in METHODS:
+            raise ValueError("{} is not a valid fan out method: choose from {}".format(method, METHODS))
+    if not os.path.isfile(source):
+        raise FileNotFoundError("The checkpoint {} does not exist".format(source))
+
+    used = {}
+    remaining = []
+    for destination in destinations:
+        destination = str(destination)
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            used[destination] = 'hardlink'
+        else:
+            remaining.append(destination)
+    for method in methods:
+        if not remaining:
+            break
+        if method == 'copy':
+            _chunked_copy(source, remaining, chunk_size=chunk_size, max_workers=max_workers)
+            used.update({destination: method for destination in remaining})
+            remaining = []
+            break
+        link = _reflink if method == 'reflink' else _hardlink
+        while remaining:
+            try:
+                link(source, remaining[0])
+            except OSError as error:
+                if error.errno not in _UNSUPPORTED:
+                    raise
+                # The filesystem does not support this method; fall through to the next one
+                break
+            used[remaining.pop(0)] = method
+    if remaining:
+        raise OSError("Could not copy {} to {} with methods {}".format(source, remaining, methods))
+    return used
+
+
+def unshare(path):
+    """Give ``path`` its own copy of the data if it is hardlinked to other
+    files, so it can safely be modified in place.
+
+    Parameters
+    ----------
+    path : str
+        path to the file.
+
+    Returns
+    -------
+    bool
+        True if the file had to be copied.
+    """
+    if os.stat(path).st_nlink < 2:
+        return False
+    tmp = _temporary_name(path)
+    shutil.copy2(path, tmp)
+    os.replace(tmp, path)
+    return True
+
+
+class CheckpointStore():
+    def __init__(self, root):
+        """Content-addressed store for checkpoint files.
+
+        Blobs live in ``<root>/objects/<first two hex digits>/<rest of the sha256>``.
+
+        Parameters
+        ----------
+        root : str
+            directory for the store, e.g. ``<ensemble_dir>/checkpoints``.
+        """
+        self.root = os.path.abspath(str(root))
+        # (device, inode, size, mtime) -> digest, so links to blobs are never hashed twice
+        self._digests = {}
+
+    def get_blob(self, digest):
+        """The path of the blob with the given digest."""
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:])
+
+    def hash(self, path, chunk_size=CHUNK_SIZE):
+        """sha256 of a file, cached by inode so links to the same data are only
+        hashed once per process.
+
+        Parameters
+        ----------
+        path : str
+            path to the file.
+        chunk_size : int, optional
+            read size in bytes, by default 64 MiB
+
+        Returns
+        -------
+        str
+            hex digest.
+        """
+        stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(chunk_size), b''):
+                    sha.update(chunk)
+            self._digests[key] = sha.hexdigest()
+        return self._digests[key]
+
+    def add(self, path):
+        """Register a checkpoint with the store. If the store already has the
+        same data, ``path`` is replaced by a link to the existing blob; otherwise
+        ``path`` becomes the blob.
+
+        Parameters
+        ----------
+        path : str
+            path to the checkpoint.
+
+        Returns
+        -------
+        str
+            the digest of the checkpoint.
+        """
+        path = str(path)
+        digest = self.hash(path)
+        blob = self.get_blob(digest)
+        if os.path.exists(blob):
+            if not os.path.samefile(path, blob):
+                fan_out(blob, [path])
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            fan_out(path, [blob])
+        return digest
+
+    def checkout(self, digest, destinations):
+        """Link (or, if the filesystem cannot, copy) a stored checkpoint into
+        the destinations.
+
+        Parameters
+        ----------
+        digest : str
+            digest returned by ``add``.
+        destinations : list
+            paths to write the checkpoint to.
+
+        Returns
+        -------
+        dict
+            {destination: method used}, see ``fan_out``.
+        """
+        blob = self.get_blob(digest)
+        if not os.path.exists(blob):
+            raise KeyError("There is no checkpoint {} in the store {}".format(digest, self.root))
+        return fan_out(blob, destinations)
+
+    def prune(self, min_age=0.):
+        """Remove blobs that are no longer linked from any phase directory.
+
+        A blob is unused when its link count has dropped back to one. Blobs that
+        were only reflinked or copied out look unused too; removing them is safe
+        because those copies own their data.
+
+        Parameters
+        ----------
+        min_age : float, optional
+            only remove blobs that were last modified at least this many seconds ago, by default 0. The store
+            is shared by the whole ensemble, and a blob that another member has just copied in may not have been
+            checked out yet (see PRUNE_AGE).
+
+        Returns
+        -------
+        list
+            digests of the removed blobs.
+        """
+        removed = []
+        now = time.time()
+        objects = os.path.join(self.root, 'objects')
+        if not os.path.isdir(objects):
+            return removed
+        for prefix in os.listdir(objects):
+            for rest in os.listdir(os.path.join(objects, prefix)):
+                blob = os.path.join(objects, prefix, rest)
+                stat = os.stat(blob)
+                if stat.st_nlink == 1 and not rest.endswith('.tmp') and now - stat.st_mtime >= min_age:
+                    os.remove(blob)
+                    removed.append(prefix + rest)
+        return removed
@@ -0,0 +1,279 @@
+"""Offline analysis of an ensemble from the command line.
+
+    wzm-wzt stats ENSEMBLE_DIR      iteration and phases of every member
+    wzm-wzt work ENSEMBLE_DIR       convergence work and Boltzmann probabilities
+    wzm-wzt targets ENSEMBLE_DIR    target, alpha and phase of every pair
+    wzm-wzt distances ENSEMBLE_DIR --deer-data deer_data.json
+                                    production distances compared with DEER
+    wzm-wzt correlations ENSEMBLE_DIR
+                                    the most strongly correlated pairs of pairs
+
+Only the state files and logs are read (archived iterations included, see
+archive.open_log), so the commands need neither GROMACS, MPI, the tpr nor
+write access to the ensemble (``correlations`` caches its results outside the
+ensemble, see ``--cache``). Members are processed in parallel with a pool of
+``--jobs`` worker processes. Output is tab-separated, or JSON lines with
+``--json``.
+
+Example
+-------
+    $ wzm-wzt work /scratch/ensemble --members 37 --iteration 4
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from wzm_wzt.run_params import State
+from wzm_wzt.archive import list_files, list_iterations
+from wzm_wzt.run_md import work_calculation
+from wzm_wzt import distances
+from wzm_wzt import correlations
+
+
+def find_members(ensemble_dir):
+    """The ensemble members (ensemble_num) that have a state file."""
+    members = []
+    for state_json in glob.glob(os.path.join(str(ensemble_dir), "mem_*", "state.json")):
+        name = os.path.basename(os.path.dirname(state_json))[len("mem_"):]
+        if name.isdigit():
+            members.append(int(name))
+    return sorted(members)
+
+
+def load_state(ensemble_dir, ensemble_num):
+    state_json = os.path.join(str(ensemble_dir), "mem_{}".format(ensemble_num), "state.json")
+    state = State(state_json)
+    state.load_from_json(state_json)
+    return state
+
+
+def find_convergence_logs(ensemble_dir, ensemble_num, iteration):
+    """The convergence logs of one iteration, on disk or archived.
+
+    Returns
+    -------
+    dict
+        {num_test_sites: [log file paths]}, where the paths are the ones the logs had before archiving.
+    """
+    iteration_dir = os.path.join(os.path.abspath(str(ensemble_dir)), "mem_{}".format(ensemble_num), str(iteration))
+    pattern = re.compile(r"^num_test_sites_(\d+)/([0-9]+_[0-9]+)/convergence/\2\.log$")
+    logs = {}
+    for relative_path in list_files(iteration_dir):
+        match = pattern.match(relative_path)
+        if match:
+            logs.setdefault(int(match.group(1)), []).append(os.path.join(iteration_dir, relative_path))
+    return logs
+
+
+def member_stats(ensemble_dir, ensemble_num):
+    """One row for a member: its iteration, production start time and the
+    number of pairs in each phase."""
+    state = load_state(ensemble_dir, ensemble_num)
+    test_sites = state.get("test_sites")
+    phases = [state.get("phase", site_name=name) for name in test_sites]
+    return [{
+        "ensemble_num": ensemble_num,
+        "iteration": state.get("iteration"),
+        "start_time": state.get("start_time"),
+        "test_sites": len(test_sites),
+        "training": phases.count("training"),
+        "convergence": phases.count("convergence"),
+        "production": sum(1 for name in state.pair_params if state.get("phase", site_name=name) == "production"
+                          and state.get("on", site_name=name))
+    }]
+
+
+def member_targets(ensemble_dir, ensemble_num):
+    """One row per pair of a member: phase, target and alpha."""
+    state = load_state(ensemble_dir, ensemble_num)
+    rows = []
+    for name in sorted(state.pair_params):
+        rows.append({
+            "ensemble_num": ensemble_num,
+            "iteration": state.get("iteration"),
+            "site_name": name,
+            "phase": state.get("phase", site_name=name),
+            "target": state.get("target", site_name=name),
+            "alpha": state.get("alpha", site_name=name),
+            "on": state.get("on", site_name=name),
+            "testing": state.get("testing", site_name=name)
+        })
+    return rows
+
+
+def member_work(ensemble_dir, ensemble_num, iteration=None):
+    """One row per converged site of a member: work and Boltzmann probability,
+    for every round of test sites of one iteration (or all iterations)."""
+    if iteration is None:
+        iterations = list_iterations(os.path.join(str(ensemble_dir), "mem_{}".format(ensemble_num)))
+    else:
+        iterations = [iteration]
+    rows = []
+    for current in iterations:
+        for num_test_sites, log_files in sorted(find_convergence_logs(ensemble_dir, ensemble_num, current).items(),
+                                                reverse=True):
+            work, probs = work_calculation(log_files)
+            for site_name in sorted(work):
+                rows.append({
+                    "ensemble_num": ensemble_num,
+                    "iteration": current,
+                    "num_test_sites": num_test_sites,
+                    "site_name": site_name,
+                    "work": float(work[site_name]),
+                    "probability": float(probs[site_name])
+                })
+    return rows
+
+
+COMMANDS = {
+    "stats": (member_stats, "iteration, production start time and the number of pairs in each phase"),
+    "work": (member_work, "convergence work and Boltzmann probabilities"),
+    "targets": (member_targets, "target, alpha and phase of every pair"),
+}
+
+
+def _run_member(arguments):
+    # Top-level, so that it can be sent to the worker processes
+    command, ensemble_dir, ensemble_num, kwargs = arguments
+    return COMMANDS[command][0](ensemble_dir, ensemble_num, **kwargs)
+
+
+def collect(command, ensemble_dir, members=None, jobs=1, **kwargs):
+    """Run a command for several members, in parallel if ``jobs`` > 1.
+
+    Returns
+    -------
+    list
+        the rows of every member, in member order.
+    """
+    members = find_members(ensemble_dir) if members is None else members
+    tasks = [(command, ensemble_dir, ensemble_num, kwargs) for ensemble_num in members]
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            results = list(executor.map(_run_member, tasks))
+    else:
+        results = list(map(_run_member, tasks))
+    return [row for result in results for row in result]
+
+
+def ensemble_distances(ensemble_dir, deer_data, members=None, jobs=1, iteration=None):
+    """One row per pair: the divergence of the ensemble's production distances
+    from the DEER distribution (see distances.compare).
+
+    Parameters
+    ----------
+    deer_data : str
+        the DEER data json.
+    """
+    # Read directly: MetaData.get returns lists sorted, which would scramble the distribution
+    deer_data = json.load(open(deer_data))
+    members = find_members(ensemble_dir) if members is None else members
+    histograms = distances.ensemble_histograms(ensemble_dir,
+                                               deer_data["bins"],
+                                               members=members,
+                                               iteration=iteration,
+                                               jobs=jobs)
+    return distances.compare(histograms, deer_data["distribution"])
+
+
+def ensemble_correlations(ensemble_dir, members=None, jobs=1, top=20, output=None, cache_dir=None, **kwargs):
+    """The most strongly correlated pairs of pairs (see
+    correlations.strongest_correlations), after bringing every member's
+    cached accumulator up to date.
+
+    Parameters
+    ----------
+    output : str, optional
+        also save the merged accumulator here.
+    cache_dir : str, optional
+        where to cache the members' accumulators, by default correlations.get_cache_dir(ensemble_dir)
+    kwargs
+        passed to correlations.update_member.
+    """
+    accumulator = correlations.ensemble_correlations(ensemble_dir,
+                                                     members=members,
+                                                     jobs=jobs,
+                                                     cache_dir=cache_dir or correlations.get_cache_dir(ensemble_dir),
+                                                     **kwargs)
+    if accumulator is None:
+        return []
+    if output:
+        accumulator.save(output)
+    return correlations.strongest_correlations(accumulator, top=top)
+
+
+def write_rows(rows, stream, as_json=False):
+    if as_json:
+        for row in rows:
+            stream.write(json.dumps(row) + "\n")
+        return
+    if not rows:
+        return
+    columns = list(rows[0])
+    stream.write("\t".join(columns) + "\n")
+    for row in rows:
+        stream.write("\t".join(str(row[column]) for column in columns) + "\n")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="wzm-wzt", description="Offline analysis of a Wzm-Wzt BRER ensemble.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    descriptions = {command: description for command, (_, description) in COMMANDS.items()}
+    descriptions["distances"] = "divergence of the production distances of every pair from the DEER distribution"
+    descriptions["correlations"] = "the most strongly correlated pairs of pairs in production"
+    for command, description in descriptions.items():
+        subparser = subparsers.add_parser(command, help=description, description=description)
+        subparser.add_argument("ensemble_dir", help="the top-level ensemble directory")
+        subparser.add_argument("-m", "--members", type=int, nargs="+", help="ensemble members, by default all")
+        subparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+        subparser.add_argument("--json", action="store_true", help="write JSON lines instead of a table")
+        if command in ["work", "distances"]:
+            subparser.add_argument("-i", "--iteration", type=int, help="only this iteration, by default all")
+        if command == "distances":
+            subparser.add_argument("--deer-data", required=True, help="the DEER data json")
+        if command == "correlations":
+            subparser.add_argument("--top", type=int, default=20, help="number of pairs of pairs to show")
+            subparser.add_argument("--float32", action="store_true", help="store new co-moment matrices as float32")
+            subparser.add_argument("--include-current", action="store_true", help="include the running iteration")
+            subparser.add_argument("-o", "--output", help="also save the merged accumulator (.npz)")
+            subparser.add_argument("--cache",
+                                   help="where to keep each member's accumulator, by default under ~/.cache/wzm-wzt")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.command == "distances":
+        rows = ensemble_distances(args.ensemble_dir,
+                                  args.deer_data,
+                                  members=args.members,
+                                  jobs=args.jobs,
+                                  iteration=args.iteration)
+    elif args.command == "correlations":
+        rows = ensemble_correlations(args.ensemble_dir,
+                                     members=args.members,
+                                     jobs=args.jobs,
+                                     top=args.top,
+                                     output=args.output,
+                                     cache_dir=args.cache,
+                                     dtype="float32" if args.float32 else "float64",
+                                     include_current=args.include_current)
+    else:
+        kwargs = {"iteration": args.iteration} if args.command == "work" else {}
+        rows = collect(args.command, args.ensemble_dir, members=args.members, jobs=args.jobs, **kwargs)
+    try:
+        write_rows(rows, sys.stdout, as_json=args.json)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader went away (e.g. ``| head``); keep Python from complaining again at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Typed collectives for the values the ranks of an ensemble member agree on.
+
+mpi4py's lowercase ``bcast`` pickles its argument on the root and unpickles it
+on every other rank, and needs an extra message for the size. The values the
+ranks exchange are small and have a known type (a target, a start time, the
+chosen site), so they are sent here with the uppercase, buffer-based
+collectives on preallocated numpy arrays instead. Strings that every rank
+already knows (site names) are sent as their index in a list every rank has;
+other strings are encoded into a fixed-width byte buffer.
+
+``bcast_decisions`` sends everything that is decided at the end of a
+convergence phase (the selected site, the production start time and the pruned
+sites) in a single broadcast.
+
+mpi4py initializes MPI when it is imported, so it is only imported once a
+communicator is actually needed (see get_comm). Analysis code that only reads
+states, logs or the catalog does not need MPI at all.
+"""
+
+import numpy as np
+
+STRING_WIDTH = 1024  # bytes
+_HEADER = 8  # the first 8 bytes of a string buffer hold its length
+
+
+def get_comm(comm=None):
+    """``comm``, or MPI.COMM_WORLD if it is None (importing mpi4py, and so
+    initializing MPI, only then)."""
+    if comm is not None:
+        return comm
+    from mpi4py import MPI
+    return MPI.COMM_WORLD
+
+
+def bcast_array(array, comm, root=0):
+    """Broadcast a numpy array in place. Every rank must pass an array of the
+    same shape and dtype.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``array``, now holding the root's values.
+    """
+    comm.Bcast(array, root=root)
+    return array
+
+
+def bcast_float(value, comm, root=0):
+    """Broadcast a single float (the value on other ranks is ignored)."""
+    buffer = np.array([value if comm.Get_rank() == root else 0.], dtype=np.float64)
+    return float(bcast_array(buffer, comm, root=root)[0])
+
+
+def bcast_int(value, comm, root=0):
+    """Broadcast a single integer (the value on other ranks is ignored)."""
+    buffer = np.array([value if comm.Get_rank() == root else 0], dtype=np.int64)
+    return int(bcast_array(buffer, comm, root=root)[0])
+
+
+def bcast_string(value, comm, root=0, width=STRING_WIDTH):
+    """Broadcast a string of at most ``width`` bytes (UTF-8).
+
+    Raises
+    ------
+    ValueError
+        on every rank, if the root's string does not fit.
+    """
+    buffer = np.zeros(_HEADER + width, dtype=np.uint8)
+    header = buffer[:_HEADER].view(np.int64)
+    if comm.Get_rank() == root:
+        encoded = value.encode("utf-8")
+        if len(encoded) > width:
+            header[0] = -len(encoded)
+        else:
+            header[0] = len(encoded)
+            buffer[_HEADER:_HEADER + len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+    bcast_array(buffer, comm, root=root)
+    length = int(header[0])
+    if length < 0:
+        raise ValueError("Cannot broadcast a string of {} bytes: the limit is {}".format(-length, width))
+    return buffer[_HEADER:_HEADER + length].tobytes().decode("utf-8")
+
+
+def bcast_choice(choice, options, comm, root=0):
+    """Broadcast one of ``options`` (which every rank must have, in the same
+    order) as its index.
+
+    Returns
+    -------
+    object
+        the root's choice, or None if the root chose None.
+    """
+    index = options.index(choice) if comm.Get_rank() == root and choice is not None else -1
+    index = bcast_int(index, comm, root=root)
+    return options[index] if index >= 0 else None
+
+
+def bcast_decisions(comm, sites, selected=None, start_time=0., pruned=(), root=0):
+    """Broadcast the end-of-convergence decisions in one message.
+
+    Parameters
+    ----------
+    comm : mpi4py.MPI.Comm
+        the member's communicator.
+    sites : list
+        the test sites, the same (sorted) list on every rank.
+    selected : str, optional
+        the site to restrain in production (root only).
+    start_time : float, optional
+        the production start time (root only), by default 0.
+    pruned : list, optional
+        the pruned sites (root only).
+
+    Returns
+    -------
+    tuple
+        (selected, start_time, pruned) as decided on the root.
+    """
+    buffer = np.zeros(2 + len(sites), dtype=np.float64)
+    if comm.Get_rank() == root:
+        buffer[0] = sites.index(selected) if selected is not None else -1
+        buffer[1] = start_time
+        for site in pruned:
+            buffer[2 + sites.index(site)] = 1
+    bcast_array(buffer, comm, root=root)
+    index = int(buffer[0])
+    selected = sites[index] if index >= 0 else None
+    return selected, float(buffer[1]), [site for site, flag in zip(sites, buffer[2:]) if flag]
+
+
+def allreduce_values(values, sites, comm):
+    """Combine per-site values when every site was handled by exactly one rank.
+
+    Parameters
+    ----------
+    values : dict
+        {site: value} for the sites this rank handled.
+    sites : list
+        all the sites, the same (sorted) list on every rank.
+    comm : mpi4py.MPI.Comm
+        the member's communicator.
+
+    Returns
+    -------
+    dict
+        {site: value} for every site that any rank handled.
+    """
+    from mpi4py import MPI
+
+    buffer = np.zeros((2, len(sites)), dtype=np.float64)
+    for site, value in values.items():
+        buffer[0, sites.index(site)] = value
+        buffer[1, sites.index(site)] = 1
+    comm.Allreduce(MPI.IN_PLACE, buffer, op=MPI.SUM)
+    return {site: float(value) for site, value, count in zip(sites, buffer[0], buffer[1]) if count}
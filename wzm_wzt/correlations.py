@@ -0,0 +1,384 @@
+"""Correlations between the restraint distances of different pairs.
+
+Each production run logs the distance R of every pair it restrains, at the
+same times for all of them, so a run gives a (frames x pairs) sample of the
+joint distribution of those distances. Runs restrain different pairs (in each
+round of test sites, only the pairs selected so far are restrained), so the
+statistics are kept for every pair of variables (i, j) separately, over the
+samples in which both were logged ("pairwise complete"):
+
+    N[i, j]  the number of joint samples
+    A[i, j]  the mean of i over them
+    C[i, j]  the co-moment of i and j over them (the covariance times N - 1)
+    V[i, j]  the co-moment of i with itself over them
+
+A batch of samples (a run), or another accumulator, is added with the batch
+form of Welford's algorithm, i.e. Chan et al.'s parallel update, applied
+elementwise:
+
+    n = N + N'
+    D = A' - A
+    C += C' + D * D.T * N * N' / n
+    V += V' + D ** 2 * N * N' / n
+    A += D * N' / n
+
+Each update only needs these statistics, not the data, so every member is
+processed on its own and the results are merged.
+
+The four pairs x pairs matrices dominate the memory use (N is int64; A, C and
+V can be stored as float32). They are updated in blocks of ``block_size``
+rows, so the temporaries stay small even for thousands of pairs. Every block
+is computed in float64 before it is stored.
+
+The logs of a run are read together, a chunk of frames at a time, and every
+chunk is one update, so memory use does not depend on the length of the logs.
+
+The ensemble is only read. Each member's accumulator can be cached outside it
+(see get_cache_dir), together with the production runs it already includes;
+update_member then only reads production runs that are not in the cache yet.
+Runs of the member's current iteration are still being written and are left
+out.
+"""
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from wzm_wzt.archive import list_files, list_iterations
+from wzm_wzt.distances import read_column, CHUNK_SIZE
+
+CACHE_FILENAME = "mem_{}.npz"
+BLOCK_SIZE = 1024  # rows of the matrices updated at once
+
+
+class CovarianceAccumulator():
+    def __init__(self, names, dtype=np.float64, block_size=BLOCK_SIZE):
+        """Streaming pairwise-complete covariance of a set of variables.
+
+        Parameters
+        ----------
+        names : list
+            the variables (pair names).
+        dtype : numpy.dtype, optional
+            storage for the means and co-moments, by default float64; float32 halves their memory.
+        block_size : int, optional
+            number of rows of the matrices to update at once, by default 1024
+        """
+        self.names = list(names)
+        self.block_size = block_size
+        self._index = {name: i for i, name in enumerate(self.names)}
+        size = len(self.names)
+        self.count = np.zeros((size, size), dtype=np.int64)
+        self.mean = np.zeros((size, size), dtype=dtype)
+        self.comoment = np.zeros((size, size), dtype=dtype)
+        self.variance_comoment = np.zeros((size, size), dtype=dtype)
+        # Where the data came from, so that it is not added twice
+        self.sources = []
+
+    def _combine(self, indices, other_block):
+        """Chan's update of the statistics of the variables ``indices``.
+
+        ``other_block(rows)`` gives the other statistics (N', A', A'.T, C', V')
+        for the variables ``indices[rows]`` (rows) and ``indices`` (columns),
+        as float64 arrays or anything that broadcasts to them.
+        """
+        blocks = [
+            slice(start, min(start + self.block_size, len(indices)))
+            for start in range(0, len(indices), self.block_size)
+        ]
+        # The co-moments need the old means of both variables, so the means change in a second pass
+        for rows in blocks:
+            block, transposed = np.ix_(indices[rows], indices), np.ix_(indices, indices[rows])
+            count_b, mean_b, mean_t_b, comoment_b, variance_b = other_block(rows)
+            count_a = self.count[block]
+            total = count_a + count_b
+            weight = count_a * count_b / np.maximum(total, 1)
+            delta = mean_b - self.mean[block]
+            delta_t = mean_t_b - self.mean[transposed].T
+            self.comoment[block] += (comoment_b + delta * delta_t * weight).astype(self.comoment.dtype)
+            self.variance_comoment[block] += (variance_b + delta**2 * weight).astype(self.comoment.dtype)
+        for rows in blocks:
+            block = np.ix_(indices[rows], indices)
+            count_b, mean_b = other_block(rows)[:2]
+            total = self.count[block] + count_b
+            fraction = count_b / np.maximum(total, 1)
+            self.mean[block] += ((mean_b - self.mean[block]) * fraction).astype(self.mean.dtype)
+            self.count[block] = total
+
+    def update(self, data, names=None, source=None):
+        """Add a batch of joint samples.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            (samples x variables).
+        names : list, optional
+            the variables of the columns of ``data``, by default all of them in order.
+        source : str, optional
+            recorded in ``sources``.
+        """
+        data = np.asarray(data)
+        names = self.names if names is None else list(names)
+        if data.ndim != 2 or data.shape[1] != len(names):
+            raise ValueError("Expected data with {} columns, got shape {}".format(len(names), data.shape))
+        if len(data):
+            indices = np.array([self._index[name] for name in names], dtype=np.int64)
+            mean = data.mean(axis=0, dtype=np.float64)
+            centered = data - mean  # float64
+            squares = np.einsum("ij,ij->j", centered, centered, dtype=np.float64)
+
+            def batch_block(rows):
+                return len(data), mean[rows, None], mean[None, :], centered[:, rows].T @ centered, squares[rows, None]
+
+            self._combine(indices, batch_block)
+        if source is not None:
+            self.sources.append(source)
+        return self
+
+    def merge(self, other):
+        """Add the statistics of another accumulator over the same variables."""
+        if other.names != self.names:
+            raise ValueError("Cannot merge accumulators over different variables")
+        indices = np.arange(len(self.names))
+
+        def other_block(rows):
+            block, transposed = np.ix_(indices[rows], indices), np.ix_(indices, indices[rows])
+            return (other.count[block], other.mean[block].astype(np.float64),
+                    other.mean[transposed].T.astype(np.float64), other.comoment[block].astype(np.float64),
+                    other.variance_comoment[block].astype(np.float64))
+
+        self._combine(indices, other_block)
+        self.sources.extend(other.sources)
+        return self
+
+    def get_covariance(self, ddof=1):
+        """The covariance of every pair of variables over their joint samples
+        (nan where there are not enough)."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.count > ddof, self.comoment / (self.count - ddof), np.nan)
+
+    def get_correlation(self):
+        """The Pearson correlation of every pair of variables over their joint
+        samples (nan where there are none, or a variable did not change)."""
+        variance = self.variance_comoment.astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = self.comoment / np.sqrt(variance * variance.T)
+        return np.clip(np.where(self.count > 1, correlation, np.nan), -1., 1.)
+
+    def save(self, filename):
+        """Save to a .npz file (replaced atomically)."""
+        tmp = "{}.tmp.npz".format(filename)
+        np.savez(tmp,
+                 names=np.array(self.names, dtype=str),
+                 count=self.count,
+                 mean=self.mean,
+                 comoment=self.comoment,
+                 variance_comoment=self.variance_comoment,
+                 sources=np.array(self.sources, dtype=str),
+                 block_size=self.block_size)
+        os.replace(tmp, str(filename))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(str(filename)) as data:
+            accumulator = cls([], block_size=int(data["block_size"]))
+            accumulator.names = data["names"].tolist()
+            accumulator._index = {name: i for i, name in enumerate(accumulator.names)}
+            for key in ["count", "mean", "comoment", "variance_comoment"]:
+                setattr(accumulator, key, data[key])
+            accumulator.sources = data["sources"].tolist()
+        return accumulator
+
+
+def read_production_run(log_files, dtype=np.float32, chunk_size=CHUNK_SIZE):
+    """Read the distances of every pair in one production run, all logs
+    together, in chunks.
+
+    Parameters
+    ----------
+    log_files : dict
+        {pair name: production log}; the logs of one run share their sample times.
+    dtype : numpy.dtype, optional
+        by default float32
+    chunk_size : int, optional
+        the number of frames per chunk, by default 65536
+
+    Yields
+    ------
+    numpy.ndarray
+        (frames x pairs) in the order of ``sorted(log_files)``. If a log is shorter than the others (e.g. a line
+        that was still being written), the run ends where it does.
+    """
+    readers = [read_column(log_files[name], chunk_size=chunk_size) for name in sorted(log_files)]
+    for columns in zip(*readers):
+        frames = min(len(column) for column in columns)
+        chunk = np.empty((frames, len(columns)), dtype=dtype)
+        for i, column in enumerate(columns):
+            chunk[:, i] = column[:frames]
+        yield chunk
+        if frames < max(len(column) for column in columns):
+            return
+
+
+def find_production_runs(member_dir, iterations):
+    """The production runs of some iterations of a member, on disk or
+    archived.
+
+    Returns
+    -------
+    dict
+        {'<iteration>/num_test_sites_<k>': {pair name: log file}}
+    """
+    pattern = re.compile(r"^(num_test_sites_\d+)/production/([0-9]+_[0-9]+)\.log$")
+    runs = {}
+    for iteration in iterations:
+        iteration_dir = os.path.join(os.path.abspath(str(member_dir)), str(iteration))
+        for relative_path in list_files(iteration_dir):
+            match = pattern.match(relative_path)
+            if match:
+                run = "{}/{}".format(iteration, match.group(1))
+                runs.setdefault(run, {})[match.group(2)] = os.path.join(iteration_dir, relative_path)
+    return runs
+
+
+def get_cache_dir(ensemble_dir):
+    """The default directory for the accumulators of an ensemble's members:
+    outside the ensemble, under $XDG_CACHE_HOME (by default ~/.cache), one
+    directory per ensemble path."""
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    digest = hashlib.sha1(os.path.abspath(str(ensemble_dir)).encode()).hexdigest()[:16]
+    return os.path.join(root, "wzm-wzt", "correlations", digest)
+
+
+def update_member(ensemble_dir,
+                  ensemble_num,
+                  cache_dir=None,
+                  dtype=np.float64,
+                  block_size=BLOCK_SIZE,
+                  include_current=False,
+                  chunk_size=CHUNK_SIZE):
+    """The correlations of a member's production runs. With a cache, only the
+    runs that are not in the member's cached accumulator yet are read, and the
+    cache is updated.
+
+    Parameters
+    ----------
+    ensemble_dir : str
+        the top-level ensemble directory (only read).
+    ensemble_num : int
+        the member.
+    cache_dir : str, optional
+        keep the member's accumulator in ``<cache_dir>/mem_<n>.npz`` (see get_cache_dir), by default read every
+        run every time.
+    dtype, block_size
+        see CovarianceAccumulator; only used when the accumulator is created.
+    include_current : bool, optional
+        also read the runs of the current iteration (which may still be running), by default False. They are
+        not cached, so they are read again next time.
+    chunk_size : int, optional
+        the number of frames read (from every log of a run) at a time, by default 65536
+
+    Returns
+    -------
+    CovarianceAccumulator
+        everything the member has produced so far.
+    """
+    member_dir = os.path.join(str(ensemble_dir), "mem_{}".format(ensemble_num))
+    filename = os.path.join(str(cache_dir), CACHE_FILENAME.format(ensemble_num)) if cache_dir else None
+    state = json.load(open(os.path.join(member_dir, "state.json")))
+    if filename and os.path.exists(filename):
+        accumulator = CovarianceAccumulator.load(filename)
+    else:
+        accumulator = CovarianceAccumulator(sorted(state["pair_parameters"]), dtype=dtype, block_size=block_size)
+    done = set(accumulator.sources)
+
+    current = state["general_parameters"]["iteration"]
+    iterations = [iteration for iteration in list_iterations(member_dir) if iteration <= current]
+    runs = find_production_runs(member_dir, iterations)
+    partial = None
+    for run in sorted(runs, key=lambda run: (int(run.split("/")[0]), run)):
+        finished = int(run.split("/")[0]) < current
+        if run in done or not (finished or include_current):
+            continue
+        if finished:
+            target = accumulator
+        else:
+            if partial is None:
+                partial = CovarianceAccumulator(accumulator.names, block_size=block_size)
+            target = partial
+        names = sorted(runs[run])
+        for chunk in read_production_run(runs[run], dtype=accumulator.mean.dtype, chunk_size=chunk_size):
+            target.update(chunk, names=names)
+        if finished:
+            accumulator.sources.append(run)
+    if filename:
+        os.makedirs(str(cache_dir), exist_ok=True)
+        accumulator.save(filename)
+    if partial is not None:
+        accumulator.merge(partial)
+    return accumulator
+
+
+def _update_member(arguments):
+    # Top-level, so that it can be sent to the worker processes
+    ensemble_dir, ensemble_num, kwargs = arguments
+    return update_member(ensemble_dir, ensemble_num, **kwargs)
+
+
+def ensemble_correlations(ensemble_dir, members=None, jobs=1, **kwargs):
+    """Update every member (see update_member) and merge them.
+
+    Parameters
+    ----------
+    ensemble_dir : str
+        the top-level ensemble directory.
+    members : list, optional
+        by default every member with a state file.
+    jobs : int, optional
+        update members in this many worker processes, by default 1
+    kwargs
+        passed to update_member.
+
+    Returns
+    -------
+    CovarianceAccumulator
+        the whole ensemble, or None if there are no members.
+    """
+    if members is None:
+        members = sorted(
+            int(name[len("mem_"):]) for name in os.listdir(str(ensemble_dir))
+            if name.startswith("mem_") and name[len("mem_"):].isdigit()
+            and os.path.exists(os.path.join(str(ensemble_dir), name, "state.json")))
+    tasks = [(ensemble_dir, ensemble_num, kwargs) for ensemble_num in members]
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            results = list(executor.map(_update_member, tasks))
+    else:
+        results = list(map(_update_member, tasks))
+
+    merged = None
+    for ensemble_num, accumulator in zip(members, results):
+        accumulator.sources = ["mem_{}/{}".format(ensemble_num, source) for source in accumulator.sources]
+        merged = accumulator if merged is None else merged.merge(accumulator)
+    return merged
+
+
+def strongest_correlations(accumulator, top=20):
+    """The most strongly (anti-)correlated pairs of pairs.
+
+    Returns
+    -------
+    list
+        dictionaries with site_a, site_b and correlation, by decreasing absolute correlation.
+    """
+    correlation = accumulator.get_correlation()
+    rows, columns = np.triu_indices(len(accumulator.names), k=1)
+    values = correlation[rows, columns]
+    order = np.argsort(-np.nan_to_num(np.abs(values), nan=-1.), kind="stable")[:top]
+    return [{
+        "site_a": accumulator.names[rows[i]],
+        "site_b": accumulator.names[columns[i]],
+        "correlation": float(values[i])
+    } for i in order]
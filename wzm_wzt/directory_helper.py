@@ -42,11 +42,60 @@ How the directory structure is organized:
         │   └── training
         ├── production              # run a *SINGLE* production phase once you decide which pair to restrain.
         └── work.json               # store work calculation data
+
+All of the directories are also available as absolute ``pathlib.Path`` objects
+(see ``DirectoryHelper.get_path``), so callers never need to change the working
+directory of the process.
+
+Layouts are cached: ``get_directory_helper`` returns the same DirectoryHelper
+for the same (member, iteration, test sites), and directories that have already
+been created are remembered, so repeated calls to ``build_working_dir`` do not
+touch the filesystem.
 """
 
 import os
+import pathlib
 from wzm_wzt.metadata import site_to_str
 
+PHASES = ['training', 'convergence']
+
+# Layout manifests by (top_dir, ensemble_num, iteration, num_test_sites, test sites)
+_layouts = {}
+# Directories that have been created (or found to exist) by this process
+_existing_dirs = set()
+
+
+def get_directory_helper(top_dir, param_dict):
+    """Get the (cached) DirectoryHelper for a layout.
+
+    Parameters
+    ----------
+    top_dir :
+        the path to the directory containing all the ensemble members.
+    param_dict :
+        a dictionary specifying the ensemble number, the iteration, and the test sites (see DirectoryHelper).
+
+    Returns
+    -------
+    DirectoryHelper
+    """
+    for required in ['ensemble_num', 'iteration', 'test_sites']:
+        if required not in param_dict:
+            raise KeyError('Must define {}'.format(required))
+    test_sites = tuple(site if type(site) == str else site_to_str(site) for site in param_dict['test_sites'])
+    key = (os.path.abspath(str(top_dir)), param_dict['ensemble_num'], param_dict['iteration'],
+           param_dict.get('num_test_sites', len(test_sites)), test_sites)
+    if key not in _layouts:
+        _layouts[key] = DirectoryHelper(top_dir, dict(param_dict))
+    return _layouts[key]
+
+
+def clear_directory_cache():
+    """Forget all cached layouts and created directories, e.g. after directories
+    have been removed from outside this process."""
+    _layouts.clear()
+    _existing_dirs.clear()
+
 
 class DirectoryHelper():
     def __init__(self, top_dir, param_dict):
@@ -72,6 +121,74 @@ class DirectoryHelper():
             self._param_dict['num_test_sites'] = param_dict['num_test_sites']
         else:
             self._param_dict['num_test_sites'] = len(self._param_dict['test_sites'])
+        self._paths = self._build_paths()
+        self._manifest = [
+            self.get_path('phase', test_site=site_name, phase=phase) for site_name in self.get_site_names()
+            for phase in PHASES
+        ] + [self.get_path('production')]
+
+    def _build_paths(self):
+        """Precompute the absolute path of every level, test site and phase."""
+        pdict = self._param_dict
+        top = pathlib.Path(os.path.abspath(str(self._top_dir)))
+        num_test_sites = top / 'mem_{}'.format(pdict['ensemble_num']) / '{}'.format(
+            pdict['iteration']) / 'num_test_sites_{}'.format(pdict['num_test_sites'])
+        paths = {
+            ('top', None, None): top,
+            ('ensemble_num', None, None): num_test_sites.parent.parent,
+            ('iteration', None, None): num_test_sites.parent,
+            ('num_test_sites', None, None): num_test_sites,
+            ('production', None, None): num_test_sites / 'production'
+        }
+        for site_name in self.get_site_names():
+            paths[('test_site', site_name, None)] = num_test_sites / site_name
+            for phase in PHASES:
+                paths[('phase', site_name, phase)] = num_test_sites / site_name / phase
+        return paths
+
+    def get_site_names(self):
+        """The names of the test sites (see metadata.site_to_str)."""
+        return [site if type(site) == str else site_to_str(site) for site in self._param_dict['test_sites']]
+
+    def get_path(self, level, test_site=None, phase=None):
+        """Get the absolute path for however far you want to go down the
+        directory tree. Unlike ``change_dir``, this does not touch the working
+        directory of the process.
+
+        Parameters
+        ----------
+        level : str
+            one of 'top', 'ensemble_num', 'iteration', 'num_test_sites', 'production', 'test_site' or 'phase'.
+        test_site : str, optional
+            the test site; required for the 'test_site' and 'phase' levels.
+        phase : str, optional
+            the phase; required for the 'phase' level.
+
+        Returns
+        -------
+        pathlib.Path
+            the absolute path to the specified directory.
+        """
+        if level == 'test_site':
+            if not test_site:
+                raise ValueError("You must provide a test site name to get the appropriate directory")
+            key = (level, test_site, None)
+        elif level == 'phase':
+            if not test_site or not phase:
+                raise ValueError("You must provide a test site name ({}) and the phase ({}) to get the appropriate "
+                                 "directory".format(test_site, phase))
+            key = (level, test_site, phase)
+        else:
+            key = (level, None, None)
+
+        if key not in self._paths:
+            if level == 'test_site':
+                self._paths[key] = self._paths[('num_test_sites', None, None)] / test_site
+            elif level == 'phase':
+                self._paths[key] = self._paths[('num_test_sites', None, None)] / test_site / phase
+            else:
+                raise ValueError('{} is not a valid directory type for BRER simulations'.format(level))
+        return self._paths[key]
 
     def get_dir(self, level, test_site=None, phase=None):
         """Get the directory for however far you want to go down the directory
@@ -116,19 +233,28 @@ class DirectoryHelper():
             raise ValueError('{} is not a valid directory type for BRER simulations'.format('type'))
         return return_dir
 
+    def get_manifest(self):
+        """All of the working directories (every test site and phase, plus
+        production) for this layout.
+
+        Returns
+        -------
+        list
+            list of absolute pathlib.Path objects.
+        """
+        return list(self._manifest)
+
     def build_working_dir(self):
         """Checks to see if the working directory for current state of BRER
         simulation exists. If it does not, creates the directory.
-        """
 
-        for site in self._param_dict['test_sites']:
-            if type(site) != str:
-                site_name = site_to_str(site)
-            else:
-                site_name = site
-            for phase in ['training', 'convergence']:
-                os.makedirs(self.get_dir(level='phase', test_site=site_name, phase=phase), exist_ok=True)
-        os.makedirs('{}/production'.format(self.get_dir('num_test_sites')), exist_ok=True)
+        Directories this process has already created are skipped without any
+        filesystem calls.
+        """
+        for path in self._manifest:
+            if path not in _existing_dirs:
+                os.makedirs(path, exist_ok=True)
+                _existing_dirs.add(path)
 
     def change_dir(self, level, test_site=None, phase=None):
         """Change directory to the directory specified by 'level'
@@ -144,4 +270,4 @@ class DirectoryHelper():
                 test_site, phase))
         if level == 'test_site' and not test_site:
             raise ValueError('You must provide a test site.')
-        os.chdir(self.get_dir(level, test_site=test_site, phase=phase))
+        os.chdir(self.get_path(level, test_site=test_site, phase=phase))
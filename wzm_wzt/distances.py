@@ -0,0 +1,228 @@
+"""Ensemble restraint-distance histograms compared with the DEER distribution.
+
+The restraint distance R of every pair is recorded in the production logs
+(``mem_<n>/<iteration>/num_test_sites_<k>/production/<site>.log``). The logs
+are read in fixed-size chunks and accumulated into one histogram per pair on
+the DEER grid (the ``bins`` of deer_data.json), so memory use does not depend
+on the length of the logs or the size of the ensemble. The DEER bins are
+evenly spaced distances and each one is taken as the centre of its histogram
+bin, so the bin of a value is found by arithmetic rather than by searching.
+
+Each pair's histogram is compared with the DEER distribution with the
+Jensen-Shannon and Kullback-Leibler divergences (in nats).
+
+Example
+-------
+>>> histograms = ensemble_histograms(ensemble_dir, bins, jobs=8)
+>>> for row in compare(histograms, distribution):
+...     print(row["site_name"], row["js_divergence"])
+"""
+
+import os
+import re
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from wzm_wzt.archive import open_log, list_files, list_iterations
+
+CHUNK_SIZE = 65536  # lines
+EPSILON = 1e-10  # added to empty bins, so that the KL divergence stays finite
+
+
+class DistanceHistogram():
+    def __init__(self, bins):
+        """A histogram on an evenly spaced grid of bin centres.
+
+        Parameters
+        ----------
+        bins : list
+            the bin centres, e.g. the 'bins' of deer_data.json.
+
+        Raises
+        ------
+        ValueError
+            if the bins are not evenly spaced.
+        """
+        self.bins = np.asarray(bins, dtype=np.float64)
+        if self.bins.size < 2:
+            raise ValueError("A histogram needs at least two bins")
+        self.width = (self.bins[-1] - self.bins[0]) / (self.bins.size - 1)
+        if not np.allclose(np.diff(self.bins), self.width):
+            raise ValueError("The bins are not evenly spaced")
+        self.counts = np.zeros(self.bins.size, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def add(self, values):
+        """Add an array of distances."""
+        indices = np.floor((np.asarray(values, dtype=np.float64) - self.bins[0]) / self.width + 0.5)
+        below, above = indices < 0, indices >= self.bins.size
+        self.underflow += int(np.count_nonzero(below))
+        self.overflow += int(np.count_nonzero(above))
+        self.counts += np.bincount(indices[~(below | above)].astype(np.int64), minlength=self.bins.size)
+
+    def merge(self, other):
+        """Add the counts of another histogram on the same grid."""
+        if not np.array_equal(self.bins, other.bins):
+            raise ValueError("Cannot merge histograms on different grids")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def get_total(self):
+        """The number of values added, including those outside the grid."""
+        return int(self.counts.sum()) + self.underflow + self.overflow
+
+    def get_probabilities(self):
+        """The normalized histogram (of the values on the grid)."""
+        total = self.counts.sum()
+        return self.counts / total if total else np.zeros(self.bins.size)
+
+
+def read_column(log_file, column=1, chunk_size=CHUNK_SIZE):
+    """Read one column of a BRER log (R by default) in chunks.
+
+    Yields
+    ------
+    numpy.ndarray
+        the values of up to ``chunk_size`` lines.
+    """
+    with open_log(log_file) as fh:
+        fh.readline()  # the header
+        while True:
+            lines = list(itertools.islice(fh, chunk_size))
+            if not lines:
+                return
+            yield np.loadtxt(lines, usecols=column, ndmin=1)
+
+
+def find_production_logs(member_dir, iteration=None):
+    """The production logs of a member (on disk or archived), by site.
+
+    Returns
+    -------
+    dict
+        {site name: [log file paths]}
+    """
+    pattern = re.compile(r"^num_test_sites_\d+/production/([0-9]+_[0-9]+)\.log$")
+    iterations = list_iterations(member_dir) if iteration is None else [iteration]
+    logs = {}
+    for current in iterations:
+        iteration_dir = os.path.join(os.path.abspath(str(member_dir)), str(current))
+        for relative_path in list_files(iteration_dir):
+            match = pattern.match(relative_path)
+            if match:
+                logs.setdefault(match.group(1), []).append(os.path.join(iteration_dir, relative_path))
+    return logs
+
+
+def member_histograms(ensemble_dir, ensemble_num, bins, iteration=None, chunk_size=CHUNK_SIZE):
+    """Histograms of the production distances of one member.
+
+    Returns
+    -------
+    dict
+        {site name: DistanceHistogram}
+    """
+    member_dir = os.path.join(str(ensemble_dir), "mem_{}".format(ensemble_num))
+    histograms = {}
+    for site_name, log_files in find_production_logs(member_dir, iteration=iteration).items():
+        histogram = histograms[site_name] = DistanceHistogram(bins)
+        for log_file in log_files:
+            for values in read_column(log_file, chunk_size=chunk_size):
+                histogram.add(values)
+    return histograms
+
+
+def _member_histograms(arguments):
+    # Top-level, so that it can be sent to the worker processes
+    return member_histograms(*arguments)
+
+
+def ensemble_histograms(ensemble_dir, bins, members=None, iteration=None, jobs=1):
+    """Histograms of the production distances of every pair, over the whole
+    ensemble.
+
+    Parameters
+    ----------
+    ensemble_dir : str
+        the top-level ensemble directory.
+    bins : list
+        the DEER bins.
+    members : list, optional
+        the members to include, by default every ``mem_<n>`` directory.
+    iteration : int, optional
+        only this iteration, by default all.
+    jobs : int, optional
+        read members in this many worker processes, by default 1
+
+    Returns
+    -------
+    dict
+        {site name: DistanceHistogram}
+    """
+    if members is None:
+        members = sorted(
+            int(name[len("mem_"):]) for name in os.listdir(str(ensemble_dir))
+            if name.startswith("mem_") and name[len("mem_"):].isdigit())
+    tasks = [(ensemble_dir, ensemble_num, bins, iteration) for ensemble_num in members]
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            results = list(executor.map(_member_histograms, tasks))
+    else:
+        results = list(map(_member_histograms, tasks))
+    histograms = {}
+    for result in results:
+        for site_name, histogram in result.items():
+            if site_name in histograms:
+                histograms[site_name].merge(histogram)
+            else:
+                histograms[site_name] = histogram
+    return histograms
+
+
+def kl_divergence(p, q, epsilon=EPSILON):
+    """Kullback-Leibler divergence D(p || q) of two histograms on the same grid
+    (normalized here), in nats."""
+    p = np.asarray(p, dtype=np.float64) + epsilon
+    q = np.asarray(q, dtype=np.float64) + epsilon
+    p, q = p / p.sum(), q / q.sum()
+    return float(np.sum(p * np.log(p / q)))
+
+
+def js_divergence(p, q):
+    """Jensen-Shannon divergence of two histograms on the same grid, in nats
+    (between 0 and ln 2)."""
+    p = np.asarray(p, dtype=np.float64)
+    q = np.asarray(q, dtype=np.float64)
+    p, q = p / p.sum(), q / q.sum()
+    m = (p + q) / 2.
+    # 0 log 0 = 0, and m > 0 wherever p or q is
+    return float(
+        (np.sum(p[p > 0] * np.log(p[p > 0] / m[p > 0])) + np.sum(q[q > 0] * np.log(q[q > 0] / m[q > 0]))) / 2.)
+
+
+def compare(histograms, distribution):
+    """Compare the histogram of every pair with the DEER distribution.
+
+    Returns
+    -------
+    list
+        one dictionary per pair (with any samples): site_name, samples, underflow, overflow, js_divergence and
+        kl_divergence (of the ensemble from the DEER distribution).
+    """
+    rows = []
+    for site_name in sorted(histograms):
+        histogram = histograms[site_name]
+        if not histogram.counts.any():
+            continue
+        rows.append({
+            "site_name": site_name,
+            "samples": histogram.get_total(),
+            "underflow": histogram.underflow,
+            "overflow": histogram.overflow,
+            "js_divergence": js_divergence(histogram.counts, distribution),
+            "kl_divergence": kl_divergence(histogram.counts, distribution)
+        })
+    return rows
@@ -0,0 +1,262 @@
+"""MD engine backends.
+
+Everything that touches gmxapi goes through an engine with four operations:
+
+    - ``from_tpr(tprs, **kwargs)``: a workflow that runs one simulation per tpr.
+    - ``WorkElement(namespace, operation, depends, params)``: a restraint plugin.
+    - ``ParallelArrayContext(workflow, workdir_list, communicator)``: runs the
+      workflow, one working directory per rank.
+    - ``run(work)``: runs a workflow in the current directory.
+
+The default engine, 'gromacs', is gmxapi itself (with the BRER plugins). The
+'mock' engine needs neither GROMACS nor the plugins: it reads the restraint
+parameters from the plugins and writes training, convergence and production
+logs in the same format as the BRER plugins, plus checkpoints and an md.log,
+at a configurable speed. It is for exercising and load-testing the
+orchestration (directories, checkpoints, post-processing, MPI) on any machine;
+the numbers in its logs are plausible, not physical.
+
+Select an engine with ``set_engine`` or the WZM_WZT_ENGINE environment
+variable.
+"""
+
+import os
+import time
+import socket
+import zlib
+import numpy as np
+
+ENGINES = ['gromacs', 'mock']
+CHECKPOINT_HEADER = b"mock-checkpoint time="
+
+_engine = None
+
+
+class GromacsEngine():
+    """gmxapi, imported the first time it is needed."""
+
+    def __init__(self):
+        import gmx
+        self.gmx = gmx
+
+    def from_tpr(self, tprs, **kwargs):
+        return self.gmx.workflow.from_tpr(tprs, **kwargs)
+
+    def WorkElement(self, **kwargs):
+        return self.gmx.workflow.WorkElement(**kwargs)
+
+    def ParallelArrayContext(self, workflow, workdir_list, communicator):
+        return self.gmx.context.ParallelArrayContext(workflow, workdir_list=workdir_list, communicator=communicator)
+
+    def run(self, work):
+        return self.gmx.run(work=work)
+
+
+class MockWorkflow():
+    def __init__(self, tprs, **kwargs):
+        self.tprs = tprs if isinstance(tprs, list) else [tprs]
+        self.kwargs = kwargs
+        self.dependencies = []
+
+    def add_dependency(self, dependency):
+        """Add a plugin for every simulation, or a list with one per simulation."""
+        self.dependencies.append(dependency)
+
+    def get_plugins(self, index):
+        """The plugins attached to simulation ``index``."""
+        return [dependency[index] if isinstance(dependency, list) else dependency for dependency in self.dependencies]
+
+
+class MockWorkElement():
+    def __init__(self, namespace, operation, depends=(), params=None):
+        self.namespace = namespace
+        self.operation = operation
+        self.depends = list(depends)
+        self.params = dict(params or {})
+        self.name = None
+
+
+class MockSession():
+    def __init__(self, engine, workflow, workdir_list, communicator):
+        self.engine = engine
+        self.workflow = workflow
+        self.workdir_list = workdir_list
+        self.communicator = communicator
+
+    def run(self):
+        rank = self.communicator.Get_rank() if self.communicator is not None else 0
+        if rank < len(self.workdir_list):
+            self.engine.simulate(self.workflow, rank, str(self.workdir_list[rank]))
+
+
+class MockContext():
+    def __init__(self, engine, workflow, workdir_list, communicator):
+        self.session = MockSession(engine, workflow, workdir_list, communicator)
+
+    def __enter__(self):
+        return self.session
+
+    def __exit__(self, *args):
+        return False
+
+
+class MockEngine():
+    def __init__(self, ns_per_day=None, checkpoint_size=1024, seed=0):
+        """Stand-in for GROMACS that writes BRER-style logs and checkpoints.
+
+        Parameters
+        ----------
+        ns_per_day : float, optional
+            simulated speed; if given, each run sleeps as long as a real run at this speed would take. By default
+            runs take no time at all.
+        checkpoint_size : int, optional
+            size of the checkpoints written, in bytes, by default 1024
+        seed : int, optional
+            random seed; together with the working directory it makes every run reproducible, by default 0
+        """
+        self.ns_per_day = ns_per_day
+        self.checkpoint_size = checkpoint_size
+        self.seed = seed
+        self.dt = 0.002  # ps
+
+    def from_tpr(self, tprs, **kwargs):
+        return MockWorkflow(tprs, **kwargs)
+
+    def WorkElement(self, **kwargs):
+        return MockWorkElement(**kwargs)
+
+    def ParallelArrayContext(self, workflow, workdir_list, communicator):
+        return MockContext(self, workflow, workdir_list, communicator)
+
+    def run(self, work):
+        with MockContext(self, work, [os.getcwd()], None) as session:
+            session.run()
+
+    def read_checkpoint_time(self, workdir):
+        """The simulation time stored in a mock checkpoint, or 0. if there is none."""
+        cpt = os.path.join(workdir, "state.cpt")
+        if not os.path.exists(cpt):
+            return 0.
+        with open(cpt, "rb") as fh:
+            header = fh.readline()
+        if not header.startswith(CHECKPOINT_HEADER):
+            return 0.
+        return float(header[len(CHECKPOINT_HEADER):])
+
+    def write_checkpoint(self, workdir, sim_time):
+        # Replaced rather than rewritten, as GROMACS does
+        cpt = os.path.join(workdir, "state.cpt")
+        header = CHECKPOINT_HEADER + "{}\n".format(sim_time).encode()
+        tmp = "{}.tmp".format(cpt)
+        with open(tmp, "wb") as fh:
+            fh.write(header + b"\0" * max(0, self.checkpoint_size - len(header)))
+        os.replace(tmp, cpt)
+
+    def simulate(self, workflow, index, workdir):
+        """Write the outputs of simulation ``index`` of ``workflow`` into ``workdir``."""
+        rng = np.random.default_rng([self.seed, zlib.crc32(os.path.abspath(workdir).encode())])
+        start_time = self.read_checkpoint_time(workdir)
+        end_time = start_time
+        for plugin in workflow.get_plugins(index):
+            params = plugin.params
+            log_file = os.path.join(workdir, params["logging_filename"])
+            if plugin.operation == "brer_restraint":
+                rows = self._training(params, start_time, rng)
+                header = "time\tR\ttarget\tA\ttau\talpha"
+            elif plugin.operation == "linearstop_restraint":
+                rows = self._convergence(params, start_time, rng)
+                header = "time\tR\ttarget\talpha"
+            elif plugin.operation == "linear_restraint":
+                rows = self._production(params, start_time, workflow.kwargs.get("end_time"), rng)
+                header = "time\tR\ttarget\talpha"
+            else:
+                raise ValueError("The mock engine does not know the operation {}".format(plugin.operation))
+            with open(log_file, "w") as fh:
+                fh.write(header + "\n")
+                for row in rows:
+                    fh.write("\t".join("{:f}".format(value) for value in row) + "\n")
+            end_time = max(end_time, rows[-1][0])
+
+        wall_time = 0.
+        if self.ns_per_day:
+            wall_time = (end_time - start_time) / 1000. / self.ns_per_day * 86400.
+            time.sleep(wall_time)
+        self.write_checkpoint(workdir, end_time)
+        with open(os.path.join(workdir, "md.log"), "a") as fh:
+            ns_per_day = self.ns_per_day or 0.
+            fh.write("Hardware detected on host {} (the node of MPI rank 0):\n".format(socket.gethostname()))
+            steps = int(round((end_time - start_time) / self.dt))
+            fh.write("   Statistics over {:d} steps using {:d} frames\n".format(steps, 1 + steps // 5000))
+            fh.write("               Core t (s)   Wall t (s)        (%)\n")
+            fh.write("       Time:   {:10.3f}   {:10.3f}      100.0\n".format(wall_time, wall_time))
+            fh.write("                 (ns/day)    (hour/ns)\n")
+            fh.write("Performance:   {:10.3f}   {:10.3f}\n".format(ns_per_day, 24. / ns_per_day if ns_per_day else 0.))
+
+    def _distance(self, target, rng):
+        return max(0.5, target + rng.normal(0., 0.5))
+
+    def _training(self, params, start_time, rng):
+        # alpha is updated every tau ps and settles on the force that holds R at the target
+        target, A, tau = params["target"], params["A"], params["tau"]
+        r = self._distance(target, rng)
+        alpha = 0.
+        rows = []
+        for update in range(int(rng.integers(3, 10))):
+            alpha += A * (target - r) / (update + 1)
+            r += 0.5 * (target - r) + rng.normal(0., 0.05)
+            rows.append([start_time + (update + 1) * tau, r, target, A, tau, alpha])
+        return rows
+
+    def _convergence(self, params, start_time, rng):
+        # R is pulled towards the target until it is within the tolerance
+        target, period = params["target"], params["sample_period"]
+        tolerance = min(params["tolerance"], 0.5)
+        r = self._distance(target, rng)
+        rows = [[start_time, r, target, params["alpha"]]]
+        while abs(r - target) > tolerance and len(rows) < 1000:
+            r += 0.3 * (target - r) + rng.normal(0., 0.02)
+            rows.append([start_time + len(rows) * period, r, target, params["alpha"]])
+        return rows
+
+    def _production(self, params, start_time, end_time, rng):
+        target, period = params["target"], params["sample_period"]
+        if end_time is None:
+            end_time = start_time + params["production_time"]
+        rows = []
+        sim_time = start_time
+        while True:
+            rows.append([sim_time, self._distance(target, rng), target, params["alpha"]])
+            if sim_time >= end_time:
+                break
+            sim_time = min(end_time, sim_time + period)
+        return rows
+
+
+def set_engine(name, **kwargs):
+    """Choose the MD engine.
+
+    Parameters
+    ----------
+    name : str
+        'gromacs' or 'mock'.
+    kwargs
+        passed to the engine (see MockEngine).
+
+    Returns
+    -------
+    object
+        the engine.
+    """
+    global _engine
+    if name not in ENGINES:
+        raise ValueError("{} is not a valid engine: choose from {}".format(name, ENGINES))
+    _engine = GromacsEngine(**kwargs) if name == 'gromacs' else MockEngine(**kwargs)
+    return _engine
+
+
+def get_engine():
+    """The current MD engine; by default the one named by the WZM_WZT_ENGINE
+    environment variable, or 'gromacs'."""
+    if _engine is None:
+        set_engine(os.environ.get("WZM_WZT_ENGINE", "gromacs"))
+    return _engine
@@ -0,0 +1,136 @@
+"""Runs several ensemble members in one MPI launch.
+
+Without a driver, every ensemble member is its own ``mpirun`` of a Simulation,
+with its own Python start-up, imports and MPI initialization. The
+EnsembleDriver splits one communicator (by default MPI.COMM_WORLD) into groups
+of ``ranks_per_member`` ranks and gives each group a sub-communicator. The
+members are dealt out to the groups round-robin, and each group runs its
+members one after the other, each as a Simulation on the group's
+sub-communicator.
+"""
+
+from wzm_wzt.run_md import Simulation
+from wzm_wzt.tracing import write_trace
+from wzm_wzt.comms import get_comm
+
+
+def assign_members(members, num_groups, group):
+    """The members that one group of ranks runs.
+
+    Parameters
+    ----------
+    members : list
+        all the ensemble members (ensemble_num) to run.
+    num_groups : int
+        the number of groups the ranks are split into.
+    group : int
+        the group.
+
+    Returns
+    -------
+    list
+        every ``num_groups``-th member, starting from ``group``.
+    """
+    if not 0 <= group < num_groups:
+        raise IndexError("Group {} does not exist: there are {} groups".format(group, num_groups))
+    return list(members)[group::num_groups]
+
+
+class EnsembleDriver():
+    def __init__(self, members, ranks_per_member=1, comm=None):
+        """Split the ranks into one sub-communicator per group of
+        ``ranks_per_member`` ranks.
+
+        Parameters
+        ----------
+        members : list
+            the ensemble members (ensemble_num) to run.
+        ranks_per_member : int, optional
+            the number of ranks each member runs on (one per test site), by default 1
+        comm : mpi4py.MPI.Comm, optional
+            the communicator to split, by default MPI.COMM_WORLD
+        """
+        self.comm = get_comm(comm)
+        size = self.comm.Get_size()
+        if ranks_per_member < 1 or size % ranks_per_member:
+            raise ValueError("{} ranks cannot be split into groups of {}".format(size, ranks_per_member))
+        self.ranks_per_member = ranks_per_member
+        self.num_groups = size // ranks_per_member
+        self.group = self.comm.Get_rank() // ranks_per_member
+        self.member_comm = self.comm.Split(color=self.group, key=self.comm.Get_rank())
+        self.members = assign_members(members, self.num_groups, self.group)
+        self.simulations = {}
+        self._set_up = False
+
+    def get_members(self):
+        """The members this rank's group runs."""
+        return self.members
+
+    def setup(self, tpr, ensemble_dir, site_filename, deer_data_filename, **kwargs):
+        """Set up a Simulation for every member of this rank's group.
+
+        Parameters
+        ----------
+        tpr, ensemble_dir, site_filename, deer_data_filename
+            see Simulation.
+        kwargs
+            any other keyword arguments for Simulation (mdrun_args, target_schedule, ...).
+
+        Returns
+        -------
+        dict
+            {ensemble_num: Simulation}
+        """
+        for ensemble_num in self.members:
+            self.simulations[ensemble_num] = Simulation(tpr,
+                                                        ensemble_dir,
+                                                        ensemble_num,
+                                                        site_filename,
+                                                        deer_data_filename,
+                                                        comm=self.member_comm,
+                                                        **kwargs)
+        self._set_up = True
+        return self.simulations
+
+    def run(self, num_phases=1):
+        """Run every member of this rank's group through ``num_phases`` phases
+        (training, convergence or production). Members take turns, one phase
+        at a time, so they progress at the same rate.
+
+        Parameters
+        ----------
+        num_phases : int, optional
+            the number of phases to run each member for, by default 1. A group without members (there are more
+            groups than members) has nothing to run.
+        """
+        if not self._set_up:
+            raise RuntimeError("Call setup before running the ensemble")
+        if not self.members:
+            return
+        for _ in range(num_phases):
+            for ensemble_num in self.members:
+                simulation = self.simulations[ensemble_num]
+                simulation.build_plugins(clean=True)
+                simulation.run()
+                simulation.post_process()
+
+    def write_trace(self, filename):
+        """Merge the spans of every member on every rank into one Chrome trace
+        (a collective call over the driver's communicator). The members must
+        have been set up with trace=True.
+
+        Parameters
+        ----------
+        filename : str
+            where to write the trace.
+        """
+        tracers = [simulation.tracer for simulation in self.simulations.values() if simulation.tracer is not None]
+        write_trace(filename, tracers, self.comm)
+
+    def free(self):
+        """Release the sub-communicator."""
+        from mpi4py import MPI
+
+        if self.member_comm != MPI.COMM_NULL:
+            self.member_comm.Free()
+            self.member_comm = MPI.COMM_NULL
@@ -0,0 +1,182 @@
+"""Per-phase timing of a member's run.
+
+Every rank keeps a PhaseTimer with the wall time it spent in each stage of the
+current phase (setting up the Simulation, building the workflow, mdrun,
+barriers, collectives, reading logs, moving checkpoints, ...). At the end of
+each phase the timers are reduced over the member's ranks (sum, min and max
+per stage), and rank 0 writes the result to the member directory:
+
+    - ``metrics.jsonl``: one JSON object per phase, appended.
+    - ``metrics.prom``: the latest phase in the Prometheus text format, e.g. for
+      node_exporter's textfile collector. It is replaced atomically.
+"""
+
+import os
+import json
+import time
+import threading
+import contextlib
+import numpy as np
+
+STAGES = [
+    "init", "initialize_workflow", "build_plugins", "staging", "run", "barrier", "collectives", "read_logs",
+    "training_pp", "convergence_pp", "production_pp", "checkpoints", "write_state"
+]
+JSONL_FILENAME = "metrics.jsonl"
+PROMETHEUS_FILENAME = "metrics.prom"
+
+
+class PhaseTimer():
+    def __init__(self, tracer=None):
+        """Accumulates the wall time spent in each stage (see STAGES) on this
+        rank. Safe to use from several threads.
+
+        Parameters
+        ----------
+        tracer : tracing.Tracer, optional
+            also record every timed stage as a span, by default None
+        """
+        self.tracer = tracer
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.seconds = np.zeros(len(STAGES), dtype=np.float64)
+            self.counts = np.zeros(len(STAGES), dtype=np.float64)
+
+    def add(self, stage, seconds):
+        index = STAGES.index(stage)
+        with self._lock:
+            self.seconds[index] += seconds
+            self.counts[index] += 1
+
+    @contextlib.contextmanager
+    def time(self, stage, **kwargs):
+        """Time the enclosed block as ``stage``. Any keyword arguments are
+        passed on to the tracer's span (e.g. site=...).
+
+        Example
+        -------
+        >>> with timer.time("barrier"):
+        ...     comm.Barrier()
+        """
+        if stage not in STAGES:
+            raise ValueError("{} is not a stage: choose from {}".format(stage, STAGES))
+        start, wall_start = time.perf_counter(), time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+            if self.tracer is not None:
+                self.tracer.add(stage, wall_start, time.time(), **kwargs)
+
+    def reduce(self, comm, root=0):
+        """Combine the timers of every rank in ``comm`` (a collective call).
+
+        Returns
+        -------
+        dict
+            on the root, {stage: {'sum': s, 'min': s, 'max': s, 'count': n}} for every stage any rank spent time
+            in; None on the other ranks.
+        """
+        from mpi4py import MPI
+
+        with self._lock:
+            local = np.concatenate([self.seconds, self.counts])
+        totals, minima, maxima = np.zeros_like(local), np.zeros_like(local), np.zeros_like(local)
+        comm.Reduce(local, totals, op=MPI.SUM, root=root)
+        comm.Reduce(local, minima, op=MPI.MIN, root=root)
+        comm.Reduce(local, maxima, op=MPI.MAX, root=root)
+        if comm.Get_rank() != root:
+            return None
+        num_stages = len(STAGES)
+        return {
+            stage: {
+                "sum": float(totals[i]),
+                "min": float(minima[i]),
+                "max": float(maxima[i]),
+                "count": int(totals[num_stages + i])
+            }
+            for i, stage in enumerate(STAGES) if totals[num_stages + i]
+        }
+
+
+def to_prometheus(record):
+    """Format one phase record (see write_metrics) in the Prometheus text
+    exposition format."""
+    labels = 'member="{}",iteration="{}",phase="{}"'.format(record["ensemble_num"], record["iteration"],
+                                                            record["phase"])
+    lines = [
+        "# HELP wzm_wzt_stage_seconds Wall time spent in each stage of the latest phase.",
+        "# TYPE wzm_wzt_stage_seconds gauge"
+    ]
+    for stage, stats in sorted(record["stages"].items()):
+        for statistic in ["sum", "min", "max"]:
+            lines.append('wzm_wzt_stage_seconds{{{},stage="{}",statistic="{}"}} {}'.format(
+                labels, stage, statistic, stats[statistic]))
+    lines += [
+        "# HELP wzm_wzt_stage_calls Number of times each stage ran in the latest phase, summed over ranks.",
+        "# TYPE wzm_wzt_stage_calls gauge"
+    ]
+    for stage, stats in sorted(record["stages"].items()):
+        lines.append('wzm_wzt_stage_calls{{{},stage="{}"}} {}'.format(labels, stage, stats["count"]))
+    lines += [
+        "# HELP wzm_wzt_phase_end_timestamp_seconds When the latest phase finished.",
+        "# TYPE wzm_wzt_phase_end_timestamp_seconds gauge",
+        "wzm_wzt_phase_end_timestamp_seconds{{{}}} {}".format(labels, record["time"])
+    ]
+    if record.get("throughput"):
+        lines += [
+            "# HELP wzm_wzt_ns_per_day MD throughput of each run in the latest phase.",
+            "# TYPE wzm_wzt_ns_per_day gauge"
+        ]
+        for row in record["throughput"]:
+            lines.append('wzm_wzt_ns_per_day{{{},site="{}",host="{}"}} {}'.format(labels, row["site_name"],
+                                                                                row["host"], row["ns_per_day"]))
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(member_dir, stages, ensemble_num, iteration, phase, num_ranks, throughput=None):
+    """Append a phase record to metrics.jsonl and replace metrics.prom.
+
+    Parameters
+    ----------
+    member_dir : str
+        the member directory (``<ensemble_dir>/mem_<n>``).
+    stages : dict
+        the result of PhaseTimer.reduce.
+    ensemble_num : int
+        the ensemble member.
+    iteration : int
+        the BRER iteration.
+    phase : str
+        the phase that finished.
+    num_ranks : int
+        the number of ranks the member ran on.
+    throughput : list, optional
+        the MD throughput of the phase's runs (see throughput.collect).
+
+    Returns
+    -------
+    dict
+        the record.
+    """
+    record = {
+        "time": time.time(),
+        "ensemble_num": ensemble_num,
+        "iteration": iteration,
+        "phase": phase,
+        "num_ranks": num_ranks,
+        "stages": stages
+    }
+    if throughput is not None:
+        record["throughput"] = throughput
+    with open(os.path.join(str(member_dir), JSONL_FILENAME), "a") as fh:
+        fh.write(json.dumps(record) + "\n")
+    prometheus = os.path.join(str(member_dir), PROMETHEUS_FILENAME)
+    tmp = "{}.tmp".format(prometheus)
+    with open(tmp, "w") as fh:
+        fh.write(to_prometheus(record))
+    os.replace(tmp, prometheus)
+    return record
@@ -4,7 +4,7 @@ restraint."""
 
 from wzm_wzt.metadata import MetaData
 from abc import abstractmethod
-import gmx
+from wzm_wzt.engines import get_engine
 
 
 class PluginConfig(MetaData):
@@ -78,7 +78,7 @@ class TrainingPluginConfig(PluginConfig):
         """Build gmxapi potential for training simulations."""
         if self.get_missing_keys():
             raise KeyError('Must define {}'.format(self.get_missing_keys()))
-        potential = gmx.workflow.WorkElement(namespace="myplugin",
+        potential = get_engine().WorkElement(namespace="myplugin",
                                              operation="brer_restraint",
                                              depends=[],
                                              params=self.get_as_dictionary())
@@ -98,7 +98,7 @@ class ConvergencePluginConfig(PluginConfig):
         """Build gmxapi potential for convergence simulations."""
         if self.get_missing_keys():
             raise KeyError('Must define {}'.format(self.get_missing_keys()))
-        potential = gmx.workflow.WorkElement(namespace="myplugin",
+        potential = get_engine().WorkElement(namespace="myplugin",
                                              operation="linearstop_restraint",
                                              depends=[],
                                              params=self.get_as_dictionary())
@@ -118,7 +118,7 @@ class ProductionPluginConfig(PluginConfig):
         """Build gmxapi potential for production simulations."""
         if self.get_missing_keys():
             raise KeyError('Must define {}'.format(self.get_missing_keys()))
-        potential = gmx.workflow.WorkElement(namespace="myplugin",
+        potential = get_engine().WorkElement(namespace="myplugin",
                                              operation="linear_restraint",
                                              depends=[],
                                              params=self.get_as_dictionary())
@@ -0,0 +1,299 @@
+"""Stops convergence runs that are not going to be selected.
+
+At the end of convergence, the site to restrain in production is drawn from
+the Boltzmann weights of the convergence work values. Long before the runs
+finish, some sites usually have so much more work than the others that their
+weight is negligible. The work along a convergence path only grows while the
+run goes on, so such a site is pruned: its run is stopped early and the rank is
+free for other work.
+
+The pruning decision is made in one place (a ConvergencePruner thread on rank
+0, reading the convergence logs as they are written) and is passed on through
+the filesystem: the pruner writes a request marker into the site's convergence
+directory, and a PruneWatcher on the rank that runs the site stops mdrun when
+the marker appears while mdrun is running, and then marks the run as stopped.
+Only runs that were actually stopped are left out of the Boltzmann selection.
+When a run ends by itself, its watcher marks it as finished and it is never
+pruned.
+
+Sites are compared at a common simulation time, the earliest time reached by
+the runs that are still going, since a run that has got further has done more
+work. A site is pruned when its weight relative to the site with the least
+work, ``exp(-(W_site - W_min) / RT)``, drops below a threshold. The site with
+the least work can still do more work later on, so this is a heuristic rather
+than a guarantee; ``min_time`` keeps sites from being compared before their
+runs have got going.
+"""
+
+import os
+import signal
+import logging
+import threading
+import contextlib
+import numpy as np
+
+PRUNE_MARKER = "pruned"  # written by the pruner: stop this run
+STOPPED_MARKER = "stopped"  # written by the watcher: the run was stopped
+FINISHED_MARKER = "finished"  # written by the watcher: the run ended by itself
+RT = 2.479  # kJ/mol
+
+
+def is_pruned(workdir):
+    """Whether the run in ``workdir`` was stopped because it was pruned."""
+    return os.path.exists(os.path.join(str(workdir), STOPPED_MARKER))
+
+
+def is_finished(workdir):
+    """Whether the run in ``workdir`` ended by itself (while it was watched)."""
+    return os.path.exists(os.path.join(str(workdir), FINISHED_MARKER))
+
+
+def clear_markers(workdir):
+    """Remove the pruning markers of an earlier run in ``workdir``."""
+    for marker in [PRUNE_MARKER, STOPPED_MARKER, FINISHED_MARKER]:
+        try:
+            os.remove(os.path.join(str(workdir), marker))
+        except FileNotFoundError:
+            pass
+
+
+def select_pruned(work, threshold, protected=(), rt=RT):
+    """The sites whose Boltzmann weight relative to the site with the least work
+    is below ``threshold``.
+
+    Parameters
+    ----------
+    work : dict
+        {site: work}, all up to the same simulation time.
+    threshold : float
+        prune sites whose relative weight is below this.
+    protected : list, optional
+        sites that are compared but never pruned (e.g. runs that have finished).
+    rt : float, optional
+        RT in kJ/mol, by default 2.479
+
+    Returns
+    -------
+    list
+        the sites to prune.
+    """
+    if len(work) < 2:
+        return []
+    least = min(work.values())
+    return sorted(site for site in work
+                  if site not in protected and np.exp(-(work[site] - least) / rt) < threshold)
+
+
+def stop_mdrun(thread_id):
+    """Ask mdrun, running in thread ``thread_id`` of this process, to stop.
+
+    gmxapi sessions cannot be stopped from outside, but mdrun handles SIGTERM
+    by stopping (and writing a checkpoint) at the next neighbour-search step,
+    after which the session returns as usual. The signal is sent to the thread
+    that runs mdrun rather than to the whole process, and only while that
+    thread is inside PruneWatcher.running, whose handler keeps the signal from
+    ending the process. mdrun's stop flag is global, so this assumes one
+    simulation per process at a time (as in Simulation and EnsembleDriver).
+    """
+    signal.pthread_kill(thread_id, signal.SIGTERM)
+
+
+class ConvergencePruner():
+    def __init__(self, log_files, work_function, threshold=1e-3, min_time=0., interval=30.):
+        """Watch the convergence logs of all test sites and prune the losers.
+
+        Parameters
+        ----------
+        log_files : dict
+            {site: path to the convergence log}
+        work_function : callable
+            ``work_function(log_file, until=None)`` returns (site, work, time) for a log file, with the work up to
+            the simulation time ``until`` if given, e.g. run_md.convergence_work
+        threshold : float, optional
+            prune sites whose weight relative to the leader is below this, by default 1e-3
+        min_time : float, optional
+            only compare sites that have reached this simulation time (ps), by default 0.
+        interval : float, optional
+            seconds between checks when run in the background, by default 30.
+        """
+        self.log_files = log_files
+        self.work_function = work_function
+        self.threshold = threshold
+        self.min_time = min_time
+        self.interval = interval
+        self.pruned = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def read_work(self, sites=None, until=None):
+        """The work and time so far for every site whose log has any data.
+
+        Parameters
+        ----------
+        sites : list, optional
+            only these sites, by default all.
+        until : float, optional
+            the work up to this simulation time, by default all of it.
+
+        Returns
+        -------
+        tuple
+            ({site: work}, {site: time})
+        """
+        work, times = {}, {}
+        for site in self.log_files if sites is None else sites:
+            try:
+                _, work[site], times[site] = self.work_function(self.log_files[site], until=until)
+            except (OSError, ValueError):
+                # Not written yet, or a line is only half written
+                continue
+        return work, times
+
+    def check(self):
+        """Prune every site that has fallen too far behind, comparing all sites
+        at the earliest time reached by the runs that are still going.
+
+        Returns
+        -------
+        list
+            the sites pruned by this check.
+        """
+        work, times = self.read_work()
+        finished = [site for site in work if is_finished(os.path.dirname(self.log_files[site]))]
+        running = [
+            site for site in work if site not in finished and site not in self.pruned and times[site] >= self.min_time
+        ]
+        if not running:
+            return []
+        common_time = min(times[site] for site in running)
+        work, _ = self.read_work(running + finished, until=common_time)
+
+        newly_pruned = []
+        for site in select_pruned(work, self.threshold, protected=finished):
+            if site in self.pruned:
+                continue
+            self.pruned[site] = {"work": float(work[site]), "time": common_time}
+            open(os.path.join(os.path.dirname(self.log_files[site]), PRUNE_MARKER), "w").write("{} {}\n".format(
+                work[site], common_time))
+            newly_pruned.append(site)
+            logging.getLogger("WZM-WZT").info("Pruned the convergence run for {} at {} ps (work {})".format(
+                site, common_time, work[site]))
+        return newly_pruned
+
+    def start(self):
+        """Check every ``interval`` seconds in a background thread until
+        ``stop`` is called."""
+
+        def loop():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.check()
+                except Exception:
+                    logging.getLogger("WZM-WZT").exception("Checking the convergence runs failed")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name="ConvergencePruner", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class PruneWatcher():
+    def __init__(self, workdir, stop=stop_mdrun, interval=30.):
+        """Stop the run in ``workdir`` once it has been pruned.
+
+        The run is only stopped while it is inside ``running``; when the run
+        has been stopped, the watcher writes the stopped marker, and when it
+        is cancelled without having stopped the run, the finished marker.
+
+        Parameters
+        ----------
+        workdir : str
+            the convergence directory of the run.
+        stop : callable, optional
+            called (once) with the id of the thread that runs mdrun when the run is pruned, by default stop_mdrun
+        interval : float, optional
+            seconds between checks, by default 30.
+        """
+        self.workdir = str(workdir)
+        self.stop = stop
+        self.interval = interval
+        self.fired = False
+        self._running = None  # the thread inside running()
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        def loop():
+            while not self._cancel.wait(self.interval):
+                if self.check():
+                    return
+
+        clear_markers(self.workdir)
+        self._cancel.clear()
+        self._thread = threading.Thread(target=loop, name="PruneWatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def check(self):
+        """Stop the run if it has been pruned and is running.
+
+        Returns
+        -------
+        bool
+            whether the run was stopped.
+        """
+        with self._lock:
+            if self.fired or self._running is None or not os.path.exists(os.path.join(self.workdir, PRUNE_MARKER)):
+                return False
+            self.fired = True
+            self.stop(self._running)
+            open(os.path.join(self.workdir, STOPPED_MARKER), "w").close()
+            return True
+
+    @contextlib.contextmanager
+    def running(self):
+        """Wrap the call that runs mdrun (session.run()): only then is it safe
+        to stop it.
+
+        In the main thread, SIGTERM is handled for the duration: once the
+        watcher has fired it is ignored (in case it arrives before mdrun has
+        installed its own handler), any other SIGTERM is passed on to the
+        previous handler. The previous handler is restored afterwards, which
+        also removes the one mdrun leaves behind.
+        """
+        previous = None
+        if threading.current_thread() is threading.main_thread():
+
+            def handle(signum, frame):
+                if self.fired:
+                    return
+                # Not ours (e.g. the batch system ending the job): as if we had not been here
+                signal.signal(signum, previous)
+                os.kill(os.getpid(), signum)
+
+            previous = signal.signal(signal.SIGTERM, handle)
+        with self._lock:
+            self._running = threading.get_ident()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running = None
+            if previous is not None:
+                signal.signal(signal.SIGTERM, previous)
+
+    def cancel(self):
+        """Stop watching (the run has finished)."""
+        self._cancel.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if not self.fired:
+            open(os.path.join(self.workdir, FINISHED_MARKER), "w").close()
@@ -1,28 +1,54 @@
 """Class that defines the gmxapi run configuration for a single iteration of
 Wzm-Wzt BRER."""
 
-import gmx
 import os, shutil
+import copy
 import warnings
 import numpy
 import logging
 from wzm_wzt.run_params import State
 from wzm_wzt.metadata import MetaData
-from wzm_wzt.directory_helper import DirectoryHelper
+from wzm_wzt.directory_helper import get_directory_helper
+from wzm_wzt.comms import get_comm, bcast_array
+from wzm_wzt.engines import get_engine
 from wzm_wzt.plugin_configs import TrainingPluginConfig, ConvergencePluginConfig, ProductionPluginConfig
-from mpi4py import MPI
-
-comm = MPI.COMM_WORLD
 
 
 class gmxapiConfig(MetaData):
-    def __init__(self):
+    def __init__(self, comm=None):
+        """The gmxapi run configuration for one ensemble member.
+
+        Parameters
+        ----------
+        comm : mpi4py.MPI.Comm, optional
+            the ranks that run this member, by default MPI.COMM_WORLD
+        """
         super().__init__("gmxapi_config")
+        self.comm = get_comm(comm)
         self.set_requirements(["tpr", "ensemble_dir", "ensemble_num", "test_sites", "num_test_sites"])
         self.state = None
         self.helper = None
         self.workflow = None
 
+    def split(self, comm):
+        """A copy of this configuration that builds its workflows for ``comm``
+        (e.g. MPI.COMM_SELF to run a single site on one rank). The copy shares
+        the state and the metadata, but has no workflow yet.
+
+        Parameters
+        ----------
+        comm : mpi4py.MPI.Comm
+            the communicator for the copy.
+
+        Returns
+        -------
+        gmxapiConfig
+        """
+        config = copy.copy(self)
+        config.comm = comm
+        config.workflow = None
+        return config
+
     def load_state(self, state: State):
         self.state = state
         test_sites = []
@@ -57,7 +83,16 @@ class gmxapiConfig(MetaData):
         assert (not self.get_missing_keys())
         # Do resampling of targets if training phase
 
-    def change_to_test_directory(self):
+    def build_test_directory(self):
+        """Build the directory helper for the current test sites and make sure
+        the working directories exist. Does not change the working directory.
+        Layouts are cached, so repeated calls for the same test sites are cheap.
+
+        Returns
+        -------
+        DirectoryHelper
+            the helper, whose ``get_path`` gives absolute paths for every level, site and phase.
+        """
         # Go through test_sites
         test_sites = self.get("test_sites")
         dir_helper_params = {
@@ -67,14 +102,29 @@ class gmxapiConfig(MetaData):
             'num_test_sites': self.get("num_test_sites")
         }
 
-        self.helper = DirectoryHelper(top_dir=self.get("ensemble_dir"), param_dict=dir_helper_params)
+        self.helper = get_directory_helper(top_dir=self.get("ensemble_dir"), param_dict=dir_helper_params)
         self.helper.build_working_dir()
+        return self.helper
+
+    def change_to_test_directory(self):
+        self.build_test_directory()
         self.helper.change_dir(level='num_test_sites')
 
-    def build_plugins(self, mdrun_args={}):
+    def build_plugins(self, mdrun_args={}, sites=None):
+        """Add the restraint plugins to the workflow.
+
+        Parameters
+        ----------
+        mdrun_args : dict, optional
+            mdrun arguments, only used if the workflow has not been initialized yet.
+        sites : list, optional
+            only build the testing plugins for this subset of the test sites (one wave of a
+            scheduler.WaveScheduler), by default all of the test sites.
+        """
         if not self.workflow:
             warnings.warn("You have not initialized a workflow. Automatically setting one up for you...")
-            self.initialize_workflow(mdrun_args=mdrun_args)
+            self.initialize_workflow(mdrun_args=mdrun_args, sites=sites)
+        active_sites = self.get("test_sites") if sites is None else sorted(sites)
 
         all_pair_params = self.state.pair_params
         names = sorted(list(all_pair_params.keys()))
@@ -88,6 +138,9 @@ class gmxapiConfig(MetaData):
             pair_parameters = all_pair_params[name]
             # If the pair is being restrained but is not part of the testing, then it should be restrained by linear potential.
             if pair_parameters.get("on"):
+                if pair_parameters.get("testing") and name not in active_sites:
+                    # Runs in another wave
+                    continue
                 if not pair_parameters.get("testing"):
                     assert pair_parameters.get("phase") == "production"
                     phases.append("production")
@@ -116,39 +169,51 @@ class gmxapiConfig(MetaData):
         if plugins_fixed:
             for fixed_plugin in plugins_fixed.values():
                 if "training" in phases or "convergence" in phases:
-                    self.workflow.add_dependency([fixed_plugin] * self.get("num_test_sites"))
+                    self.workflow.add_dependency([fixed_plugin] * len(active_sites))
                 else:
                     self.workflow.add_dependency(fixed_plugin)
         if plugins_testing:
-            assert sorted(list(plugins_testing.keys())) == self.get("test_sites")
+            assert sorted(list(plugins_testing.keys())) == active_sites
             plugins_testing_list = []
-            for test_site in self.get("test_sites"):
+            for test_site in active_sites:
                 plugins_testing_list.append(plugins_testing[test_site])
             self.workflow.add_dependency(plugins_testing_list)
 
-    def initialize_workflow(self, mdrun_args={}):
+    def initialize_workflow(self, mdrun_args={}, sites=None):
+        """Set up a new gmxapi workflow with one tpr per test site (or a single
+        one for production).
+
+        Parameters
+        ----------
+        mdrun_args : dict, optional
+            mdrun arguments.
+        sites : list, optional
+            only set up the workflow for this subset of the test sites, by default all of them.
+        """
         phases = [self.state.get("phase", site_name=name) for name in self.state.names]
 
-        args_for_from_tpr = {"append_output": False}
-        tprs = None
-        if comm.Get_rank() == 0:
-            for key, value in mdrun_args.items():
-                args_for_from_tpr[key] = value
-
+        # Rank 0 decides the number of tprs and the production end time; every rank is given the same mdrun_args
+        decision = numpy.zeros(2, dtype=numpy.float64)
+        if self.comm.Get_rank() == 0:
             if "training" in phases or "convergence" in phases:
-                tprs = [self.get("tpr")] * self.get("num_test_sites")
-
+                decision[0] = self.get("num_test_sites") if sites is None else len(sites)
             else:
-                end_time = self.state.get('production_time') + self.state.get('start_time')
-                args_for_from_tpr["end_time"] = end_time
-                tprs = self.get("tpr")
+                decision[1] = self.state.get('production_time') + self.state.get('start_time')
+        bcast_array(decision, self.comm)
+
+        args_for_from_tpr = {"append_output": False}
+        for key, value in mdrun_args.items():
+            args_for_from_tpr[key] = value
+        if decision[0]:
+            tprs = [self.get("tpr")] * int(decision[0])
+        else:
+            args_for_from_tpr["end_time"] = float(decision[1])
+            tprs = self.get("tpr")
 
-        args_for_from_tpr = comm.bcast(args_for_from_tpr, root=0)
-        tprs = comm.bcast(tprs, root=0)
         logging.getLogger("WZM-WZT").debug(
-            "Rank {} will pass tprs: {} and arguments: {} to gmx.workflow.from_tpr".format(
-                comm.Get_rank(), tprs, args_for_from_tpr))
-        self.workflow = gmx.workflow.from_tpr(tprs, **args_for_from_tpr)
+            "Rank {} will pass tprs: {} and arguments: {} to from_tpr".format(
+                self.comm.Get_rank(), tprs, args_for_from_tpr))
+        self.workflow = get_engine().from_tpr(tprs, **args_for_from_tpr)
 
     def run(self):
-        gmx.run(work=self.workflow)
+        get_engine().run(self.workflow)
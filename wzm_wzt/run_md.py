@@ -10,41 +10,198 @@ from wzm_wzt.run_params import State, GeneralParams, PairParams
 from wzm_wzt.experimental_data import ExperimentalData
 from wzm_wzt.metadata import site_to_str
 from wzm_wzt.run_config import gmxapiConfig
+from wzm_wzt.target_schedule import TargetSchedule
+from wzm_wzt.target_allocation import discrepancy as target_discrepancy
+from wzm_wzt.checkpoints import CheckpointStore, PRUNE_AGE
+from wzm_wzt.catalog import RunCatalog
+from wzm_wzt.archive import open_log
+from wzm_wzt.staging import ScratchStager
+from wzm_wzt.scheduler import WaveScheduler
+from wzm_wzt.pruning import ConvergencePruner, PruneWatcher, is_pruned, clear_markers
+from wzm_wzt.comms import get_comm, bcast_float, bcast_choice, bcast_decisions, allreduce_values
+from wzm_wzt.engines import get_engine
+from wzm_wzt.metrics import PhaseTimer, write_metrics
+from wzm_wzt import throughput
+from wzm_wzt.tracing import Tracer
 import logging
+import logging.handlers
+import queue
+import atexit
+import copy
+import sqlite3
 import json
-import os, re, shutil
-import gmx
+import os, re
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from mpi4py import MPI
-
-comm = MPI.COMM_WORLD
-
-
-def configure_logging(filename):
-    root_logger = logging.getLogger()
-
-    logger = logging.getLogger("WZM-WZT")
-    logger.setLevel(logging.DEBUG)
-    # Format for our loglines
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    # Setup console logging
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    ch.setFormatter(formatter)
-    root_logger.addHandler(ch)
-    # Setup file logging as well
-    fh = logging.FileHandler(filename)
-    fh.setLevel(logging.DEBUG)
-    fh.setFormatter(formatter)
-    root_logger.addHandler(fh)
+
+
+# The queue handler, listener and router shared by every log file in the process (see configure_logging)
+_logging = None
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue with only their message merged in (in case
+    its arguments change later); the line is formatted by the listener."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+
+class LogRouter(logging.Handler):
+    """Writes each record to the console and to one log file: that of the
+    closest ancestor of its logger that was given a file by configure_logging.
+
+    ``route`` runs on the logging thread, as a filter of the queue handler; it
+    tags the record with the file and the MPI rank, and drops records that no
+    file is configured for. ``emit`` runs on the QueueListener thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__()
+        self.log_queue = log_queue
+        self.console = logging.StreamHandler()
+        self.console.setLevel(logging.INFO)
+        self.console.setFormatter(FORMATTER)
+        # logger name ("" for the root logger) -> (FileHandler, rank)
+        self.files = {}
+
+    def set_file(self, name, filename, rank, level):
+        """Send the records of logger ``name`` (and its descendants) to
+        ``filename``, replacing its previous file."""
+        with self.lock:
+            previous, _ = self.files.get(name, (None, None))
+            if previous is not None and previous.baseFilename == os.path.abspath(filename):
+                self.files[name] = previous, rank
+                previous.setLevel(level)
+                return
+        file_handler = logging.FileHandler(filename)
+        file_handler.setLevel(level)
+        file_handler.setFormatter(FORMATTER)
+        if previous is not None:
+            # Whatever is still queued for the previous file goes there first
+            self.log_queue.join()
+        with self.lock:
+            self.files[name] = file_handler, rank
+        if previous is not None:
+            previous.close()
+
+    def route(self, record):
+        with self.lock:
+            name = "" if record.name == "root" else record.name
+            while name not in self.files:
+                if not name:
+                    return False
+                name = name.rpartition(".")[0]
+            record.log_file, record.rank = name, self.files[name][1]
+        return True
+
+    def emit(self, record):
+        file_handler, _ = self.files.get(record.log_file, (None, None))
+        for handler in [self.console, file_handler]:
+            if handler is not None and record.levelno >= handler.level:
+                handler.handle(record)
+
+    def close(self):
+        for file_handler, _ in self.files.values():
+            file_handler.close()
+        self.files = {}
+        self.console.close()
+        super().close()
+
+
+# Format for our loglines
+FORMATTER = logging.Formatter("%(asctime)s - %(name)s - [rank %(rank)s] - %(levelname)s - %(message)s")
+
+
+def configure_logging(filename, name="WZM-WZT", attach_to_root=True, rank=0, per_rank=False, level=logging.DEBUG):
+    """Log to the console and to ``filename``.
+
+    Records are put on a queue by the logging call and written to the console and
+    the file by a background QueueListener, so logging never waits on file I/O.
+    There is one queue, listener and console handler per process; each record
+    goes to the file of the closest logger configured here. Calling this again
+    for the same logger and file changes nothing, and with another file moves
+    the logger over to it.
+
+    Parameters
+    ----------
+    filename : str
+        the log file.
+    name : str, optional
+        name of the logger to return, by default "WZM-WZT"
+    attach_to_root : bool, optional
+        send the messages of every logger (including other libraries) to ``filename``, by default True.
+        Members that share a process (see ensemble.EnsembleDriver) only send their own logger's messages to
+        their file instead, so each member's messages only end up in its own file.
+    rank : int, optional
+        the MPI rank; every line is tagged with it, by default 0
+    per_rank : bool, optional
+        ranks other than 0 write to their own file, ``<filename>.rank<rank>.log``, by default False (all
+        ranks write to ``filename``)
+    level : int, optional
+        the lowest level written to the file, by default logging.DEBUG. Messages below every handler's level
+        are dropped before they are formatted.
+    """
+    global _logging
+    logger = logging.getLogger(name)
+    if per_rank and rank:
+        filename = "{}.rank{}.log".format(os.path.splitext(filename)[0], rank)
+
+    if _logging is None:
+        # The listener thread does the writing
+        log_queue = queue.Queue()
+        router = LogRouter(log_queue)
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.addFilter(router.route)
+        logging.getLogger().addHandler(queue_handler)
+        listener = logging.handlers.QueueListener(log_queue, router)
+        listener.start()
+        _logging = queue_handler, listener, router
+    _, _, router = _logging
+    router.set_file("" if attach_to_root else name, filename, rank, level)
+    logger.setLevel(min(level, logging.INFO))
     return logger
 
 
+def shutdown_logging():
+    """Write out every queued log record and remove the handlers added by
+    configure_logging. Called automatically at exit."""
+    global _logging
+    if _logging is None:
+        return
+    queue_handler, listener, router = _logging
+    _logging = None
+    logging.getLogger().removeHandler(queue_handler)
+    listener.stop()
+    router.close()
+
+
+atexit.register(shutdown_logging)
+
+
 class Simulation():
     """Run Wzm-Wzt simulations
     """
 
-    def __init__(self, tpr, ensemble_dir, ensemble_num, site_filename, deer_data_filename, mdrun_args={}):
+    def __init__(self,
+                 tpr,
+                 ensemble_dir,
+                 ensemble_num,
+                 site_filename,
+                 deer_data_filename,
+                 mdrun_args={},
+                 target_schedule=None,
+                 target_allocation=None,
+                 scratch_dir=None,
+                 pruning=None,
+                 comm=None,
+                 per_rank_logs=False,
+                 trace=False,
+                 catalog=None):
         """Initialize the run.
         
         Parameters
@@ -61,12 +218,51 @@ class Simulation():
             path to json file containing DEER data for restraints.
         mdrun_args : dict
             dictionary of mdrun commandline arguments. 
+        target_schedule : str, optional
+            path to a pre-generated target schedule (see target_schedule.TargetSchedule). If provided, training
+            targets are looked up in the schedule instead of being re-sampled and broadcast. Iterations past the
+            end of the schedule (with a warning) choose their targets as if there were none.
+        target_allocation : dict, optional
+            keyword arguments for State.allocate_targets ('ensemble_size', and optionally 'method' and 'seed').
+            If provided (and there is no target schedule, or it has run out), this member's targets are its share
+            of an allocation across the whole ensemble rather than an independent draw.
+        scratch_dir : str, optional
+            node-local directory to run the MD in (see staging.ScratchStager). Inputs are staged in before each
+            run and outputs staged back to the ensemble directory afterwards. By default, runs happen directly in
+            the ensemble directory.
+        pruning : dict, optional
+            keyword arguments for pruning.ConvergencePruner ('threshold', and optionally 'min_time' and
+            'interval'). If provided, convergence runs whose Boltzmann weight falls below the threshold are
+            stopped early and left out of the selection. The pruner reads the logs in the ensemble directory, so
+            this cannot be combined with scratch_dir.
+        comm : mpi4py.MPI.Comm, optional
+            the ranks that run this member, by default MPI.COMM_WORLD. Pass a sub-communicator to run several
+            members in one launch (see ensemble.EnsembleDriver).
+        per_rank_logs : bool, optional
+            every rank other than 0 logs to its own file, by default False (see configure_logging).
+        trace : bool, optional
+            record every timed stage on every rank as a span, for a Chrome trace (see write_trace), by default
+            False
+        catalog : str, optional
+            path to a run catalog to keep up to date (see catalog.RunCatalog), usually
+            ``<ensemble_dir>/catalog.sqlite``, by default None (no catalog). The state and log files remain the
+            record of the run: failing to write to the catalog only logs a warning, and RunCatalog.rebuild fills
+            it in from the state files afterwards.
         """
+        init_start = time.perf_counter()
+        self.tracer = Tracer(pid=ensemble_num, tid=get_comm().Get_rank()) if trace else None
+        self.timer = PhaseTimer(tracer=self.tracer)
+        self.comm = get_comm(comm)
+        if pruning and scratch_dir:
+            raise ValueError("Convergence runs cannot be pruned while they run in scratch")
         sites = json.load(open(site_filename))
         deer_data = json.load(open(deer_data_filename))
+        # In the order of the bins: the state returns lists sorted (and sorts the dictionary it was given)
+        self.distribution = list(deer_data["distribution"])
 
         state_json = '{}/mem_{}/state.json'.format(ensemble_dir, ensemble_num)
         state = State(state_json)
+        state.comm = self.comm
 
         gmx_config_parameters = {
             'tpr': tpr,
@@ -96,39 +292,160 @@ class Simulation():
                 state.import_pair_parameters(pair_parameters)
 
         assert not state.get_all_missing_keys()
+        state.set(ensemble_num=ensemble_num)
+        state.catalog = RunCatalog(catalog) if catalog else None
 
-        gmxapi_config = gmxapiConfig()
+        gmxapi_config = gmxapiConfig(comm=self.comm)
         gmxapi_config.set_from_dictionary(gmx_config_parameters)
         gmxapi_config.load_state(state)
 
-        test_sites = gmxapi_config.state.get("test_sites")
-        phases = [gmxapi_config.state.get("phase", site_name=test_site) for test_site in test_sites]
-        if "training" in phases:
+        if comm is None:
+            self.logger = configure_logging("{}/{}.log".format(ensemble_dir, ensemble_num),
+                                            rank=self.comm.Get_rank(),
+                                            per_rank=per_rank_logs)
+        else:
+            self.logger = configure_logging("{}/{}.log".format(ensemble_dir, ensemble_num),
+                                            name="WZM-WZT.mem_{}".format(ensemble_num),
+                                            attach_to_root=False,
+                                            rank=self.comm.Get_rank(),
+                                            per_rank=per_rank_logs)
+        self.gmxapi = gmxapi_config
+        self.target_schedule = TargetSchedule.load(target_schedule) if target_schedule else None
+        self.target_allocation = target_allocation
+        self.__select_targets()
+        self.checkpoints = CheckpointStore("{}/checkpoints".format(ensemble_dir))
+        self.stager = ScratchStager(ensemble_dir, scratch_dir) if scratch_dir else None
+        self.pruning = pruning
+
+        # print("Hello from rank {}! Test sites are: {}".format(self.comm.Get_rank(), self.gmxapi.state.get("test_sites")))
+
+        self.member_dir = '{}/mem_{}'.format(ensemble_dir, ensemble_num)
+
+        with self.timer.time("write_state"):
+            self.gmxapi.state.write_to_json()
+        self.__parallel_log("The number of sites: %s", self.gmxapi.get("num_test_sites"))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.__parallel_log("Set up simulation with state: %s",
+                                self.gmxapi.state.get_as_dictionary(),
+                                level="debug")
+        self.mdrun_args = mdrun_args
+        self.__parallel_log("mdrun commandline arguments: %s", mdrun_args, level='debug')
+        self.timer.add("init", time.perf_counter() - init_start)
+
+    def __select_targets(self):
+        """Choose the targets of the test sites that are about to train: from
+        the target schedule, this member's share of the target allocation, or a
+        new draw broadcast from rank 0. Past the end of the target schedule,
+        the targets are chosen as if there were none."""
+        state = self.gmxapi.state
+        test_sites = state.get("test_sites")
+        if "training" not in [state.get("phase", site_name=test_site) for test_site in test_sites]:
+            return
+        scheduled = self.target_schedule is not None and state.get("iteration") < self.target_schedule.num_iterations
+        if self.target_schedule is not None and not scheduled and self.comm.Get_rank() == 0:
+            self.logger.warning("The target schedule only covers %s iterations: the targets for iteration %s are %s",
+                                self.target_schedule.num_iterations, state.get("iteration"),
+                                "allocated" if self.target_allocation else "drawn from the DEER distribution")
+        if scheduled:
+            # Every rank reads the same schedule, so there is nothing to broadcast.
+            for test_site in test_sites:
+                target = self.target_schedule.get(self.gmxapi.get("ensemble_num"),
+                                                  state.get("iteration"),
+                                                  site_name=test_site)
+                state.set(target=target, site_name=test_site)
+            if self.comm.Get_rank() == 0:
+                discrepancy = self.target_schedule.get_discrepancy(self.distribution)[state.get("iteration")]
+                self.__log_discrepancy("scheduled", self.target_schedule.num_members,
+                                       dict(zip(self.target_schedule.names, discrepancy)))
+        elif self.target_allocation:
+            targets = state.allocate_targets(self.gmxapi.get("ensemble_num"),
+                                             distribution=self.distribution,
+                                             **self.target_allocation)
+            for test_site in test_sites:
+                state.set(target=targets[test_site], site_name=test_site)
+            if self.comm.Get_rank() == 0:
+                indices = state.get_allocation(distribution=self.distribution, **self.target_allocation)
+                discrepancy = target_discrepancy(indices[:, -1:], self.distribution)[0]
+                self.__log_discrepancy("allocated", len(indices), dict(zip(sorted(state.pair_params), discrepancy)))
+        else:
             # Do resampling of targets
             target = 0
-            if comm.Get_rank() == 0:
-                target = gmxapi_config.state.re_sample_targets()
-            target = comm.bcast(target, root=0)
+            if self.comm.Get_rank() == 0:
+                target = state.re_sample_targets()
+            with self.timer.time("collectives"):
+                target = bcast_float(target, self.comm)
             for test_site in test_sites:
-                gmxapi_config.state.set(target=target, site_name=test_site)
-        self.gmxapi = gmxapi_config
+                state.set(target=target, site_name=test_site)
 
-        # print("Hello from rank {}! Test sites are: {}".format(comm.Get_rank(), self.gmxapi.state.get("test_sites")))
+    def __log_discrepancy(self, kind, ensemble_size, discrepancy):
+        """Log how far the ensemble's targets for this iteration are from the
+        DEER distribution (see target_allocation.discrepancy).
 
-        self.gmxapi.state.write_to_json()
-        self.logger = configure_logging("{}/{}.log".format(ensemble_dir, ensemble_num))
-        self.__parallel_log("The number of sites: {}".format(self.gmxapi.get("num_test_sites")))
-        self.__parallel_log("Set up simulation with state: {}".format(self.gmxapi.state.get_as_dictionary()),
-                            level="debug")
-        self.mdrun_args = mdrun_args
-        self.__parallel_log("mdrun commandline arguments: {}".format(mdrun_args), level='debug')
+        Parameters
+        ----------
+        kind : str
+            where the targets came from, for the message.
+        ensemble_size : int
+            the number of members the targets are shared out over.
+        discrepancy : dict
+            {pair name: discrepancy}
+        """
+        worst = max(discrepancy, key=discrepancy.get)
+        self.__parallel_log("Discrepancy of the %s targets from the DEER distribution over %s members "
+                            "(iteration %s): mean %.4f, max %.4f (%s)", kind, ensemble_size,
+                            self.gmxapi.state.get("iteration"), np.mean(list(discrepancy.values())),
+                            discrepancy[worst], worst)
+        self.__parallel_log("Discrepancy by pair: %s", discrepancy, level="debug")
+
+    def __record(self, method, *args, **kwargs):
+        """Call ``method`` of the run catalog, if there is one. The catalog is
+        only bookkeeping, so a failed write is logged rather than raised."""
+        catalog = self.gmxapi.state.catalog
+        if catalog is None:
+            return
+        try:
+            getattr(catalog, method)(*args, **kwargs)
+        except sqlite3.Error as error:
+            self.logger.warning("Could not write to the run catalog %s (%s): %s", catalog.filename, method, error)
 
-    def __parallel_log(self, message, level="info"):
-        if comm.Get_rank() == 0:
+    def __parallel_log(self, message, *args, level="info"):
+        """Log a message on rank 0. ``args`` are %-formatted into the message
+        only if the message is actually logged."""
+        if self.comm.Get_rank() == 0:
             if level == "info":
-                self.logger.info(message)
+                self.logger.info(message, *args)
             if level == "debug":
-                self.logger.debug(message)
+                self.logger.debug(message, *args)
+
+    def __barrier(self):
+        with self.timer.time("barrier"):
+            self.comm.Barrier()
+
+    def __set_trace_context(self):
+        if self.tracer is not None:
+            self.tracer.set_context(phase=self.__get_phase_name(), iteration=self.gmxapi.state.get("iteration"))
+
+    def write_trace(self, filename=None):
+        """Merge the spans of every rank of this member into one Chrome trace
+        (a collective call; see tracing.write_trace). Open it in
+        chrome://tracing or https://ui.perfetto.dev.
+
+        Parameters
+        ----------
+        filename : str, optional
+            by default ``<member_dir>/trace.json``
+        """
+        if self.tracer is None:
+            raise RuntimeError("This simulation is not being traced: pass trace=True")
+        self.tracer.write(filename or "{}/trace.json".format(self.member_dir), self.comm)
+
+    def __build_workflow(self, config=None, sites=None, clean=True):
+        config = config or self.gmxapi
+        if clean:
+            with self.timer.time("initialize_workflow"):
+                config.initialize_workflow(self.mdrun_args, sites=sites)
+        with self.timer.time("build_plugins"):
+            config.build_plugins(sites=sites)
 
     def build_plugins(self, clean=False):
         """Build the gmxapi plugins.
@@ -138,55 +455,322 @@ class Simulation():
         clean : bool, optional
             Delete all previous plugins?, by default False
         """
-        if clean:
-            self.gmxapi.initialize_workflow(self.mdrun_args)
-        self.gmxapi.build_plugins()
+        self.__build_workflow(clean=clean)
 
-    def run(self):
+    def run(self, wave_size=None):
         """Run the gmxapi workflow.
+
+        Parameters
+        ----------
+        wave_size : int, optional
+            the maximum number of test sites to run at once, by default the number of MPI ranks. If there are
+            more test sites than that, they run in waves (see scheduler.WaveScheduler) and the workflow is
+            rebuilt for every wave.
         """
-        self.gmxapi.change_to_test_directory()
+        helper = self.gmxapi.build_test_directory()
+        self.__set_trace_context()
 
         # Set up gmxapi run
         workdir_list = []
         test_sites = self.gmxapi.state.get("test_sites")
-        if test_sites:
-            for test_site in test_sites:
-                phase = self.gmxapi.state.get("phase", site_name=test_site)
-                workdir_list.append("{}/{}/{}".format(os.getcwd(), test_site, phase))
+        wave_size = wave_size or self.comm.Get_size()
+        pruner = self.__start_pruner(test_sites)
+        if test_sites and len(test_sites) > wave_size:
+            self.__run_waves(helper, test_sites, wave_size)
         else:
-            self.gmxapi.helper.change_dir("num_test_sites")
-            workdir_list = ["{}/production".format(os.getcwd())]
-        context = gmx.context.ParallelArrayContext(self.gmxapi.workflow, workdir_list=workdir_list, communicator=comm)
-        with context as session:
-            session.run()
+            if test_sites:
+                for test_site in test_sites:
+                    phase = self.gmxapi.state.get("phase", site_name=test_site)
+                    workdir_list.append(str(helper.get_path("phase", test_site=test_site, phase=phase)))
+            else:
+                workdir_list = [str(helper.get_path("production"))]
+            self.__run_session(workdir_list, sites=test_sites)
 
-        comm.Barrier()
+        self.__barrier()
+        if pruner:
+            pruner.stop()
         self.__parallel_log("The MD portion of the simulation has finished.")
 
-    def __training_pp(self):
+    def __start_pruner(self, test_sites, pipelined=False):
+        """Start watching the convergence runs of ``test_sites`` (on rank 0, if
+        pruning is enabled and the sites are converging, or with ``pipelined``
+        will converge once they have trained)."""
+        if not self.pruning or not test_sites or self.comm.Get_rank() != 0:
+            return None
+        phases = ["training", "convergence"] if pipelined else ["convergence"]
+        if any(self.gmxapi.state.get("phase", site_name=site) not in phases for site in test_sites):
+            return None
+        log_files = dict(zip(test_sites, self.__get_log_files("convergence", test_sites)))
+        return ConvergencePruner(log_files, convergence_work, **self.pruning).start()
+
+    def run_phases(self, num_iterations=None, num_phases=None, pipelined=False, wave_size=None):
+        """Run phase after phase in this process, instead of relaunching for
+        each phase. The state, communicator and directory layouts are kept;
+        only the gmxapi workflow is rebuilt for every phase.
+
+        Parameters
+        ----------
+        num_iterations : int, optional
+            stop once this many more BRER iterations have finished.
+        num_phases : int, optional
+            stop after this many phases (with ``pipelined``, training and convergence count as one).
+            If the simulation is traced, the trace is written when the last phase has finished.
+        pipelined : bool, optional
+            run training and convergence with run_pipelined, by default False
+        wave_size : int, optional
+            see run.
+
+        Returns
+        -------
+        int
+            the number of phases that were run.
+
+        Example
+        -------
+        >>> simulation = Simulation(tpr, ensemble_dir, ensemble_num, site_filename, deer_data_filename)
+        >>> simulation.run_phases(num_iterations=5)
+        """
+        if num_iterations is None and num_phases is None:
+            raise ValueError("Give the number of iterations or phases to run")
+        last_iteration = None
+        if num_iterations is not None:
+            last_iteration = self.gmxapi.state.get("iteration") + num_iterations
+
+        phases_run = 0
+        while True:
+            if last_iteration is not None and self.gmxapi.state.get("iteration") >= last_iteration:
+                break
+            if num_phases is not None and phases_run >= num_phases:
+                break
+            if pipelined and self.gmxapi.state.get("test_sites"):
+                self.run_pipelined()
+            else:
+                self.build_plugins(clean=True)
+                self.run(wave_size=wave_size)
+            self.post_process()
+            phases_run += 1
+            self.__parallel_log("Finished phase {} (iteration {})".format(phases_run,
+                                                                          self.gmxapi.state.get("iteration")))
+        if self.tracer is not None:
+            self.write_trace()
+        return phases_run
+
+    def __run_session(self, workdir_list, config=None, sites=None, phase=None):
+        """Run one gmxapi session over ``workdir_list`` (one per rank of the
+        configuration's communicator). ``sites`` (in the same order) and
+        ``phase`` only label the trace.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            the stage-out of this rank's directory, if it ran in scratch, otherwise None.
+        """
+        config = config or self.gmxapi
+        # Each rank stages the working directory it runs; the scratch paths are the same on every node.
+        rank = config.comm.Get_rank()
+        canonical_list = workdir_list
+        if self.stager:
+            if rank < len(canonical_list):
+                with self.timer.time("staging"):
+                    self.stager.stage_in(canonical_list[rank])
+            workdir_list = [self.stager.get_scratch_path(workdir) for workdir in canonical_list]
+
+        watcher = None
+        if self.pruning and rank < len(canonical_list) and os.path.basename(canonical_list[rank]) == "convergence":
+            watcher = PruneWatcher(canonical_list[rank], interval=self.pruning.get("interval", 30.)).start()
+
+        context = get_engine().ParallelArrayContext(config.workflow,
+                                                    workdir_list=workdir_list,
+                                                    communicator=config.comm)
+        span = {"site": sites[rank] if sites and rank < len(sites) else None}
+        if phase:
+            span["phase"] = phase
+        with context as session, self.timer.time("run", **span):
+            if watcher:
+                # mdrun can only be stopped while it is running
+                with watcher.running():
+                    session.run()
+            else:
+                session.run()
+        if watcher:
+            watcher.cancel()
+
+        if self.stager and rank < len(canonical_list):
+            # Copied back in the background; post_process waits for it.
+            return self.stager.stage_out(canonical_list[rank])
+        return None
+
+    def __run_waves(self, helper, test_sites, wave_size):
+        phase = self.gmxapi.state.get("phase", site_name=test_sites[0])
+        scheduler = WaveScheduler(test_sites,
+                                  wave_size,
+                                  status_file=str(helper.get_path("num_test_sites") / "waves.json"),
+                                  phase=phase)
+        waves = scheduler.get_waves()
+        for number, wave in enumerate(waves):
+            self.__parallel_log("Running {} wave {}/{}: {}".format(phase, number + 1, len(waves), wave))
+            self.__build_workflow(sites=wave)
+            self.__run_session([str(helper.get_path("phase", test_site=site, phase=phase)) for site in wave],
+                               sites=wave)
+            self.__barrier()
+            scheduler.mark_complete(wave, write=self.comm.Get_rank() == 0)
+
+    def run_pipelined(self):
+        """Run training and convergence without waiting for the other sites in
+        between.
+
+        Each rank takes its share of the test sites and runs every site on its
+        own (on MPI.COMM_SELF): as soon as a site's training has finished, its
+        alpha is read from the training log and its convergence run starts. The
+        ranks only meet once all their sites have converged, to share the alphas;
+        after that, post_process does the Boltzmann selection as usual.
+
+        In production there is only one run, so this is the same as ``run``.
+        """
         test_sites = self.gmxapi.state.get("test_sites")
-        assert test_sites
-        for test_site in test_sites:
+        if not test_sites:
+            return self.run()
+
+        helper = self.gmxapi.build_test_directory()
+        self.__set_trace_context()
+        from mpi4py import MPI
+
+        config = self.gmxapi.split(MPI.COMM_SELF)
+        pruner = self.__start_pruner(test_sites, pipelined=True)
+        alphas = {}
+        for test_site in test_sites[self.comm.Get_rank()::self.comm.Get_size()]:
+            if self.gmxapi.state.get("phase", site_name=test_site) == "training":
+                stage_out = self.__run_site(config, helper, test_site, "training")
+                if stage_out is not None:
+                    stage_out.result()
+                log_file = self.__get_log_files("training", [test_site])[0]
+                if not os.path.exists(log_file):
+                    raise FileNotFoundError("The log file {} was not written properly".format(log_file))
+                alphas[test_site] = float(final_fields(log_file)[5])
+                self.gmxapi.state.set(alpha=alphas[test_site], phase="convergence", site_name=test_site)
+                self.__parallel_log("{} has finished training (alpha = {})".format(test_site, alphas[test_site]))
+            self.__run_site(config, helper, test_site, "convergence")
+
+        # Every rank needs every alpha for the state it writes
+        with self.timer.time("collectives"):
+            alphas = allreduce_values(alphas, test_sites, self.comm)
+        for test_site, alpha in alphas.items():
+            self.gmxapi.state.set(alpha=alpha, phase="convergence", site_name=test_site)
+        self.__barrier()
+        if pruner:
+            pruner.stop()
+        self.__parallel_log("The MD portion of the simulation has finished.")
+
+    def __run_site(self, config, helper, test_site, phase):
+        self.__build_workflow(config, sites=[test_site])
+        return self.__run_session([str(helper.get_path("phase", test_site=test_site, phase=phase))],
+                                  config=config,
+                                  sites=[test_site],
+                                  phase=phase)
+
+    def __get_phases(self):
+        return [self.gmxapi.state.get("phase", site_name=name) for name in self.gmxapi.state.names]
+
+    def __get_log_files(self, phase, test_sites):
+        helper = self.gmxapi.build_test_directory()
+        return [
+            str(helper.get_path("phase", test_site=test_site, phase=phase) / "{}.log".format(test_site))
+            for test_site in test_sites
+        ]
+
+    def __read_logs(self, parse_map=map):
+        """Parse the log files needed to post-process the current phases.
+
+        Parameters
+        ----------
+        parse_map : callable, optional
+            used as ``parse_map(parser, log_files)``; pass e.g. ``ThreadPoolExecutor.map`` to read the logs
+            concurrently, by default map
+
+        Returns
+        -------
+        dict
+            {'alpha': {site: alpha}} after training, {'work': {site: work}, 'start_time': t, 'pruned': [sites]}
+            after convergence (rank 0 only), or {}. Pruned sites are left out of the work.
+        """
+        parser, log_files, collect = self.__plan_read_logs()
+        if parser is None:
+            return {}
+        return collect(list(parse_map(parser, log_files)))
+
+    def __plan_read_logs(self):
+        """Work out which logs __read_logs has to parse, without parsing them.
+
+        Everything that touches the state, the communicator or the test directory happens here, so that only the
+        parsing itself has to leave the calling thread.
+
+        Returns
+        -------
+        tuple
+            (parser, log_files, collect): ``collect`` turns the parser's results, in the order of ``log_files``,
+            into the dictionary returned by __read_logs. ``parser`` is None when there is nothing to read.
+        """
+        test_sites = self.gmxapi.state.get("test_sites")
+        phases = self.__get_phases()
+        if "training" in phases:
+            assert test_sites
             # Get alpha.
             # TODO: pull this from the context.
-            self.gmxapi.helper.change_dir(level="phase", test_site=test_site, phase="training")
-            log_file = "{}.log".format(test_site)
-            if not os.path.exists(log_file):
-                raise FileNotFoundError("The log file {} was not written properly".format(log_file))
-            with open(log_file, "r") as fh:
-                for line in fh:
-                    pass
-                alpha = float(line.split()[5])
-                self.gmxapi.state.set(alpha=alpha, site_name=test_site)
+            log_files = self.__get_log_files("training", test_sites)
+            for log_file in log_files:
+                if not os.path.exists(log_file):
+                    raise FileNotFoundError("The log file {} was not written properly".format(log_file))
+
+            def collect(results):
+                return {"alpha": dict(zip(test_sites, [float(fields[5]) for fields in results]))}
+
+            return final_fields, log_files, collect
+        if "convergence" in phases and self.comm.Get_rank() == 0:
+            assert test_sites
+            helper = self.gmxapi.build_test_directory()
+            pruned = [
+                site for site in test_sites
+                if is_pruned(helper.get_path("phase", test_site=site, phase="convergence"))
+            ]
+            if len(pruned) == len(test_sites):
+                # Should not happen (the leader is never pruned), but there has to be something to choose from
+                pruned = []
+
+            def collect(results):
+                return {
+                    "work": {site_name: work for site_name, work, _ in results if site_name not in pruned},
+                    "start_time": max([0] + [end_time for _, _, end_time in results]),
+                    "pruned": pruned
+                }
+
+            return convergence_work, self.__get_log_files("convergence", test_sites), collect
+        return None, [], None
+
+    def __training_pp(self, alphas):
+        test_sites = self.gmxapi.state.get("test_sites")
+        assert test_sites
+        for test_site in test_sites:
+            self.gmxapi.state.set(alpha=alphas[test_site], site_name=test_site)
             self.gmxapi.state.set(phase="convergence", site_name=test_site)
+        return []
 
-    def __convergence_pp(self):
-        self.gmxapi.change_to_test_directory()
+    def __convergence_pp(self, work=None, start_time=0, pruned=None):
+        helper = self.gmxapi.build_test_directory()
 
         test_sites = self.gmxapi.state.get("test_sites")
         assert test_sites
-        fixed_site = self.re_sample()
+        # Everything rank 0 decided goes out in one broadcast
+        selected = self.re_sample(work=work, broadcast=False)
+        with self.timer.time("collectives"):
+            fixed_site, start_time, pruned = bcast_decisions(self.comm,
+                                                             test_sites,
+                                                             selected=selected,
+                                                             start_time=start_time,
+                                                             pruned=pruned or [])
+
+        # Record which convergence runs were stopped early
+        for test_site in pruned:
+            self.gmxapi.state.set(pruned=True, site_name=test_site)
 
         for test_site in test_sites:
             if test_site == fixed_site:
@@ -195,23 +779,35 @@ class Simulation():
                 on = False
             self.gmxapi.state.set(phase="production", testing=False, on=on, site_name=test_site)
 
-        # Get the production start_time from the final log files
-        log_files = ["{}/convergence/{}.log".format(test_site, test_site) for test_site in test_sites]
-        self.gmxapi.state.set(start_time=final_time(log_files), test_sites=[])
+        # The production start_time is the final time in the convergence logs
+        self.gmxapi.state.set(start_time=start_time, test_sites=[])
 
         # Move the checkpoint to the production directory
-        convergence_cpt = "{}/{}/convergence/state.cpt".format(os.getcwd(), fixed_site)
-        production_cpt = "{}/production/state.cpt".format(os.getcwd())
-        shutil.copy(convergence_cpt, production_cpt)
-        self.__parallel_log("Writing cpt to {}".format(production_cpt))
+        convergence_cpt = helper.get_path("phase", test_site=fixed_site, phase="convergence") / "state.cpt"
+        production_cpt = helper.get_path("production") / "state.cpt"
+        ensemble_num, iteration = self.gmxapi.get("ensemble_num"), self.gmxapi.state.get("iteration")
+
+        def move_checkpoint():
+            digest = self.checkpoints.add(convergence_cpt)
+            self.checkpoints.checkout(digest, [production_cpt])
+            self.__record("record_checkpoints",
+                          ensemble_num,
+                          iteration, [convergence_cpt, production_cpt],
+                          digest=digest)
+            self.__parallel_log("Writing cpt to {}".format(production_cpt))
+
+        return [move_checkpoint] if self.comm.Get_rank() == 0 else []
 
     def __production_pp(self):
-        self.gmxapi.change_to_test_directory()
+        # The production checkpoint lives in the directory for the *current* number of test sites
+        production_cpt = self.gmxapi.build_test_directory().get_path("production") / "state.cpt"
         test_sites = []
         for name in self.gmxapi.state.names:
             # Set up for the next round of training.
             if not self.gmxapi.state.get("on", site_name=name):
                 self.gmxapi.state.set(on=True, testing=True, phase="training", site_name=name)
+                if "pruned" in self.gmxapi.state.pair_params[name].get_as_dictionary():
+                    self.gmxapi.state.set(pruned=False, site_name=name)
                 test_sites.append(name)
 
         # Update the iteration number if num_sites is zero
@@ -221,89 +817,316 @@ class Simulation():
         #TODO: don't store the test sites in two places!!
         self.gmxapi.set(test_sites=test_sites)
         self.gmxapi.state.set(test_sites=test_sites)
+        # The sites train again, towards new targets (as they would after a relaunch)
+        self.__select_targets()
         # Move the checkpoint to the new training and convergence directories.
-        production_cpt = "{}/production/state.cpt".format(os.getcwd())
-        self.gmxapi.change_to_test_directory()
-        training_cpts = ["{}/{}/training/state.cpt".format(os.getcwd(), test_site) for test_site in test_sites]
-        convergence_cpts = ["{}/{}/convergence/state.cpt".format(os.getcwd(), test_site) for test_site in test_sites]
-        for training_cpt in training_cpts:
-            shutil.copy(production_cpt, training_cpt)
-            self.__parallel_log("Writing cpt {} to {}".format(production_cpt, training_cpt))
-        for convergence_cpt in convergence_cpts:
-            shutil.copy(production_cpt, convergence_cpt)
-            self.__parallel_log("Writing cpt {} to {}".format(production_cpt, convergence_cpt))
+        helper = self.gmxapi.build_test_directory()
+        training_cpts = [
+            helper.get_path("phase", test_site=test_site, phase="training") / "state.cpt" for test_site in test_sites
+        ]
+        convergence_cpts = [
+            helper.get_path("phase", test_site=test_site, phase="convergence") / "state.cpt"
+            for test_site in test_sites
+        ]
+        if self.comm.Get_rank() == 0:
+            # A marker left in these directories (e.g. by an earlier launch) must not prune the new runs
+            for test_site in test_sites:
+                clear_markers(helper.get_path("phase", test_site=test_site, phase="convergence"))
+        ensemble_num, iteration = self.gmxapi.get("ensemble_num"), self.gmxapi.state.get("iteration")
 
-    def post_process(self):
-        phases = [self.gmxapi.state.get("phase", site_name=name) for name in self.gmxapi.state.names]
+        def fan_out_checkpoint():
+            digest = self.checkpoints.add(production_cpt)
+            methods = self.checkpoints.checkout(digest, training_cpts + convergence_cpts)
+            self.__record("record_checkpoints",
+                          ensemble_num,
+                          iteration, [production_cpt] + training_cpts + convergence_cpts,
+                          digest=digest)
+            for cpt, method in methods.items():
+                self.__parallel_log("Writing cpt {} to {} ({})".format(production_cpt, cpt, method))
+            # Checkpoints that no directory links to any more (e.g. replaced ones) take up space for nothing
+            removed = self.checkpoints.prune(min_age=PRUNE_AGE)
+            if removed:
+                self.__parallel_log("Removed {} unused checkpoints from the store".format(len(removed)))
+
+        # post_process waits on a barrier afterwards, so the other ranks will see the checkpoints
+        return [fan_out_checkpoint] if self.comm.Get_rank() == 0 else []
+
+    def __update_phases(self, logs):
+        """Move every pair on to its next phase.
+
+        Returns
+        -------
+        list
+            the file operations (checkpoint moves) that still have to be done on this rank, as callables.
+        """
+        phases = self.__get_phases()
         if "training" in phases:
-            self.__training_pp()
+            with self.timer.time("training_pp"):
+                return self.__training_pp(logs["alpha"])
         elif "convergence" in phases:
-            self.__convergence_pp()
+            with self.timer.time("convergence_pp"):
+                return self.__convergence_pp(logs.get("work"), logs.get("start_time", 0), logs.get("pruned"))
         elif all(phase == "production" for phase in phases):
-            self.__production_pp()
+            with self.timer.time("production_pp"):
+                return self.__production_pp()
         else:
             raise ValueError(
                 "{} is not a valid set of phases".format(phases))
 
-        comm.Barrier()
+    def __get_phase_name(self):
+        phases = self.__get_phases()
+        for phase in ["training", "convergence"]:
+            if phase in phases:
+                return phase
+        return "production"
+
+    def __timed(self, stage, function):
+        def timed_function(*args, **kwargs):
+            with self.timer.time(stage):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+    def __collect_throughput(self, phase):
+        """Read the MD throughput of the phase that just ran from its md.log
+        files and record it in the catalog, if any (rank 0 only; see throughput).
+
+        Returns
+        -------
+        list
+            the result of throughput.collect, or None on other ranks.
+        """
+        if self.comm.Get_rank() != 0:
+            return None
+        helper = self.gmxapi.build_test_directory()
+        if phase == "production":
+            workdirs = {"production": helper.get_path("production")}
+        else:
+            workdirs = {
+                test_site: helper.get_path("phase", test_site=test_site, phase=phase)
+                for test_site in self.gmxapi.state.get("test_sites")
+            }
+        rows = throughput.collect(workdirs)
+        if rows:
+            self.__record("record_throughput", self.gmxapi.get("ensemble_num"), self.gmxapi.state.get("iteration"),
+                          self.gmxapi.get("num_test_sites"), phase, rows)
+        return rows
+
+    def __report_metrics(self, phase, iteration, rows=None):
+        """Reduce the stage timers over the member's ranks, write them (and the
+        MD throughput) to the member directory (see metrics.write_metrics) and
+        start timing the next phase."""
+        stages = self.timer.reduce(self.comm)
+        if stages is not None:
+            write_metrics(self.member_dir,
+                          stages,
+                          self.gmxapi.get("ensemble_num"),
+                          iteration,
+                          phase,
+                          self.comm.Get_size(),
+                          throughput=rows)
+        self.timer.reset()
+
+    def post_process(self):
+        phase, iteration = self.__get_phase_name(), self.gmxapi.state.get("iteration")
+        self.__set_trace_context()
+        if self.stager:
+            with self.timer.time("staging"):
+                self.stager.wait()
+            self.__barrier()
+
+        with self.timer.time("read_logs"):
+            logs = self.__read_logs()
+            rows = self.__collect_throughput(phase)
+        for io_step in self.__update_phases(logs):
+            with self.timer.time("checkpoints"):
+                io_step()
+
+        self.__barrier()
         self.__parallel_log("Phases have been set to: {}".format(" ".join(
             [self.gmxapi.state.get("phase", site_name=site_name) for site_name in self.gmxapi.state.names])),
                             level="debug")
 
-        self.gmxapi.state.write_to_json()
+        with self.timer.time("write_state"):
+            self.gmxapi.state.write_to_json()
+        self.__report_metrics(phase, iteration, rows)
+
+    async def post_process_async(self, build_next=False, max_workers=8):
+        """Same as post_process, but with the file I/O overlapped: the logs are
+        parsed concurrently, and the checkpoint moves run in worker threads while
+        (optionally) the workflow for the next phase is assembled. The state is
+        written once the checkpoints are in place, and everything ends at a
+        single barrier.
+
+        MPI calls and the state only happen in the calling thread; the worker
+        threads just parse logs and move files.
+
+        Parameters
+        ----------
+        build_next : bool, optional
+            also call build_plugins(clean=True) for the next phase, by default False
+        max_workers : int, optional
+            number of I/O threads, by default 8
+
+        Example
+        -------
+        >>> simulation.run()
+        >>> run_until_complete(simulation.post_process_async(build_next=True))
+        >>> simulation.run()
+        """
+        phase, iteration = self.__get_phase_name(), self.gmxapi.state.get("iteration")
+        self.__set_trace_context()
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            if self.stager:
+                await loop.run_in_executor(executor, self.__timed("staging", self.stager.wait))
+                self.__barrier()
+
+            with self.timer.time("read_logs"):
+                logs = await self.read_logs_async(executor)
+                rows = self.__collect_throughput(phase)
+            io_steps = [
+                loop.run_in_executor(executor, self.__timed("checkpoints", io_step))
+                for io_step in self.__update_phases(logs)
+            ]
+            if build_next:
+                self.build_plugins(clean=True)
+            await asyncio.gather(*io_steps)
+        with self.timer.time("write_state"):
+            self.gmxapi.state.write_to_json()
 
-    def re_sample(self):
-        next_site = " "
-        if comm.Get_rank() == 0:
-            test_sites = self.gmxapi.state.get("test_sites")
-            self.gmxapi.change_to_test_directory()
-            log_files = ["{}/convergence/{}.log".format(test_site, test_site) for test_site in test_sites]
-            work, probs = work_calculation(log_files)
+        self.__parallel_log("Phases have been set to: {}".format(" ".join(
+            [self.gmxapi.state.get("phase", site_name=site_name) for site_name in self.gmxapi.state.names])),
+                            level="debug")
+        self.__barrier()
+        self.__report_metrics(phase, iteration, rows)
+
+    async def read_logs_async(self, executor):
+        """Parse the log files for the current phases concurrently in ``executor``.
+
+        The state, the communicator and the test directory are only used in the calling thread; the workers just
+        parse the logs.
+
+        Returns
+        -------
+        dict
+            see __read_logs.
+        """
+        parser, log_files, collect = self.__plan_read_logs()
+        if parser is None:
+            return {}
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[loop.run_in_executor(executor, parser, log_file) for log_file in log_files])
+        return collect(results)
+
+    def re_sample(self, work=None, broadcast=True):
+        """Choose the site to restrain in production from the Boltzmann weights
+        of the convergence work values.
+
+        Parameters
+        ----------
+        work : dict, optional
+            {site: work}; by default computed from the convergence logs.
+        broadcast : bool, optional
+            send the choice to every rank, by default True. Otherwise only rank 0 knows it.
+
+        Returns
+        -------
+        str
+            the chosen site (on every rank, or only on rank 0 if broadcast is False).
+        """
+        next_site = None
+        if self.comm.Get_rank() == 0:
+            if work is None:
+                test_sites = self.gmxapi.state.get("test_sites")
+                work, probs = work_calculation(self.__get_log_files("convergence", test_sites))
+            else:
+                probs = boltzmann_probabilities(work)
+            self.__record("record_work", self.gmxapi.get("ensemble_num"), self.gmxapi.state.get("iteration"),
+                          self.gmxapi.get("num_test_sites"), work, probs)
             self.__parallel_log("Work: {}".format(work))
             self.__parallel_log("Probabilities: {}".format(probs))
             next_site = np.random.choice(a=list(probs.keys()), p=list(probs.values()))
-        next_site = comm.bcast(next_site, root=0)
+        if broadcast:
+            with self.timer.time("collectives"):
+                next_site = bcast_choice(next_site, self.gmxapi.state.get("test_sites"), self.comm)
         return next_site
 
 
-def final_time(log_files: list):
+def run_until_complete(coroutine):
+    """Run a coroutine (e.g. Simulation.post_process_async) to completion in a
+    fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def final_fields(log_file):
+    """The whitespace-separated fields of the last line of a log file."""
+    with open_log(log_file) as fh:
+        for line in fh:
+            pass
+    return line.split()
+
+
+def final_time(log_files: list, comm=None):
+    comm = get_comm(comm)
     max_time = 0
     if comm.Get_rank() == 0:
         # Find the final time
         for log_file in log_files:
-            with open(log_file) as fh:
-                for line in fh:
-                    pass
-                final_time = float(line.split()[0])    
+            final_time = float(final_fields(log_file)[0])
             if final_time > max_time:
                 max_time = final_time
-    max_time = comm.bcast(max_time, root=0)
+    max_time = bcast_float(max_time, comm)
     return max_time
 
 
-def work_calculation(log_files: list):
-    work = {}
-    for fnm in log_files:
-        site_name = re.search("[0-9]+_[0-9]+", fnm).group(0)
-        data = []
-
-        # Calculate the total path distance
-        with open(fnm) as log_file:
-            newline = log_file.readline()  # read the header
-            while 1:
-                newline = log_file.readline()
-                if not newline:
-                    break
-                splitline = newline.split()
-                r, target, alpha = float(splitline[1]), float(splitline[2]), float(splitline[3])
-                data.append([r, alpha])
-        data = np.array(data)
-        delta_x = np.sum(np.abs(data[1:, 0] - data[:-1, 0]))
-
-        force_constant = alpha / target  # kJ/nm/mol
-        # Now the actual work value:
-        work[site_name] = delta_x * force_constant
+def convergence_work(fnm, until=None):
+    """Work done along the convergence path recorded in one log file.
 
+    Parameters
+    ----------
+    fnm : str
+        the convergence log.
+    until : float, optional
+        only the path up to this simulation time (ps), by default all of it.
+
+    Returns
+    -------
+    tuple
+        (site name, work, final time); (site name, 0., 0.) if there are no samples (up to ``until``) yet.
+    """
+    # Only look at the file name: the directories above it may contain digits and underscores too
+    site_name = re.search("[0-9]+_[0-9]+", os.path.basename(fnm)).group(0)
+    data = []
+
+    # Calculate the total path distance
+    with open_log(fnm) as log_file:
+        newline = log_file.readline()  # read the header
+        while 1:
+            newline = log_file.readline()
+            if not newline:
+                break
+            splitline = newline.split()
+            if until is not None and float(splitline[0]) > until:
+                break
+            r, target, alpha = float(splitline[1]), float(splitline[2]), float(splitline[3])
+            data.append([float(splitline[0]), r, alpha])
+    if not data:
+        # Only the header so far, or nothing up to ``until``: no path yet
+        return site_name, 0., 0.
+    data = np.array(data)
+    delta_x = np.sum(np.abs(data[1:, 1] - data[:-1, 1]))
+
+    force_constant = alpha / target  # kJ/nm/mol
+    # Now the actual work value:
+    return site_name, delta_x * force_constant, data[-1, 0]
+
+
+def boltzmann_probabilities(work: dict):
     boltzmann = {}
     RT = 2.479  # kJ/mol
 
@@ -315,4 +1138,11 @@ def work_calculation(log_files: list):
     for site_name in work:
         probs[site_name] = boltzmann[site_name] / z
 
-    return work, probs
\ No newline at end of file
+    return probs
+
+
+def work_calculation(log_files: list):
+    work = {}
+    for site_name, site_work, _ in map(convergence_work, log_files):
+        work[site_name] = site_work
+    return work, boltzmann_probabilities(work)
@@ -4,11 +4,14 @@
 """
 from wzm_wzt.metadata import MetaData, site_to_str, backup_file
 from wzm_wzt.experimental_data import ExperimentalData
+from wzm_wzt.target_allocation import allocate
+from wzm_wzt.comms import get_comm
 import warnings
+import logging
+import sqlite3
 import numpy
 import json
 import os
-from mpi4py import MPI
 
 
 class GeneralParams(MetaData):
@@ -109,6 +112,10 @@ class State(MetaData):
         self.pair_params = {}
         self.json = filename
         self.names = []
+        # Optional catalog.RunCatalog that is updated whenever the state is written
+        self.catalog = None
+        # The ranks that share this state; only the first one writes it. By default MPI.COMM_WORLD
+        self.comm = None
     
     def re_sample_targets(self):
         distribution = self.get('distribution')
@@ -116,6 +123,59 @@ class State(MetaData):
         normalized = numpy.divide(distribution, numpy.sum(distribution))
         return numpy.random.choice(bins, p=normalized)
 
+    def get_allocation(self, ensemble_size, distribution, method='stratified', seed=0):
+        """The allocation of targets across the whole ensemble for every
+        iteration up to the current one (see target_allocation.allocate).
+
+        Parameters
+        ----------
+        ensemble_size : int
+            the number of ensemble members.
+        distribution : list
+            the DEER distribution as read from the DEER data, in the order of the bins. The state cannot supply
+            it: ``get`` returns lists sorted, and the state file is written that way.
+        method : str, optional
+            one of target_allocation.ALLOCATION_METHODS, by default 'stratified'
+        seed : int, optional
+            seed shared by all ensemble members, by default 0
+
+        Returns
+        -------
+        numpy.ndarray
+            bin indices of shape (ensemble_size, iteration + 1, number of pairs), the pairs in sorted order.
+        """
+        # Allocate every iteration up to this one so that methods which balance across iterations stay consistent
+        return allocate(distribution,
+                        ensemble_size,
+                        self.get('iteration') + 1,
+                        len(self.pair_params),
+                        method=method,
+                        rng=numpy.random.default_rng(seed))
+
+    def allocate_targets(self, ensemble_num, ensemble_size, distribution, method='stratified', seed=0):
+        """Draw this member's targets for the current iteration as its share of
+        an allocation across the whole ensemble (see target_allocation).
+
+        Every member that uses the same seed computes the same allocation, so no
+        communication between members is needed.
+
+        Parameters
+        ----------
+        ensemble_num : int
+            this ensemble member.
+        ensemble_size, distribution, method, seed
+            see get_allocation.
+
+        Returns
+        -------
+        dict
+            {pair name: target} for every pair.
+        """
+        names = sorted(self.pair_params.keys())
+        indices = self.get_allocation(ensemble_size, distribution, method=method, seed=seed)
+        bins = self.get('bins')
+        return {name: float(bins[index]) for name, index in zip(names, indices[ensemble_num, self.get('iteration')])}
+
     def set(self, site_name=None, **kwargs):
         for key, value in kwargs.items():
             if key in self.general_params.get_requirements():
@@ -171,9 +231,17 @@ class State(MetaData):
             self.names.append(site_name)
 
     def write_to_json(self):
-        if MPI.COMM_WORLD.Get_rank() == 0:
+        comm = get_comm(self.comm)
+        if comm.Get_rank() == 0:
             backup_file(self.json, 'copy')
             json.dump(self.get_as_dictionary(), open(self.json, "w"))
+            if self.catalog is not None:
+                # The state file is the record; the catalog can be rebuilt from it
+                try:
+                    self.catalog.record_state(self)
+                except sqlite3.Error as error:
+                    logging.getLogger("WZM-WZT").warning("Could not write to the run catalog {}: {}".format(
+                        self.catalog.filename, error))
 
     def new_iteration(self):
         self.set(iteration=(self._metadata["general_parameters"]["iteration"] + 1), start_time=0.)
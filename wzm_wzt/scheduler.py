@@ -0,0 +1,83 @@
+"""Runs more test sites than there are MPI ranks.
+
+ParallelArrayContext runs one working directory per rank, so training or
+convergence for N test sites would need N ranks. The WaveScheduler splits the
+test sites into waves of at most ``wave_size`` sites (by default the number of
+ranks) that run one after another with the same allocation. A gmxapi session is
+collective over all the ranks, so sites are handed out a wave at a time rather
+than from a per-rank queue.
+
+Completed sites are recorded in a small JSON file in the num_test_sites
+directory, so a job that is killed part of the way through only re-runs the
+waves it did not finish.
+"""
+
+import os
+import json
+
+
+class WaveScheduler():
+    def __init__(self, sites, wave_size, status_file=None, phase=None):
+        """Split test sites into waves.
+
+        Parameters
+        ----------
+        sites : list
+            the test sites.
+        wave_size : int
+            the maximum number of sites that run at once (usually the number of MPI ranks).
+        status_file : str, optional
+            JSON file to track completed sites in, by default completion is only tracked in memory.
+        phase : str, optional
+            the phase being run; completion is tracked separately for each phase.
+        """
+        if wave_size < 1:
+            raise ValueError("The wave size must be at least 1, not {}".format(wave_size))
+        self.sites = sorted(sites)
+        self.wave_size = wave_size
+        self.status_file = status_file
+        self.phase = phase
+        self._status = {}
+        if status_file and os.path.exists(status_file):
+            self._status = json.load(open(status_file))
+
+    def get_complete(self):
+        """The sites that have finished the current phase."""
+        return sorted(set(self._status.get(str(self.phase), [])) & set(self.sites))
+
+    def get_pending(self):
+        """The sites that still have to run the current phase."""
+        complete = set(self.get_complete())
+        return [site for site in self.sites if site not in complete]
+
+    def get_waves(self):
+        """The pending sites, split into waves of at most ``wave_size`` sites.
+
+        Returns
+        -------
+        list
+            list of lists of sites.
+        """
+        pending = self.get_pending()
+        return [pending[i:i + self.wave_size] for i in range(0, len(pending), self.wave_size)]
+
+    def is_complete(self):
+        return not self.get_pending()
+
+    def mark_complete(self, sites, write=True):
+        """Record that ``sites`` have finished the current phase.
+
+        Parameters
+        ----------
+        sites : list
+            the sites that finished.
+        write : bool, optional
+            write the status file (only rank 0 should), by default True
+        """
+        complete = set(self._status.get(str(self.phase), [])) | set(sites)
+        self._status[str(self.phase)] = sorted(complete)
+        if write and self.status_file:
+            tmp = "{}.tmp".format(self.status_file)
+            with open(tmp, "w") as fh:
+                json.dump(self._status, fh)
+            os.replace(tmp, self.status_file)
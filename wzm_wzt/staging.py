@@ -0,0 +1,112 @@
+"""Runs phases in node-local scratch directories.
+
+The DirectoryHelper layout on the shared ensemble filesystem stays the canonical
+location of every phase. With staging, each rank runs its phase in a mirror of
+that directory on node-local scratch: inputs (the checkpoint, and anything else
+already in the canonical directory) are copied in before the run, and all
+outputs are copied back in a background thread after ``session.run()``.
+
+The scratch path of a phase is its path relative to the ensemble directory,
+under the scratch directory, so it is the same string on every node; only the
+rank that runs a phase ever creates it.
+"""
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ScratchStager():
+    def __init__(self, ensemble_dir, scratch_dir, max_workers=4):
+        """Stage phase working directories to and from node-local scratch.
+
+        Parameters
+        ----------
+        ensemble_dir : str
+            the top-level ensemble directory (on the shared filesystem).
+        scratch_dir : str
+            a node-local directory, e.g. $TMPDIR.
+        max_workers : int, optional
+            number of threads used to copy outputs back, by default 4
+        """
+        self.ensemble_dir = os.path.abspath(str(ensemble_dir))
+        self.scratch_dir = os.path.abspath(str(scratch_dir))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = []
+
+    def get_scratch_path(self, canonical):
+        """The node-local mirror of a canonical working directory."""
+        return os.path.join(self.scratch_dir, os.path.relpath(os.path.abspath(str(canonical)), self.ensemble_dir))
+
+    def stage_in(self, canonical):
+        """Create the scratch directory for a phase and copy its inputs in.
+
+        Parameters
+        ----------
+        canonical : str
+            the canonical working directory (see DirectoryHelper.get_path).
+
+        Returns
+        -------
+        str
+            the scratch working directory.
+        """
+        scratch = self.get_scratch_path(canonical)
+        os.makedirs(scratch, exist_ok=True)
+        for fnm in os.listdir(str(canonical)):
+            source = os.path.join(str(canonical), fnm)
+            if os.path.isfile(source):
+                shutil.copy2(source, os.path.join(scratch, fnm))
+        return scratch
+
+    def _copy_back(self, scratch, canonical):
+        copied = []
+        for root, _, files in os.walk(scratch):
+            destination_dir = os.path.join(str(canonical), os.path.relpath(root, scratch))
+            os.makedirs(destination_dir, exist_ok=True)
+            for fnm in files:
+                source = os.path.join(root, fnm)
+                destination = os.path.join(destination_dir, fnm)
+                if os.path.exists(destination) and os.path.getmtime(destination) >= os.path.getmtime(source) \
+                        and os.path.getsize(destination) == os.path.getsize(source):
+                    # An input that the run did not touch
+                    continue
+                # Write through a temporary file so readers never see a partial log or checkpoint
+                tmp = "{}.{}.tmp".format(destination, os.getpid())
+                shutil.copy2(source, tmp)
+                os.replace(tmp, destination)
+                copied.append(destination)
+        shutil.rmtree(scratch)
+        return copied
+
+    def stage_out(self, canonical):
+        """Start copying a phase's outputs back to the canonical directory in
+        the background. The scratch directory is removed afterwards.
+
+        Parameters
+        ----------
+        canonical : str
+            the canonical working directory.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            resolves to the list of files that were copied back.
+        """
+        future = self._executor.submit(self._copy_back, self.get_scratch_path(canonical), canonical)
+        self._pending.append(future)
+        return future
+
+    def wait(self):
+        """Wait for every pending stage-out (re-raising any copy error).
+
+        Returns
+        -------
+        list
+            all the files that were copied back.
+        """
+        pending, self._pending = self._pending, []
+        copied = []
+        for future in pending:
+            copied.extend(future.result())
+        return copied
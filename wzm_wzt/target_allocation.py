@@ -0,0 +1,198 @@
+"""Allocation of training targets across the ensemble.
+
+Drawing every member's target independently (``numpy.random.choice``) only
+reproduces the DEER histogram once the ensemble is large. The allocation methods
+below share the draws out across ensemble members so that a small ensemble
+already covers the distribution:
+
+    - 'independent'      independent draws for every member (the original behavior).
+    - 'stratified'       for every iteration and pair, the distribution is split into num_members
+                         equal-probability strata and each member gets one stratum at random.
+    - 'latin_hypercube'  stratified as above, but the strata are also balanced over iterations
+                         (a random Latin square per pair), so each member visits every stratum
+                         once every num_members iterations.
+    - 'halton'           a randomly shifted Halton sequence over the pairs, so the *joint*
+                         distribution of targets across pairs is covered evenly as well.
+
+All methods produce uniform variates on [0, 1) which are mapped onto the DEER
+bins with the inverse CDF, and all of them are deterministic given a seed, so
+members that share a seed agree on the allocation without communicating.
+"""
+
+import numpy
+
+ALLOCATION_METHODS = ['independent', 'stratified', 'latin_hypercube', 'halton']
+
+
+def inverse_cdf(distribution, u):
+    """Map uniform variates on [0, 1) onto bin indices of a (not necessarily
+    normalized) discrete distribution.
+
+    Parameters
+    ----------
+    distribution : list
+        the DEER distribution (one weight per bin).
+    u : numpy.ndarray
+        uniform variates of any shape.
+
+    Returns
+    -------
+    numpy.ndarray
+        bin indices with the same shape as ``u``.
+    """
+    cdf = numpy.cumsum(distribution, dtype=float)
+    cdf /= cdf[-1]
+    indices = numpy.searchsorted(cdf, u, side='right')
+    return numpy.minimum(indices, len(cdf) - 1)
+
+
+def primes(n):
+    """The first n prime numbers."""
+    found = []
+    candidate = 2
+    while len(found) < n:
+        if all(candidate % p for p in found if p * p <= candidate):
+            found.append(candidate)
+        candidate += 1
+    return numpy.array(found)
+
+
+def halton(num_points, num_dims, start=1):
+    """Points of the Halton low-discrepancy sequence.
+
+    Parameters
+    ----------
+    num_points : int
+        number of points.
+    num_dims : int
+        dimension of each point (one prime base per dimension).
+    start : int, optional
+        index of the first point, by default 1 (the zeroth point is the origin).
+
+    Returns
+    -------
+    numpy.ndarray
+        array of shape (num_points, num_dims) with entries in [0, 1).
+    """
+    bases = primes(num_dims)
+    n = numpy.repeat(numpy.arange(start, start + num_points)[:, numpy.newaxis], num_dims, axis=1)
+    points = numpy.zeros(n.shape)
+    scale = 1. / bases
+    while numpy.any(n):
+        points += scale * (n % bases)
+        n //= bases
+        scale /= bases
+    return points
+
+
+def allocate_uniforms(num_members, num_iterations, num_pairs, method='independent', rng=None):
+    """Uniform variates for every (iteration, pair, member).
+
+    Parameters
+    ----------
+    num_members : int
+        number of ensemble members.
+    num_iterations : int
+        number of BRER iterations.
+    num_pairs : int
+        number of restrained pairs.
+    method : str, optional
+        one of ALLOCATION_METHODS, by default 'independent'
+    rng : numpy.random.Generator, optional
+        random number generator, by default a freshly seeded one.
+
+    Returns
+    -------
+    numpy.ndarray
+        array of shape (num_iterations, num_pairs, num_members) with entries in [0, 1).
+    """
+    if method not in ALLOCATION_METHODS:
+        raise ValueError("{} is not a valid allocation method: choose one of {}".format(method, ALLOCATION_METHODS))
+    if rng is None:
+        rng = numpy.random.default_rng()
+    shape = (num_iterations, num_pairs, num_members)
+
+    if method == 'independent':
+        return rng.random(shape)
+
+    if method == 'stratified':
+        strata = numpy.argsort(rng.random(shape), axis=-1)
+
+    elif method == 'latin_hypercube':
+        # stratum = (row[member] + column[iteration]) % num_members is a Latin square; a fresh square is drawn
+        # for every block of num_members iterations.
+        num_blocks = -(-num_iterations // num_members)
+        rows = numpy.argsort(rng.random((num_blocks, num_pairs, num_members)), axis=-1)
+        columns = numpy.argsort(rng.random((num_blocks, num_pairs, num_members)), axis=-1)
+        strata = (rows[:, :, numpy.newaxis, :] + columns[:, :, :, numpy.newaxis]) % num_members
+        strata = strata.transpose(0, 2, 1, 3).reshape(num_blocks * num_members, num_pairs,
+                                                      num_members)[:num_iterations]
+
+    else:
+        # Cranley-Patterson rotation of the same Halton points for every iteration
+        points = halton(num_members, num_pairs).T
+        shifts = rng.random((num_iterations, num_pairs, 1))
+        return (points[numpy.newaxis] + shifts) % 1.
+
+    return (strata + rng.random(shape)) / num_members
+
+
+def allocate(distribution, num_members, num_iterations, num_pairs, method='independent', rng=None):
+    """Allocate target bins to every (member, iteration, pair).
+
+    Parameters
+    ----------
+    distribution : list
+        the DEER distribution.
+    num_members : int
+        number of ensemble members.
+    num_iterations : int
+        number of BRER iterations.
+    num_pairs : int
+        number of restrained pairs.
+    method : str, optional
+        one of ALLOCATION_METHODS, by default 'independent'
+    rng : numpy.random.Generator, optional
+        random number generator, by default a freshly seeded one.
+
+    Returns
+    -------
+    numpy.ndarray
+        bin indices of shape (num_members, num_iterations, num_pairs).
+    """
+    u = allocate_uniforms(num_members, num_iterations, num_pairs, method=method, rng=rng)
+    return inverse_cdf(distribution, u).transpose(2, 0, 1)
+
+
+def discrepancy(indices, distribution):
+    """How far the allocated targets are from the DEER distribution.
+
+    This is the Kolmogorov-Smirnov distance (the one-dimensional star discrepancy)
+    between the histogram of the ensemble's targets and the DEER distribution:
+    independent draws converge as 1/sqrt(num_members), the stratified methods
+    as 1/num_members.
+
+    Parameters
+    ----------
+    indices : numpy.ndarray
+        bin indices of shape (num_members, num_iterations, num_pairs), as returned by ``allocate``.
+    distribution : list
+        the DEER distribution.
+
+    Returns
+    -------
+    numpy.ndarray
+        the discrepancy of the ensemble for every (iteration, pair), shape (num_iterations, num_pairs).
+    """
+    indices = numpy.asarray(indices)
+    num_bins = len(distribution)
+    cdf = numpy.cumsum(distribution, dtype=float)
+    cdf /= cdf[-1]
+
+    # Histogram every (iteration, pair) at once by offsetting the bin indices
+    columns = indices.reshape(indices.shape[0], -1)
+    offsets = numpy.arange(columns.shape[1]) * num_bins
+    counts = numpy.bincount((columns + offsets).ravel(), minlength=columns.shape[1] * num_bins)
+    ecdf = numpy.cumsum(counts.reshape(-1, num_bins), axis=1) / indices.shape[0]
+
+    return numpy.max(numpy.abs(ecdf - cdf), axis=1).reshape(indices.shape[1:])
@@ -0,0 +1,148 @@
+"""Pre-generated training targets for a whole BRER ensemble.
+
+Rather than having every ensemble member draw (and broadcast) a new target each
+time it enters the training phase, a TargetSchedule draws the targets for all
+members, iterations and pairs at once and stores them in a small .npz file.
+Targets are stored as indices into the DEER ``bins`` so the file stays compact
+and the targets are exactly the bin values.
+
+Example
+-------
+>>> schedule = TargetSchedule.generate(distribution, bins, names, num_members=100, num_iterations=20,
+...                                    method='latin_hypercube')
+>>> schedule.save('targets.npz')
+>>> TargetSchedule.load('targets.npz').get(ensemble_num=37, iteration=4)
+{'3673_5636': 3.4, '3673_10088': 2.9, ...}
+"""
+
+import numpy
+from wzm_wzt.target_allocation import allocate, discrepancy
+
+
+class TargetSchedule():
+    def __init__(self, bins, names, indices):
+        """Training targets indexed by (ensemble member, iteration, pair).
+
+        Parameters
+        ----------
+        bins : list
+            the DEER bins; targets are stored as indices into this list.
+        names : list
+            the pair names (see metadata.site_to_str), one per column of ``indices``.
+        indices : numpy.ndarray
+            integer array of shape (num_members, num_iterations, num_pairs).
+        """
+        self.bins = numpy.asarray(bins, dtype=float)
+        self.names = [str(name) for name in names]
+        self.indices = numpy.asarray(indices)
+        if self.indices.ndim != 3 or self.indices.shape[2] != len(self.names):
+            raise ValueError("Target indices must have shape (num_members, num_iterations, {}), not {}".format(
+                len(self.names), self.indices.shape))
+        self._columns = {name: column for column, name in enumerate(self.names)}
+
+    @classmethod
+    def generate(cls, distribution, bins, names, num_members, num_iterations, method='independent', seed=None):
+        """Draw every target for the ensemble in one vectorized pass.
+
+        Parameters
+        ----------
+        distribution : list
+            the DEER distribution.
+        bins : list
+            the DEER bins.
+        names : list
+            the pair names.
+        num_members : int
+            number of ensemble members.
+        num_iterations : int
+            number of BRER iterations to plan for.
+        method : str, optional
+            how targets are shared out across the ensemble, one of target_allocation.ALLOCATION_METHODS,
+            by default 'independent'
+        seed : int, optional
+            seed for the random number generator, by default None
+
+        Returns
+        -------
+        TargetSchedule
+        """
+        if len(distribution) != len(bins):
+            raise ValueError("The distribution has {} entries but there are {} bins".format(
+                len(distribution), len(bins)))
+        indices = allocate(distribution,
+                           num_members,
+                           num_iterations,
+                           len(names),
+                           method=method,
+                           rng=numpy.random.default_rng(seed))
+        return cls(bins, names, indices.astype(numpy.min_scalar_type(len(bins) - 1)))
+
+    @classmethod
+    def load(cls, filename):
+        """Load a schedule written by TargetSchedule.save.
+
+        Parameters
+        ----------
+        filename : str
+            path to the .npz schedule file.
+        """
+        with numpy.load(filename) as data:
+            return cls(data['bins'], data['names'], data['indices'])
+
+    def save(self, filename):
+        """Write the schedule to a .npz file.
+
+        Parameters
+        ----------
+        filename : str
+            path to the schedule file.
+        """
+        with open(filename, 'wb') as fh:
+            numpy.savez(fh, bins=self.bins, names=numpy.array(self.names), indices=self.indices)
+
+    @property
+    def num_members(self):
+        return self.indices.shape[0]
+
+    @property
+    def num_iterations(self):
+        return self.indices.shape[1]
+
+    def get_targets(self):
+        """All targets as a float array of shape (num_members, num_iterations, num_pairs)."""
+        return self.bins[self.indices]
+
+    def get_discrepancy(self, distribution):
+        """The discrepancy between the scheduled targets and the DEER
+        distribution for every (iteration, pair); see target_allocation.discrepancy."""
+        return discrepancy(self.indices, distribution)
+
+    def get(self, ensemble_num, iteration, site_name=None):
+        """Look up the targets for one ensemble member and iteration.
+
+        Parameters
+        ----------
+        ensemble_num : int
+            the ensemble member.
+        iteration : int
+            the BRER iteration.
+        site_name : str, optional
+            if provided, only return the target for this pair.
+
+        Returns
+        -------
+        dict or float
+            a dictionary of {pair name: target}, or the target for ``site_name``.
+        """
+        if not 0 <= ensemble_num < self.num_members:
+            raise IndexError("Ensemble member {} is not in the schedule ({} members)".format(
+                ensemble_num, self.num_members))
+        if not 0 <= iteration < self.num_iterations:
+            raise IndexError("Iteration {} is not in the schedule ({} iterations)".format(
+                iteration, self.num_iterations))
+        row = self.bins[self.indices[ensemble_num, iteration]]
+        if site_name is not None:
+            if site_name not in self._columns:
+                raise KeyError("The pair {} is not in the schedule".format(site_name))
+            return float(row[self._columns[site_name]])
+        return {name: float(target) for name, target in zip(self.names, row)}
@@ -202,4 +202,12 @@ def simulation(data_dir, tmpdir):
         os.remove(statefile)
 
     sim = Simulation(tpr, ensemble_dir, ensemble_num, site_filename, deer_data_filename)
-    return sim
\ No newline at end of file
+    return sim
+
+@pytest.fixture()
+def mock_engine(monkeypatch):
+    """Run simulations with the mock engine (see engines.MockEngine)."""
+    from wzm_wzt import engines
+    engine = engines.MockEngine(checkpoint_size=4096)
+    monkeypatch.setattr(engines, "_engine", engine)
+    return engine
@@ -0,0 +1,59 @@
+"""Unit and regression test for archiving finished iterations."""
+
+import pytest
+import os
+import json
+import shutil
+import glob
+import zipfile
+from wzm_wzt.archive import IterationArchiver, open_log
+from wzm_wzt.checkpoints import CheckpointStore
+from wzm_wzt.run_md import work_calculation
+
+
+def test_archive(state_dict, data_dir, tmpdir):
+    member_dir = "{}/mem_0".format(tmpdir)
+    logs = sorted(glob.glob("{}/convergence/*.log".format(data_dir)))
+    for iteration in [0, 1]:
+        for log in logs:
+            site_name = os.path.basename(log)[:-len(".log")]
+            phase_dir = "{}/{}/num_test_sites_3/{}/convergence".format(member_dir, iteration, site_name)
+            os.makedirs(phase_dir)
+            shutil.copy(log, phase_dir)
+            with open("{}/state.cpt".format(phase_dir), "wb") as fh:
+                fh.write(b"checkpoint")
+    # The checkpoints of iteration 0 are only linked from there
+    store = CheckpointStore("{}/checkpoints".format(tmpdir))
+    old_digest = store.add(glob.glob("{}/0/num_test_sites_3/*/convergence/state.cpt".format(member_dir))[0])
+    os.utime(store.get_blob(old_digest), (1e9, 1e9))
+    state_dict["general_parameters"]["iteration"] = 1
+    json.dump(state_dict, open("{}/state.json".format(member_dir), "w"))
+
+    archiver = IterationArchiver(tmpdir)
+    assert archiver.get_completed() == [(0, 0)]
+    archiver.archive_completed()
+    assert not os.path.exists("{}/0".format(member_dir))
+    assert os.path.isfile("{}/0.zip".format(member_dir))
+    assert archiver.get_completed() == []
+    assert not os.path.exists(store.get_blob(old_digest))
+    # Checkpoints are left out unless asked for
+    with zipfile.ZipFile("{}/0.zip".format(member_dir)) as zf:
+        names = zf.namelist()
+    assert len(names) == len(logs) and not any(name.endswith(".cpt") for name in names)
+    with zipfile.ZipFile(IterationArchiver(tmpdir, include_checkpoints=True).archive(0, 1)) as zf:
+        assert len([name for name in zf.namelist() if name.endswith(".cpt")]) == len(logs)
+
+    # Archived logs read exactly like the originals
+    archived_logs = [
+        "{}/0/num_test_sites_3/{}/convergence/{}".format(member_dir,
+                                                         os.path.basename(log)[:-len(".log")], os.path.basename(log))
+        for log in logs
+    ]
+    for log, archived_log in zip(logs, archived_logs):
+        with open_log(archived_log) as fh:
+            assert fh.read() == open(log).read()
+    assert work_calculation(archived_logs) == work_calculation(logs)
+
+    with pytest.raises(FileNotFoundError):
+        with open_log("{}/0/missing.log".format(member_dir)):
+            pass
@@ -0,0 +1,59 @@
+"""Unit and regression test for the RunCatalog class."""
+
+import pytest
+import os
+import sqlite3
+from wzm_wzt.catalog import RunCatalog
+from wzm_wzt.run_params import State
+
+
+def test_catalog(state_dict, tmpdir):
+    catalog = RunCatalog("{}/catalog.sqlite".format(tmpdir))
+
+    os.makedirs("{}/mem_3".format(tmpdir))
+    state = State(filename="{}/mem_3/state.json".format(tmpdir))
+    state.set_from_dictionary(state_dict)
+    state.set(ensemble_num=3)
+    state.catalog = catalog
+    state.write_to_json()
+
+    status = catalog.get_status()
+    assert len(status) == 1
+    assert status[0]["ensemble_num"] == 3
+    assert status[0]["training"] == len(state.pair_params)
+
+    work = {"3673_5636": 10., "3673_10088": 20.}
+    probs = {"3673_5636": 0.9, "3673_10088": 0.1}
+    catalog.record_work(3, 0, 6, work, probs)
+    assert [row["site_name"] for row in catalog.get_work(ensemble_num=3)] == ["3673_10088", "3673_5636"]
+    assert not catalog.get_work(iteration=1)
+
+    catalog.record_checkpoints(3, 0, ["{}/production/state.cpt".format(tmpdir)], digest="abc")
+    assert catalog.query("SELECT phase, digest FROM checkpoints") == [{"phase": "production", "digest": "abc"}]
+    catalog.close()
+
+    # A fresh catalog can be rebuilt from the state files
+    rebuilt = RunCatalog("{}/rebuilt.sqlite".format(tmpdir))
+    assert rebuilt.rebuild(tmpdir) == 1
+    assert rebuilt.get_status()[0]["ensemble_num"] == 3
+
+
+def test_catalog_failure(simulation, mock_engine, monkeypatch, caplog):
+    # No catalog unless asked for
+    ensemble_dir = simulation.gmxapi.get("ensemble_dir")
+    assert simulation.gmxapi.state.catalog is None
+    assert not os.path.exists("{}/catalog.sqlite".format(ensemble_dir))
+
+    # A catalog that cannot be written to does not stop the run
+    def locked(self):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(RunCatalog, "connect", locked)
+    simulation.gmxapi.state.catalog = RunCatalog("{}/catalog.sqlite".format(ensemble_dir))
+    simulation.run_phases(num_phases=2)
+    assert all(simulation.gmxapi.state.get("phase", site_name=name) == "production"
+               for name in simulation.gmxapi.state.names)
+    failed = [record.getMessage() for record in caplog.records if "run catalog" in record.getMessage()]
+    assert any("record_work" in message for message in failed)
+    assert any("record_checkpoints" in message for message in failed)
+    assert any("database is locked" in message for message in failed)
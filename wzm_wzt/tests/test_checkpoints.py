@@ -0,0 +1,70 @@
+"""Unit and regression test for the checkpoint fan out."""
+
+import pytest
+import os
+import shutil
+from wzm_wzt.checkpoints import fan_out, unshare, CheckpointStore
+
+
+@pytest.fixture()
+def checkpoint(tmpdir):
+    fnm = "{}/state.cpt".format(tmpdir)
+    with open(fnm, "wb") as fh:
+        fh.write(os.urandom(100000))
+    return fnm
+
+
+@pytest.mark.parametrize("methods", [["reflink", "hardlink", "copy"], ["hardlink"], ["copy"]])
+def test_fan_out(checkpoint, tmpdir, methods):
+    destinations = ["{}/{}/state.cpt".format(tmpdir, i) for i in range(4)]
+    for destination in destinations:
+        os.makedirs(os.path.dirname(destination))
+    # Existing checkpoints are replaced
+    with open(destinations[0], "w") as fh:
+        fh.write("old")
+
+    used = fan_out(checkpoint, destinations, methods=methods, chunk_size=4096)
+    assert sorted(used.keys()) == destinations
+    data = open(checkpoint, "rb").read()
+    for destination in destinations:
+        assert used[destination] in methods
+        assert open(destination, "rb").read() == data
+    assert not [fnm for fnm in os.listdir(tmpdir) if fnm.endswith(".tmp")]
+
+
+def test_unshare(checkpoint, tmpdir):
+    destination = "{}/linked.cpt".format(tmpdir)
+    fan_out(checkpoint, [destination], methods=["hardlink"])
+    assert os.stat(checkpoint).st_nlink == 2
+    assert unshare(destination)
+    assert os.stat(checkpoint).st_nlink == 1
+    assert not unshare(destination)
+
+    with pytest.raises(FileNotFoundError):
+        fan_out("{}/missing.cpt".format(tmpdir), [destination])
+
+
+def test_checkpoint_store(checkpoint, tmpdir):
+    store = CheckpointStore("{}/checkpoints".format(tmpdir))
+    digest = store.add(checkpoint)
+    assert os.path.samefile(checkpoint, store.get_blob(digest))
+
+    # Identical data from another run is deduplicated
+    duplicate = "{}/duplicate.cpt".format(tmpdir)
+    shutil.copy(checkpoint, duplicate)
+    assert store.add(duplicate) == digest
+    assert os.path.samefile(duplicate, store.get_blob(digest))
+
+    destinations = ["{}/{}.cpt".format(tmpdir, i) for i in range(3)]
+    store.checkout(digest, destinations)
+    for destination in destinations:
+        assert open(destination, "rb").read() == open(checkpoint, "rb").read()
+
+    assert not store.prune()
+    for fnm in [checkpoint, duplicate] + destinations:
+        os.remove(fnm)
+    # Too new: another member may be about to check it out
+    assert not store.prune(min_age=3600.)
+    assert store.prune() == [digest]
+    with pytest.raises(KeyError):
+        store.checkout(digest, destinations)
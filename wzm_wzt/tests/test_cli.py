@@ -0,0 +1,37 @@
+"""Unit and regression test for the command-line analysis tools."""
+
+import json
+import pytest
+from mpi4py import MPI
+from wzm_wzt import cli
+from wzm_wzt.archive import IterationArchiver
+
+
+@pytest.mark.skipif(MPI.COMM_WORLD.Get_size() > 1, reason="reads the ensemble from a single process")
+def test_cli(simulation, mock_engine, tmpdir, capsys):
+    ensemble_dir = str(tmpdir)
+    simulation.run_phases(num_phases=2)
+    # Every pair is tested in the first round
+    test_sites = sorted(simulation.gmxapi.state.pair_params)
+    assert cli.find_members(ensemble_dir) == [0]
+
+    assert cli.main(["stats", ensemble_dir, "--jobs", "1"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split("\t")[:2] == ["ensemble_num", "iteration"]
+    assert lines[1].split("\t")[0] == "0"
+
+    cli.main(["targets", ensemble_dir, "--members", "0", "--json"])
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(row["site_name"] for row in rows) == test_sites
+
+    work = cli.collect("work", ensemble_dir, iteration=0)
+    assert sorted(row["site_name"] for row in work) == test_sites
+    assert sum(row["probability"] for row in work) == pytest.approx(1.)
+    # Members run in worker processes give the same answer
+    assert cli.collect("work", ensemble_dir, members=[0, 0], jobs=2) == work + work
+
+    # Archived iterations are read from the archive
+    simulation.gmxapi.state.set(iteration=1)
+    simulation.gmxapi.state.write_to_json()
+    IterationArchiver(ensemble_dir).archive(0, 0)
+    assert cli.collect("work", ensemble_dir) == work
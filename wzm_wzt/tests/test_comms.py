@@ -0,0 +1,46 @@
+"""Unit and regression test for the typed collectives."""
+
+import pytest
+import numpy as np
+from mpi4py import MPI
+from wzm_wzt.comms import (bcast_array, bcast_float, bcast_int, bcast_string, bcast_choice, bcast_decisions,
+                           allreduce_values)
+
+comm = MPI.COMM_WORLD
+sites = ["10088_12035", "3673_10088", "3673_5636"]
+
+
+def test_bcast_scalars():
+    assert bcast_float(np.float64(3.5), comm) == 3.5
+    assert bcast_int(7, comm) == 7
+    array = np.arange(4, dtype=np.float64) if comm.Get_rank() == 0 else np.zeros(4)
+    assert np.array_equal(bcast_array(array, comm), np.arange(4))
+
+
+def test_bcast_string():
+    assert bcast_string("mem_0/state.json", comm) == "mem_0/state.json"
+    assert bcast_string("", comm) == ""
+    with pytest.raises(ValueError):
+        bcast_string("x" * 20, comm, width=10)
+
+
+def test_bcast_choice():
+    assert bcast_choice("3673_10088", sites, comm) == "3673_10088"
+    assert bcast_choice(None, sites, comm) is None
+
+
+def test_bcast_decisions():
+    selected, start_time, pruned = bcast_decisions(comm,
+                                                   sites,
+                                                   selected="3673_5636",
+                                                   start_time=259.356,
+                                                   pruned=["10088_12035"])
+    assert selected == "3673_5636"
+    assert start_time == 259.356
+    assert pruned == ["10088_12035"]
+
+
+def test_allreduce_values():
+    values = {site: float(i) for i, site in enumerate(sites) if i % comm.Get_size() == comm.Get_rank()}
+    assert allreduce_values(values, sites, comm) == {site: float(i) for i, site in enumerate(sites)}
+    assert allreduce_values({}, sites, comm) == {}
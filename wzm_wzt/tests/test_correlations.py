@@ -0,0 +1,133 @@
+"""Unit and regression test for the correlations module."""
+
+import json
+import numpy as np
+import pytest
+from wzm_wzt.correlations import (CovarianceAccumulator, read_production_run, update_member, ensemble_correlations,
+                                  strongest_correlations)
+from wzm_wzt import cli
+
+NAMES = ["3673_10088", "3673_5636", "5636_10088"]  # sorted, as in update_member
+
+
+def make_samples(size, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(3.0, 0.5, size=size)
+    return np.column_stack([x, 2. * x + rng.normal(0., 0.1, size=size), rng.normal(5.0, 0.5, size=size)])
+
+
+def write_production_run(tmpdir, ensemble_num, iteration, num_test_sites, data, names):
+    for column, site_name in zip(data.T, names):
+        log = tmpdir.join("mem_{}".format(ensemble_num), str(iteration), "num_test_sites_{}".format(num_test_sites),
+                          "production", "{}.log".format(site_name))
+        log.ensure()
+        lines = ["time\tR\ttarget\talpha"]
+        lines += ["{:f}\t{:.9f}\t3.000000\t-10.000000".format(100. * i, r) for i, r in enumerate(column)]
+        log.write("\n".join(lines) + "\n")
+
+
+def write_state(tmpdir, ensemble_num, iteration):
+    state = {"general_parameters": {"iteration": iteration}, "pair_parameters": {name: {} for name in NAMES}}
+    tmpdir.join("mem_{}".format(ensemble_num), "state.json").write(json.dumps(state), ensure=True)
+
+
+def test_covariance_accumulator(tmpdir):
+    data = make_samples(500)
+    accumulator = CovarianceAccumulator(NAMES, block_size=2)
+    for batch in np.array_split(data, 7):
+        accumulator.update(batch)
+    assert accumulator.get_covariance() == pytest.approx(np.cov(data.T))
+    assert accumulator.get_correlation() == pytest.approx(np.corrcoef(data.T))
+
+    # Merging gives the same as one update
+    first, second = CovarianceAccumulator(NAMES), CovarianceAccumulator(NAMES)
+    first.update(data[:123], source="a")
+    second.update(data[123:], source="b")
+    assert first.merge(second).get_correlation() == pytest.approx(accumulator.get_correlation())
+    assert first.sources == ["a", "b"]
+
+    single = CovarianceAccumulator(NAMES, dtype=np.float32)
+    single.update(data.astype(np.float32))
+    assert single.comoment.dtype == np.float32
+    assert single.get_correlation() == pytest.approx(np.corrcoef(data.T), abs=1e-4)
+
+    filename = "{}/correlations.npz".format(tmpdir)
+    first.save(filename)
+    loaded = CovarianceAccumulator.load(filename)
+    assert loaded.names == NAMES and loaded.sources == ["a", "b"]
+    assert np.array_equal(loaded.comoment, first.comoment)
+
+    with pytest.raises(ValueError):
+        accumulator.update(data[:, :2])
+    with pytest.raises(ValueError):
+        accumulator.merge(CovarianceAccumulator(NAMES[:2]))
+
+
+def test_pairwise_complete():
+    data = make_samples(300, seed=1)
+    # The third variable is only logged for the last 100 samples
+    accumulator = CovarianceAccumulator(NAMES, block_size=1)
+    accumulator.update(data[:200, :2], names=NAMES[:2])
+    accumulator.update(data[200:], names=NAMES)
+    assert list(accumulator.count[0]) == [300, 300, 100]
+    correlation = accumulator.get_correlation()
+    assert correlation[0, 1] == pytest.approx(np.corrcoef(data[:, 0], data[:, 1])[0, 1])
+    assert correlation[0, 2] == pytest.approx(np.corrcoef(data[200:, 0], data[200:, 2])[0, 1])
+    assert correlation == pytest.approx(correlation.T)
+    assert accumulator.get_covariance()[2, 1] == pytest.approx(np.cov(data[200:, 2], data[200:, 1])[0, 1])
+
+    rows = strongest_correlations(accumulator, top=2)
+    assert len(rows) == 2 and (rows[0]["site_a"], rows[0]["site_b"]) == (NAMES[0], NAMES[1])
+    assert abs(rows[0]["correlation"]) >= abs(rows[1]["correlation"])
+    assert np.isnan(strongest_correlations(CovarianceAccumulator(NAMES))[0]["correlation"])
+
+
+def test_update_member(tmpdir):
+    data = make_samples(400, seed=2)
+    write_state(tmpdir, 0, 2)
+    write_production_run(tmpdir, 0, 0, 0, data[:100, :2], NAMES[:2])
+    write_production_run(tmpdir, 0, 0, 1, data[100:200], NAMES)
+    write_production_run(tmpdir, 0, 2, 0, data[200:300], NAMES)  # the current iteration
+    write_state(tmpdir, 1, 1)
+    write_production_run(tmpdir, 1, 0, 0, data[300:], NAMES)
+
+    cache_dir = str(tmpdir.join("cache"))
+    accumulator = update_member(str(tmpdir), 0, cache_dir=cache_dir, chunk_size=7)
+    assert accumulator.sources == ["0/num_test_sites_0", "0/num_test_sites_1"]
+    assert accumulator.count[0, 1] == 200
+    assert accumulator.get_correlation()[0, 1] == pytest.approx(np.corrcoef(data[:200, 0], data[:200, 1])[0, 1])
+    assert update_member(str(tmpdir), 0, cache_dir=cache_dir, include_current=True).count[0, 1] == 300
+    # Nothing is written to the ensemble
+    assert not tmpdir.join("mem_0").listdir(lambda path: path.ext == ".npz")
+
+    # Runs already in the cache are not read again
+    tmpdir.join("mem_0", "0", "num_test_sites_1", "production", "{}.log".format(NAMES[0])).remove()
+    assert update_member(str(tmpdir), 0, cache_dir=cache_dir).count[0, 1] == 200
+    assert update_member(str(tmpdir), 0).count[0, 1] == 100
+
+    merged = ensemble_correlations(str(tmpdir), jobs=2, cache_dir=cache_dir)
+    assert merged.sources == ["mem_0/0/num_test_sites_0", "mem_0/0/num_test_sites_1", "mem_1/0/num_test_sites_0"]
+    expected = np.concatenate([data[:200], data[300:]])
+    assert merged.get_correlation()[0, 1] == pytest.approx(np.corrcoef(expected[:, 0], expected[:, 1])[0, 1])
+    assert merged.get_correlation()[1, 2] == pytest.approx(np.corrcoef(expected[100:, 1], expected[100:, 2])[0, 1])
+
+    rows = cli.ensemble_correlations(str(tmpdir), top=1, output="{}/merged.npz".format(tmpdir), cache_dir=cache_dir)
+    assert [(row["site_a"], row["site_b"]) for row in rows] == [(NAMES[0], NAMES[1])]
+    assert rows[0]["correlation"] > 0.9
+    assert CovarianceAccumulator.load("{}/merged.npz".format(tmpdir)).sources == merged.sources
+
+
+def test_read_production_run(tmpdir):
+    data = make_samples(20)
+    write_production_run(tmpdir, 0, 0, 0, data, NAMES)
+    log_files = {name: str(tmpdir.join("mem_0", "0", "num_test_sites_0", "production", "{}.log".format(name)))
+                 for name in NAMES}
+    chunks = list(read_production_run(log_files, dtype=np.float64, chunk_size=6))
+    assert [len(chunk) for chunk in chunks] == [6, 6, 6, 2]
+    assert np.concatenate(chunks) == pytest.approx(data, abs=1e-8)
+
+    # A log that is cut short ends the run
+    write_production_run(tmpdir.join("short"), 0, 0, 0, data[:9, :1], NAMES[:1])
+    log_files[NAMES[0]] = str(tmpdir.join("short", "mem_0", "0", "num_test_sites_0", "production",
+                                          "{}.log".format(NAMES[0])))
+    assert [len(chunk) for chunk in read_production_run(log_files, chunk_size=6)] == [6, 3]
@@ -1,6 +1,6 @@
 """Unit and regression test for the DirectoryHelper class."""
 
-from wzm_wzt.directory_helper import DirectoryHelper
+from wzm_wzt.directory_helper import DirectoryHelper, get_directory_helper, clear_directory_cache
 import os
 import pytest
 
@@ -46,3 +46,50 @@ def test_directory(tmpdir):
         assert dir_helper.change_dir("bad_dir")
 
     os.chdir(my_home)
+
+
+def test_directory_paths(tmpdir):
+    """Checks that absolute paths are available for every level without changing directories."""
+    my_home = os.path.abspath(os.getcwd())
+    top_dir = tmpdir.mkdir("top_directory")
+    param_dict = {'ensemble_num': 1, 'iteration': 0, 'test_sites': [[3673, 5636], [3673, 10088]]}
+    dir_helper = DirectoryHelper(top_dir, param_dict)
+    dir_helper.build_working_dir()
+
+    num_test_sites = '{}/mem_1/0/num_test_sites_2'.format(top_dir)
+    assert str(dir_helper.get_path('top')) == top_dir
+    assert str(dir_helper.get_path('num_test_sites')) == num_test_sites
+    assert str(dir_helper.get_path('production')) == '{}/production'.format(num_test_sites)
+    assert str(dir_helper.get_path('test_site', test_site='3673_5636')) == '{}/3673_5636'.format(num_test_sites)
+    for site_name in dir_helper.get_site_names():
+        for phase in ['training', 'convergence']:
+            path = dir_helper.get_path('phase', test_site=site_name, phase=phase)
+            assert path.is_absolute() and path.is_dir()
+            assert str(path) == dir_helper.get_dir('phase', test_site=site_name, phase=phase)
+    assert os.getcwd() == my_home
+
+    with pytest.raises(ValueError):
+        dir_helper.get_path('phase', test_site='3673_5636')
+    with pytest.raises(ValueError):
+        dir_helper.get_path('bad_dir')
+
+
+def test_directory_cache(tmpdir, monkeypatch):
+    """Checks that layouts are cached and directories are only created once."""
+    param_dict = {'ensemble_num': 1, 'iteration': 0, 'test_sites': ['3673_5636', '3673_10088']}
+    dir_helper = get_directory_helper(tmpdir, param_dict)
+    assert get_directory_helper(tmpdir, param_dict) is dir_helper
+    assert len(dir_helper.get_manifest()) == 5
+
+    dir_helper.build_working_dir()
+    for path in dir_helper.get_manifest():
+        assert path.is_dir()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("build_working_dir should not touch the filesystem twice")
+
+    monkeypatch.setattr(os, "makedirs", fail)
+    get_directory_helper(tmpdir, param_dict).build_working_dir()
+
+    clear_directory_cache()
+    assert get_directory_helper(tmpdir, param_dict) is not dir_helper
@@ -0,0 +1,77 @@
+"""Unit and regression test for the distance histograms."""
+
+import json
+import numpy as np
+import pytest
+from wzm_wzt.distances import (DistanceHistogram, read_column, find_production_logs, ensemble_histograms,
+                               kl_divergence, js_divergence, compare)
+from wzm_wzt.archive import IterationArchiver
+from wzm_wzt import cli
+
+
+def write_production_log(tmpdir, ensemble_num, iteration, site_name, distances):
+    log = tmpdir.join("mem_{}".format(ensemble_num), str(iteration), "num_test_sites_0", "production",
+                      "{}.log".format(site_name))
+    log.ensure()
+    lines = ["time\tR\ttarget\talpha"]
+    lines += ["{:f}\t{:f}\t3.000000\t-10.000000".format(100. * i, r) for i, r in enumerate(distances)]
+    log.write("\n".join(lines) + "\n")
+    return log
+
+
+def test_distance_histogram():
+    bins = [0.0, 0.1, 0.2, 0.3]
+    histogram = DistanceHistogram(bins)
+    histogram.add([0.0, 0.04, 0.06, 0.149, 0.31, 0.349, -0.06, 0.36])
+    assert list(histogram.counts) == [2, 2, 0, 2]
+    assert (histogram.underflow, histogram.overflow) == (1, 1)
+    assert histogram.get_total() == 8
+    assert histogram.get_probabilities().sum() == pytest.approx(1.)
+
+    other = DistanceHistogram(bins)
+    other.add(np.array([0.2]))
+    assert list(histogram.merge(other).counts) == [2, 2, 1, 2]
+    with pytest.raises(ValueError):
+        histogram.merge(DistanceHistogram([0.0, 0.2]))
+    with pytest.raises(ValueError):
+        DistanceHistogram([0.0, 0.1, 0.3])
+
+
+def test_divergences():
+    p, q = [1., 2., 1., 0.], [0., 1., 2., 1.]
+    assert js_divergence(p, p) == pytest.approx(0.)
+    assert kl_divergence(p, p) == pytest.approx(0.)
+    assert js_divergence(p, q) == pytest.approx(js_divergence(q, p))
+    assert 0. < js_divergence(p, q) <= np.log(2)
+    assert js_divergence([1., 0.], [0., 1.]) == pytest.approx(np.log(2))
+    # Only finite because empty bins are smoothed
+    assert np.isfinite(kl_divergence(p, q)) and kl_divergence(p, q) > kl_divergence(p, [1., 2., 1., 1.])
+
+
+def test_ensemble_histograms(tmpdir, data_dir):
+    deer_data = json.load(open("{}/deer_data.json".format(data_dir)))
+    bins, distribution = deer_data["bins"], deer_data["distribution"]
+    rng = np.random.default_rng(0)
+    samples = rng.normal(3.0, 0.5, size=1000)
+    log = write_production_log(tmpdir, 0, 0, "3673_5636", samples[:600])
+    write_production_log(tmpdir, 1, 0, "3673_5636", samples[600:])
+    write_production_log(tmpdir, 1, 1, "5636_10088", rng.normal(5.0, 0.5, size=100))
+
+    # Reading in chunks gives the whole column
+    assert np.concatenate(list(read_column(str(log), chunk_size=7))) == pytest.approx(samples[:600], abs=1e-6)
+
+    expected = DistanceHistogram(bins)
+    expected.add(samples)
+    IterationArchiver(str(tmpdir)).archive(1, 0)
+    assert list(find_production_logs(tmpdir.join("mem_1"))) == ["3673_5636", "5636_10088"]
+    for jobs in [1, 2]:
+        histograms = ensemble_histograms(str(tmpdir), bins, jobs=jobs)
+        assert sorted(histograms) == ["3673_5636", "5636_10088"]
+        assert list(histograms["3673_5636"].counts) == list(expected.counts)
+    assert sorted(ensemble_histograms(str(tmpdir), bins, members=[1], iteration=1)) == ["5636_10088"]
+
+    rows = compare(histograms, distribution)
+    assert [row["samples"] for row in rows] == [1000, 100]
+    assert all(0. <= row["js_divergence"] <= np.log(2) for row in rows)
+
+    assert cli.ensemble_distances(str(tmpdir), "{}/deer_data.json".format(data_dir), members=[0, 1]) == rows
@@ -0,0 +1,52 @@
+"""Unit and regression test for the MD engine backends."""
+
+import os
+import pytest
+from wzm_wzt import engines
+from wzm_wzt.engines import MockEngine, set_engine
+from wzm_wzt.plugin_configs import TrainingPluginConfig, ConvergencePluginConfig
+from wzm_wzt.run_md import final_fields, convergence_work
+
+
+def test_set_engine(monkeypatch):
+    monkeypatch.setattr(engines, "_engine", None)
+    assert isinstance(set_engine("mock"), MockEngine)
+    with pytest.raises(ValueError):
+        set_engine("lammps")
+
+
+def test_mock_engine(tmpdir, mock_engine):
+    params = {
+        "sites": [3673, 5636],
+        "logging_filename": "3673_5636.log",
+        "target": 3.5,
+        "A": 50,
+        "tau": 50,
+        "tolerance": 0.25,
+        "num_samples": 50,
+        "sample_period": 100,
+        "alpha": 0.
+    }
+    workdirs = []
+    for phase, plugin in [("training", TrainingPluginConfig()), ("convergence", ConvergencePluginConfig())]:
+        plugin.set_parameters(**params)
+        workflow = mock_engine.from_tpr(["topol.tpr"])
+        workflow.add_dependency([plugin.build_plugin()])
+        workdirs.append(tmpdir.mkdir(phase))
+        with mock_engine.ParallelArrayContext(workflow, workdir_list=[workdirs[-1]], communicator=None) as session:
+            session.run()
+
+    # The logs look like the ones from the BRER plugins
+    float(final_fields(str(workdirs[0].join("3673_5636.log")))[5])
+    site_name, _, final_time = convergence_work(str(workdirs[1].join("3673_5636.log")))
+    assert site_name == "3673_5636"
+    assert mock_engine.read_checkpoint_time(str(workdirs[1])) == final_time
+    assert os.path.getsize(str(workdirs[1].join("state.cpt"))) == 4096
+    assert "Performance:" in workdirs[1].join("md.log").read()
+
+
+def test_mock_simulation(simulation, mock_engine):
+    simulation.run_phases(num_phases=3)
+    assert simulation.gmxapi.state.get("iteration") == 0
+    assert simulation.gmxapi.get("num_test_sites") == 5
+    assert simulation.gmxapi.state.get("start_time") > 0
@@ -0,0 +1,39 @@
+"""Unit and regression test for the EnsembleDriver class."""
+
+import pytest
+from wzm_wzt.ensemble import EnsembleDriver, assign_members
+
+
+def test_assign_members():
+    members = list(range(10))
+    assignments = [assign_members(members, 4, group) for group in range(4)]
+    assert assignments[0] == [0, 4, 8]
+    assert assignments[3] == [3, 7]
+    assert sorted(sum(assignments, [])) == members
+
+    with pytest.raises(IndexError):
+        assign_members(members, 4, 4)
+
+
+def test_ensemble_driver():
+    from mpi4py import MPI
+    size = MPI.COMM_WORLD.Get_size()
+    driver = EnsembleDriver(list(range(2 * size)), ranks_per_member=1)
+    assert driver.num_groups == size
+    assert driver.member_comm.Get_size() == 1
+    assert len(driver.get_members()) == 2
+
+    with pytest.raises(RuntimeError):
+        driver.run()
+    driver.free()
+
+    # More groups than members: a group without members has nothing to do once it is set up
+    driver = EnsembleDriver([], ranks_per_member=1)
+    with pytest.raises(RuntimeError):
+        driver.run()
+    assert driver.setup("topol.tpr", "ensemble", "sites.json", "deer_data.json") == {}
+    driver.run()
+    driver.free()
+
+    with pytest.raises(ValueError):
+        EnsembleDriver([0], ranks_per_member=size + 1)
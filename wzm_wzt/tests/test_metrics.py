@@ -0,0 +1,44 @@
+"""Unit and regression test for the phase timers."""
+
+import json
+import pytest
+from mpi4py import MPI
+from wzm_wzt.metrics import PhaseTimer, write_metrics, JSONL_FILENAME, PROMETHEUS_FILENAME
+
+
+def test_phase_timer(tmpdir):
+    timer = PhaseTimer()
+    for _ in range(2):
+        with timer.time("barrier"):
+            pass
+    timer.add("run", 1.5)
+    with pytest.raises(ValueError):
+        with timer.time("lunch"):
+            pass
+
+    stages = timer.reduce(MPI.COMM_WORLD)
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        assert sorted(stages) == ["barrier", "run"]
+        assert stages["run"]["max"] == 1.5
+        assert stages["barrier"]["count"] == 2 * MPI.COMM_WORLD.Get_size()
+
+        record = write_metrics(tmpdir, stages, 0, 3, "training", MPI.COMM_WORLD.Get_size())
+        write_metrics(tmpdir, stages, 0, 3, "convergence", MPI.COMM_WORLD.Get_size())
+        lines = tmpdir.join(JSONL_FILENAME).readlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0]) == record
+        prometheus = tmpdir.join(PROMETHEUS_FILENAME).read()
+        assert 'wzm_wzt_stage_seconds{member="0",iteration="3",phase="convergence",stage="run",statistic="max"} 1.5' \
+            in prometheus.splitlines()
+
+    timer.reset()
+    assert not timer.seconds.any()
+
+
+def test_simulation_metrics(simulation, mock_engine):
+    simulation.run_phases(num_phases=2)
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        records = [json.loads(line) for line in open("{}/{}".format(simulation.member_dir, JSONL_FILENAME))]
+        assert [record["phase"] for record in records] == ["training", "convergence"]
+        assert {"init", "run", "build_plugins", "read_logs", "training_pp"} <= set(records[0]["stages"])
+        assert {"convergence_pp", "checkpoints", "collectives"} <= set(records[1]["stages"])
@@ -0,0 +1,139 @@
+"""Unit and regression test for pruning convergence runs."""
+
+import os
+import glob
+import shutil
+import time
+import signal
+import threading
+import pytest
+from wzm_wzt.pruning import (ConvergencePruner, PruneWatcher, select_pruned, is_pruned, is_finished, clear_markers,
+                             PRUNE_MARKER, FINISHED_MARKER)
+from wzm_wzt import run_md
+from wzm_wzt.run_md import convergence_work
+
+
+def test_select_pruned():
+    work = {"a": 10., "b": 11., "c": 40.}
+    assert select_pruned(work, threshold=1e-3) == ["c"]
+    assert select_pruned(work, threshold=0.9) == ["b", "c"]
+    assert select_pruned(work, threshold=0.9, protected=["c"]) == ["b"]
+    assert select_pruned({"a": 10.}, threshold=1e-3) == []
+
+
+def write_convergence_log(tmpdir, site, distances, period=10.):
+    os.makedirs("{}/{}/convergence".format(tmpdir, site))
+    log_file = "{}/{}/convergence/{}.log".format(tmpdir, site, site)
+    with open(log_file, "w") as fh:
+        fh.write("time\tR\ttarget\talpha\n")
+        for i, r in enumerate(distances):
+            fh.write("{:f}\t{:f}\t3.000000\t300.000000\n".format(i * period, r))
+    return log_file
+
+
+def test_prune_at_common_time(tmpdir):
+    # 1_2 has got further and so has done far more work in total than 5_6, but not by the same time; 3_4 has not
+    log_files = {
+        "1_2": write_convergence_log(tmpdir, "1_2", [2.0, 2.02] * 20),
+        "3_4": write_convergence_log(tmpdir, "3_4", [2.0, 2.5] * 3),
+        "5_6": write_convergence_log(tmpdir, "5_6", [2.0, 2.01] * 3)
+    }
+    assert convergence_work(log_files["1_2"], until=50.)[1:] == pytest.approx((5 * 0.02 * 100., 50.))
+    pruner = ConvergencePruner(log_files, convergence_work, threshold=1e-6)
+    assert pruner.check() == ["3_4"]
+    assert pruner.pruned["3_4"]["time"] == 50.
+    # Requested, but only the watcher can say whether the run was stopped
+    assert not is_pruned("{}/3_4/convergence".format(tmpdir))
+
+    # A run that has ended is never pruned, though it still counts as a reference
+    open("{}/1_2/convergence/{}".format(tmpdir, FINISHED_MARKER), "w").close()
+    pruner = ConvergencePruner(log_files, convergence_work, threshold=1e-6)
+    assert pruner.check() == ["3_4"]
+    assert not os.path.exists("{}/1_2/convergence/{}".format(tmpdir, PRUNE_MARKER))
+
+
+def test_convergence_work_empty(tmpdir):
+    # A run that has only written the header, or has no samples up to the time asked for, has no path yet
+    header_only = write_convergence_log(tmpdir, "7_8", [])
+    assert convergence_work(header_only) == ("7_8", 0., 0.)
+    log_file = write_convergence_log(tmpdir, "1_2", [2.0, 2.001, 2.0])
+    assert convergence_work(log_file, until=-1.) == ("1_2", 0., 0.)
+
+    # Nothing is compared until every running site has got going
+    log_files = {"1_2": log_file, "3_4": write_convergence_log(tmpdir, "3_4", [2.0, 3.0, 2.0]), "7_8": header_only}
+    pruner = ConvergencePruner(log_files, convergence_work, threshold=0.1)
+    assert pruner.check() == []
+    write_convergence_log(tmpdir.join("more"), "7_8", [2.0, 2.01, 2.0])
+    shutil.copy("{}/more/7_8/convergence/7_8.log".format(tmpdir), header_only)
+    assert pruner.check() == ["3_4"]
+
+
+def test_convergence_pruner(tmpdir, data_dir):
+    log_files = {}
+    for log_file in sorted(glob.glob("{}/convergence/*.log".format(data_dir))):
+        site = os.path.basename(log_file)[:-len(".log")]
+        os.makedirs("{}/{}/convergence".format(tmpdir, site))
+        log_files[site] = shutil.copy(log_file, "{}/{}/convergence".format(tmpdir, site))
+    # One run has not written anything yet
+    os.makedirs("{}/1_2/convergence".format(tmpdir))
+    log_files["1_2"] = "{}/1_2/convergence/1_2.log".format(tmpdir)
+
+    # The shortest run has converged; the others are compared at the time the slower one has reached
+    open("{}/105_216/convergence/{}".format(tmpdir, FINISHED_MARKER), "w").close()
+    pruner = ConvergencePruner(log_files, convergence_work, threshold=1e-6)
+    assert pruner.check() == ["052_210", "196_228"]
+    assert pruner.pruned["052_210"]["time"] == pytest.approx(118.016)
+    assert pruner.check() == []
+    assert os.path.exists("{}/052_210/convergence/{}".format(tmpdir, PRUNE_MARKER))
+    assert not os.path.exists("{}/105_216/convergence/{}".format(tmpdir, PRUNE_MARKER))
+
+    stopped = []
+    workdir = "{}/196_228/convergence".format(tmpdir)
+    watcher = PruneWatcher(workdir, stop=stopped.append, interval=0.01)
+    open("{}/{}".format(workdir, PRUNE_MARKER), "w").close()
+    # Not running yet: nothing is stopped
+    assert not watcher.check()
+    with watcher.running():
+        assert watcher.check() and not watcher.check()
+    watcher.cancel()
+    assert watcher.fired and stopped == [threading.get_ident()]
+    assert is_pruned(workdir) and not is_finished(workdir)
+
+    # A run that ends before it is pruned is finished, and starting again clears the markers
+    watcher = PruneWatcher(workdir, stop=stopped.append, interval=0.01).start()
+    with watcher.running():
+        time.sleep(0.05)
+    watcher.cancel()
+    assert not watcher.fired and is_finished(workdir) and not is_pruned(workdir)
+    clear_markers(workdir)
+    assert not is_finished(workdir)
+
+
+def test_stop_mdrun(tmpdir):
+    # The SIGTERM that would stop mdrun goes to this thread and does not end the process
+    previous = signal.getsignal(signal.SIGTERM)
+    workdir = str(tmpdir)
+    watcher = PruneWatcher(workdir, interval=0.01).start()
+    open("{}/{}".format(workdir, PRUNE_MARKER), "w").close()
+    with watcher.running():
+        deadline = time.time() + 5.
+        while not watcher.fired and time.time() < deadline:
+            time.sleep(0.01)
+    watcher.cancel()
+    assert watcher.fired and is_pruned(workdir)
+    assert signal.getsignal(signal.SIGTERM) == previous
+
+
+def test_pruner_phases(simulation, mock_engine, monkeypatch):
+    # The pruner only watches convergence runs
+    started = []
+
+    class Pruner(ConvergencePruner):
+        def start(self):
+            started.append(sorted({simulation.gmxapi.state.get("phase", site_name=site) for site in self.log_files}))
+            return super().start()
+
+    monkeypatch.setattr(run_md, "ConvergencePruner", Pruner)
+    simulation.pruning = {"threshold": 1e-6, "interval": 0.01}
+    simulation.run_phases(num_phases=3)
+    assert started == [["convergence"]]
@@ -57,4 +57,13 @@ def test_gmxapi_config_2(data_dir, tmpdir, state_dict):
 
 def test_initialize_workflow(data_dir, tmpdir, simulation):
     mdrun_args = {'ntmpi': 4}
-    simulation.gmxapi.initialize_workflow(mdrun_args)
\ No newline at end of file
+    simulation.gmxapi.initialize_workflow(mdrun_args)
+
+def test_split(simulation):
+    from mpi4py import MPI
+    simulation.gmxapi.initialize_workflow()
+    config = simulation.gmxapi.split(MPI.COMM_SELF)
+    assert config.comm is MPI.COMM_SELF
+    assert config.workflow is None
+    assert simulation.gmxapi.workflow is not None
+    assert config.state is simulation.gmxapi.state
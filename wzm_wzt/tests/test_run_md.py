@@ -1,11 +1,18 @@
 import pytest
 
-from wzm_wzt.run_md import Simulation, final_time
+from wzm_wzt import run_md
+from wzm_wzt.run_md import Simulation, final_time, run_until_complete, configure_logging, shutdown_logging
+from wzm_wzt.run_params import State
+from wzm_wzt.target_schedule import TargetSchedule
+from wzm_wzt.target_allocation import allocate
 from wzm_wzt.metadata import site_to_str
 import os
+import json
 import logging
 import shutil
 import glob
+import threading
+import numpy as np
 
 try:
     from mpi4py import MPI
@@ -37,6 +44,108 @@ def test_simulation(simulation):
     simulation.run()
 
 
+@withmpi_only
+def test_simulation_pipelined(simulation):
+    simulation.gmxapi.state.set(**{"A": 5, "tau": 0.1, "tolerance": 100, "num_samples": 2, "sample_period": 0.1})
+    simulation.run_pipelined()
+    test_sites = simulation.gmxapi.state.get("test_sites")
+    assert all(simulation.gmxapi.state.get("phase", site_name=site) == "convergence" for site in test_sites)
+    simulation.post_process()
+    assert all(simulation.gmxapi.state.get("phase", site_name=site) == "production" for site in test_sites)
+
+
+@withmpi_only
+def test_run_phases(simulation):
+    simulation.gmxapi.state.set(**{
+        "A": 5,
+        "tau": 0.1,
+        "tolerance": 100,
+        "num_samples": 2,
+        "sample_period": 0.1,
+        "production_time": 0.2
+    })
+    assert simulation.run_phases(num_phases=3) == 3
+    assert all(
+        simulation.gmxapi.state.get("phase", site_name=site) == "training"
+        for site in simulation.gmxapi.state.get("test_sites"))
+
+
+def test_run_phases_limits(simulation):
+    with pytest.raises(ValueError):
+        simulation.run_phases()
+    assert simulation.run_phases(num_iterations=0) == 0
+
+
+def test_run_phases_targets(data_dir, tmpdir, mock_engine, monkeypatch):
+    draws = iter([3.0, 4.5, 5.0])
+    monkeypatch.setattr(State, "re_sample_targets", lambda state: next(draws))
+    os.makedirs("{}/mem_0".format(tmpdir), exist_ok=True)
+    simulation = Simulation("{}/wzmwzt.tpr".format(data_dir), str(tmpdir), 0, "{}/sites.json".format(data_dir),
+                            "{}/deer_data.json".format(data_dir))
+    test_sites = simulation.gmxapi.state.get("test_sites")
+    assert {simulation.gmxapi.state.get("target", site_name=site) for site in test_sites} == {3.0}
+
+    # Training, convergence and production: the remaining sites train again, towards new targets
+    simulation.run_phases(num_phases=3)
+    test_sites = simulation.gmxapi.state.get("test_sites")
+    assert all(simulation.gmxapi.state.get("phase", site_name=site) == "training" for site in test_sites)
+    assert {simulation.gmxapi.state.get("target", site_name=site) for site in test_sites} == {4.5}
+    state = json.load(open("{}/mem_0/state.json".format(tmpdir)))
+    assert {state["pair_parameters"][site]["target"] for site in test_sites} == {4.5}
+
+
+def test_target_schedule_end(data_dir, tmpdir, mock_engine, monkeypatch, caplog):
+    deer_data = json.load(open("{}/deer_data.json".format(data_dir)))
+    names = sorted(site_to_str(site) for site in json.load(open("{}/sites.json".format(data_dir))).values())
+    schedule = TargetSchedule.generate(deer_data["distribution"], deer_data["bins"], names, 3, 1, seed=0)
+    schedule.save("{}/targets.npz".format(tmpdir))
+    monkeypatch.setattr(State, "re_sample_targets", lambda state: 4.5)
+    os.makedirs("{}/mem_1".format(tmpdir))
+
+    def make_simulation():
+        return Simulation("{}/wzmwzt.tpr".format(data_dir),
+                          str(tmpdir),
+                          1,
+                          "{}/sites.json".format(data_dir),
+                          "{}/deer_data.json".format(data_dir),
+                          target_schedule="{}/targets.npz".format(tmpdir))
+
+    state = make_simulation().gmxapi.state
+    assert {name: state.get("target", site_name=name) for name in names} == schedule.get(1, 0)
+    assert "The target schedule only covers" not in caplog.text
+
+    # Relaunched for an iteration past the end of the schedule: the targets are drawn as if there were none
+    state.set(iteration=1)
+    state.write_to_json()
+    state = make_simulation().gmxapi.state
+    assert {state.get("target", site_name=name) for name in state.get("test_sites")} == {4.5}
+    assert "The target schedule only covers 1 iterations" in caplog.text
+
+
+def test_target_discrepancy(data_dir, tmpdir, mock_engine, caplog):
+    deer_data = json.load(open("{}/deer_data.json".format(data_dir)))
+    arguments = ["{}/wzmwzt.tpr".format(data_dir)], ["{}/sites.json".format(data_dir),
+                                                      "{}/deer_data.json".format(data_dir)]
+
+    def make_simulation(name, **kwargs):
+        os.makedirs("{}/{}/mem_1".format(tmpdir, name))
+        return Simulation(arguments[0][0], "{}/{}".format(tmpdir, name), 1, *arguments[1], **kwargs)
+
+    caplog.set_level(logging.INFO)
+    simulation = make_simulation("allocated", target_allocation={"ensemble_size": 4})
+    assert "Discrepancy of the allocated targets from the DEER distribution over 4 members" in caplog.text
+    # The allocation follows the DEER distribution as it was read (the state sorts it)
+    names = sorted(simulation.gmxapi.state.pair_params)
+    indices = allocate(deer_data["distribution"], 4, 1, len(names), method="stratified", rng=np.random.default_rng(0))
+    for name, index in zip(names, indices[1, 0]):
+        assert simulation.gmxapi.state.get("target", site_name=name) == deer_data["bins"][index]
+
+    schedule = TargetSchedule.generate(deer_data["distribution"], deer_data["bins"], names, 3, 2, seed=0)
+    schedule.save("{}/targets.npz".format(tmpdir))
+    make_simulation("scheduled", target_schedule="{}/targets.npz".format(tmpdir))
+    assert "Discrepancy of the scheduled targets from the DEER distribution over 3 members" in caplog.text
+
+
 def test_resampling(tmpdir, data_dir, simulation):
     # Make a directory structure that can support the resampling operation
     simulation.gmxapi.change_to_test_directory()
@@ -65,3 +174,83 @@ def test_final_time(tmpdir, data_dir, simulation):
 
     time = final_time(logs)
     assert time == 259.356
+
+
+def test_post_process_async(simulation, monkeypatch):
+    # Fake the training logs: alpha is the sixth column of the last line
+    helper = simulation.gmxapi.build_test_directory()
+    for site in simulation.gmxapi.get("test_sites"):
+        log = helper.get_path("phase", test_site=site, phase="training") / "{}.log".format(site)
+        with open(log, "w") as fh:
+            fh.write("time\tR\ttarget\tn\tA\talpha\n0.0\t3.0\t3.0\t1\t50\t42.0\n")
+
+    # The state and the test directory are only used in the calling thread, the logs are parsed in the workers
+    threads = {"state": set(), "parse": set()}
+
+    def record(kind, function):
+        def recorded(*args, **kwargs):
+            threads[kind].add(threading.get_ident())
+            return function(*args, **kwargs)
+
+        return recorded
+
+    monkeypatch.setattr(simulation.gmxapi.state, "get", record("state", simulation.gmxapi.state.get))
+    monkeypatch.setattr(simulation.gmxapi, "build_test_directory",
+                        record("state", simulation.gmxapi.build_test_directory))
+    monkeypatch.setattr(run_md, "final_fields", record("parse", run_md.final_fields))
+
+    run_until_complete(simulation.post_process_async())
+    assert threads["state"] == {threading.get_ident()}
+    assert threads["parse"] and threading.get_ident() not in threads["parse"]
+    for site in simulation.gmxapi.get("test_sites"):
+        assert simulation.gmxapi.state.get("phase", site_name=site) == "convergence"
+        assert simulation.gmxapi.state.get("alpha", site_name=site) == 42.0
+
+
+def test_configure_logging(tmpdir):
+    filename = "{}/0.log".format(tmpdir)
+    shutdown_logging()
+    handlers = list(logging.getLogger().handlers)
+    logger = configure_logging(filename, name="WZM-WZT.test", attach_to_root=False, rank=3, per_rank=True)
+    # Configuring the same file again does not add handlers
+    configure_logging(filename, name="WZM-WZT.test", attach_to_root=False, rank=3, per_rank=True)
+    assert len(logging.getLogger().handlers) == len(handlers) + 1
+    assert not logger.handlers
+
+    state = {"iteration": 2}
+    logger.debug("state: %s", state)
+    state["iteration"] = 3
+    shutdown_logging()
+    assert logging.getLogger().handlers == handlers
+    assert not os.path.exists(filename)
+    lines = open("{}/0.rank3.log".format(tmpdir)).readlines()
+    assert len(lines) == 1
+    assert "[rank 3] - DEBUG - state: {'iteration': 2}" in lines[0]
+
+
+def test_configure_logging_files(tmpdir, capfd):
+    shutdown_logging()
+    handlers = list(logging.getLogger().handlers)
+    first = configure_logging("{}/0.log".format(tmpdir), name="WZM-WZT.mem_0", attach_to_root=False)
+    second = configure_logging("{}/1.log".format(tmpdir), name="WZM-WZT.mem_1", attach_to_root=False, rank=1)
+    assert len(logging.getLogger().handlers) == len(handlers) + 1
+    first.info("first member")
+    second.info("second member")
+    logging.getLogger("WZM-WZT.mem_1.pruning").info("second member's pruner")
+    logging.getLogger("elsewhere").warning("no file")
+
+    # Moving a logger to another file
+    moved = configure_logging("{}/moved.log".format(tmpdir), name="WZM-WZT.mem_0", attach_to_root=False)
+    moved.info("moved")
+    shutdown_logging()
+
+    def messages(name):
+        return [line.split(" - ")[-1].strip() for line in open("{}/{}.log".format(tmpdir, name))]
+
+    assert messages(0) == ["first member"]
+    assert messages(1) == ["second member", "second member's pruner"]
+    assert messages("moved") == ["moved"]
+    assert "[rank 1]" in open("{}/1.log".format(tmpdir)).read()
+    console = capfd.readouterr().err
+    assert [console.count(message) for message in ["first member", "second member", "moved"]] == [1, 2, 1]
+    assert "no file" not in console
@@ -5,9 +5,11 @@ Unit and regression test for the RunParams class.
 from wzm_wzt.experimental_data import ExperimentalData
 from wzm_wzt.run_params import GeneralParams, PairParams, State
 from wzm_wzt.metadata import site_to_str
+from wzm_wzt.target_allocation import allocate
 import pytest
 import json
 import os
+import numpy as np
 
 def test_general_params(raw_deer_data):
     experimental_data = ExperimentalData()
@@ -71,3 +73,22 @@ def test_state(raw_deer_data, sites, tmpdir):
     state.new_iteration()
 
     #TODO: check that all the appropriate warnings are raised.
+
+def test_allocate_targets(state_dict, tmpdir):
+    distribution = list(state_dict["general_parameters"]["distribution"])
+    state = State(filename="{}/state.json".format(tmpdir))
+    state.set_from_dictionary(state_dict)
+    targets = state.allocate_targets(3, 10, distribution, method="latin_hypercube", seed=1)
+    assert sorted(targets.keys()) == sorted(state.pair_params.keys())
+    for target in targets.values():
+        assert target in state.get("bins")
+    # Members agree on the allocation without communicating
+    assert targets == state.allocate_targets(3, 10, distribution, method="latin_hypercube", seed=1)
+
+    # The targets follow the distribution in the order of the bins, not the sorted one the state returns
+    assert state.get("distribution") != distribution
+    indices = allocate(distribution, 10, 1, len(targets), method="stratified", rng=np.random.default_rng(0))
+    bins = state.get("bins")
+    expected = {name: bins[index] for name, index in zip(sorted(targets), indices[3, 0])}
+    assert state.allocate_targets(3, 10, distribution) == pytest.approx(expected)
+    assert state.allocate_targets(3, 10, state.get("distribution")) != pytest.approx(expected)
@@ -0,0 +1,28 @@
+"""Unit and regression test for the WaveScheduler class."""
+
+import pytest
+from wzm_wzt.scheduler import WaveScheduler
+
+
+def test_waves(sites, tmpdir):
+    site_names = list(sites["sites"].keys())
+    status_file = "{}/waves.json".format(tmpdir)
+    scheduler = WaveScheduler(site_names, 4, status_file=status_file, phase="training")
+    waves = scheduler.get_waves()
+    assert [len(wave) for wave in waves] == [4, 2]
+    assert sorted(sum(waves, [])) == sorted(site_names)
+
+    scheduler.mark_complete(waves[0])
+    assert not scheduler.is_complete()
+
+    # A restarted job only runs the unfinished wave
+    restarted = WaveScheduler(site_names, 4, status_file=status_file, phase="training")
+    assert restarted.get_waves() == [waves[1]]
+    restarted.mark_complete(waves[1])
+    assert restarted.is_complete()
+
+    # Completion is tracked per phase
+    assert len(WaveScheduler(site_names, 4, status_file=status_file, phase="convergence").get_pending()) == 6
+
+    with pytest.raises(ValueError):
+        WaveScheduler(site_names, 0)
@@ -0,0 +1,32 @@
+"""Unit and regression test for node-local scratch staging."""
+
+import pytest
+import os
+from wzm_wzt.staging import ScratchStager
+
+
+def test_staging(tmpdir):
+    ensemble_dir = tmpdir.mkdir("ensemble")
+    scratch_dir = tmpdir.mkdir("scratch")
+    canonical = "{}/mem_0/0/num_test_sites_6/3673_5636/training".format(ensemble_dir)
+    os.makedirs(canonical)
+    with open("{}/state.cpt".format(canonical), "w") as fh:
+        fh.write("input")
+
+    stager = ScratchStager(ensemble_dir, scratch_dir)
+    scratch = stager.stage_in(canonical)
+    assert scratch == "{}/mem_0/0/num_test_sites_6/3673_5636/training".format(scratch_dir)
+    assert open("{}/state.cpt".format(scratch)).read() == "input"
+
+    # Mimic an MD run in scratch
+    with open("{}/3673_5636.log".format(scratch), "w") as fh:
+        fh.write("time\tR\ttarget\talpha\n")
+    with open("{}/state.cpt".format(scratch), "w") as fh:
+        fh.write("output")
+
+    stager.stage_out(canonical)
+    copied = stager.wait()
+    assert sorted(os.path.basename(fnm) for fnm in copied) == ["3673_5636.log", "state.cpt"]
+    assert open("{}/state.cpt".format(canonical)).read() == "output"
+    assert os.path.exists("{}/3673_5636.log".format(canonical))
+    assert not os.path.exists(scratch)
@@ -0,0 +1,43 @@
+"""Unit and regression test for the target allocation methods."""
+
+import pytest
+import numpy
+from wzm_wzt.target_allocation import ALLOCATION_METHODS, allocate, discrepancy, halton
+
+
+@pytest.mark.parametrize("method", ALLOCATION_METHODS)
+def test_allocate(raw_deer_data, method):
+    distribution = raw_deer_data["distribution"]
+    indices = allocate(distribution, 20, 3, 6, method=method, rng=numpy.random.default_rng(0))
+    assert indices.shape == (20, 3, 6)
+    assert indices.min() >= 0 and indices.max() < len(distribution)
+    assert discrepancy(indices, distribution).shape == (3, 6)
+
+
+def test_discrepancy(raw_deer_data):
+    # Stratified allocations should match the DEER distribution much better than independent draws
+    distribution = raw_deer_data["distribution"]
+    rng = numpy.random.default_rng(2019)
+    independent = discrepancy(allocate(distribution, 50, 20, 6, rng=rng), distribution)
+    for method in ["stratified", "latin_hypercube", "halton"]:
+        allocated = discrepancy(allocate(distribution, 50, 20, 6, method=method, rng=rng), distribution)
+        assert allocated.mean() < independent.mean()
+    with pytest.raises(ValueError):
+        allocate(distribution, 50, 20, 6, method="bad_method")
+
+
+def test_latin_hypercube():
+    # Each member sees every stratum once per block of num_members iterations
+    distribution = [1.] * 5
+    indices = allocate(distribution, 5, 10, 2, method="latin_hypercube", rng=numpy.random.default_rng(0))
+    for block in [indices[:, :5], indices[:, 5:]]:
+        for pair in range(2):
+            for member in range(5):
+                assert sorted(block[member, :, pair]) == list(range(5))
+            for iteration in range(5):
+                assert sorted(block[:, iteration, pair]) == list(range(5))
+
+
+def test_halton():
+    points = halton(4, 2)
+    assert numpy.allclose(points, [[0.5, 1. / 3], [0.25, 2. / 3], [0.75, 1. / 9], [0.125, 4. / 9]])
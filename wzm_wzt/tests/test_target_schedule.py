@@ -0,0 +1,43 @@
+"""Unit and regression test for the TargetSchedule class."""
+
+import pytest
+import numpy
+from wzm_wzt.target_schedule import TargetSchedule
+
+
+def test_target_schedule(raw_deer_data, sites, tmpdir):
+    names = sorted(sites["sites"].keys())
+    schedule = TargetSchedule.generate(raw_deer_data["distribution"],
+                                       raw_deer_data["bins"],
+                                       names,
+                                       num_members=8,
+                                       num_iterations=3,
+                                       seed=1)
+    assert schedule.get_targets().shape == (8, 3, len(names))
+
+    filename = "{}/targets.npz".format(tmpdir)
+    schedule.save(filename)
+    loaded = TargetSchedule.load(filename)
+    assert numpy.array_equal(loaded.indices, schedule.indices)
+
+    targets = loaded.get(ensemble_num=2, iteration=1)
+    assert sorted(targets.keys()) == names
+    for name in names:
+        assert targets[name] in raw_deer_data["bins"]
+        assert loaded.get(2, 1, site_name=name) == targets[name]
+
+    with pytest.raises(IndexError):
+        loaded.get(ensemble_num=8, iteration=0)
+    with pytest.raises(KeyError):
+        loaded.get(0, 0, site_name="1_2")
+
+
+def test_stratified_target_schedule():
+    # With one member per bin, a stratified schedule must hit every stratum exactly once
+    distribution = [1.] * 10
+    bins = list(range(10))
+    schedule = TargetSchedule.generate(distribution, bins, ["a", "b"], num_members=10, num_iterations=2,
+                                       method="stratified", seed=0)
+    for iteration in range(2):
+        for column in range(2):
+            assert sorted(schedule.indices[:, iteration, column]) == bins
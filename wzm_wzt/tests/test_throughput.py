@@ -0,0 +1,82 @@
+"""Unit and regression test for the throughput module."""
+
+import json
+import pytest
+from mpi4py import MPI
+from wzm_wzt.throughput import parse_md_log, collect, format_ranking
+from wzm_wzt.catalog import RunCatalog
+from wzm_wzt.metrics import JSONL_FILENAME
+
+MD_LOG = """\
+Hardware detected on host {host} (the node of MPI rank 0):
+  CPU info:
+    Vendor: Intel
+        Statistics over 500001 steps using 5001 frames
+               Core t (s)   Wall t (s)        (%)
+       Time:    86400.000     3600.000     2400.0
+                         1h00:00
+                 (ns/day)    (hour/ns)
+Performance:      {ns_per_day:.3f}        0.100
+"""
+
+
+def write_md_log(workdir, host="nid001", ns_per_day=240.):
+    workdir.ensure_dir()
+    workdir.join("md.log").write(MD_LOG.format(host=host, ns_per_day=ns_per_day))
+    return workdir
+
+
+def test_parse_md_log(tmpdir):
+    figures = parse_md_log(write_md_log(tmpdir).join("md.log"))
+    assert figures == {
+        "ns_per_day": 240.,
+        "hours_per_ns": 0.1,
+        "wall_time": 3600.,
+        "core_time": 86400.,
+        "steps": 500001,
+        "host": "nid001"
+    }
+
+    # A run that was killed has no performance summary
+    tmpdir.join("killed.log").write(MD_LOG.split("Statistics")[0])
+    assert parse_md_log(tmpdir.join("killed.log")) is None
+
+
+def test_throughput_ranking(tmpdir):
+    workdirs = {
+        "slow": write_md_log(tmpdir.join("slow"), host="nid002", ns_per_day=10.),
+        "fast": write_md_log(tmpdir.join("fast"), ns_per_day=100.),
+        "unfinished": tmpdir.join("unfinished").ensure_dir()
+    }
+    rows = collect(workdirs)
+    assert [row["site_name"] for row in rows] == ["fast", "slow"]
+
+    catalog = RunCatalog("{}/catalog.sqlite".format(tmpdir))
+    catalog.record_throughput(0, 0, 2, "training", rows)
+    # Recording the same run twice replaces it
+    catalog.record_throughput(0, 0, 2, "training", rows)
+    catalog.record_throughput(1, 0, 2, "training", collect({"slow": write_md_log(tmpdir.join("1", "slow"), ns_per_day=20.)}))
+
+    by_member = catalog.get_throughput_ranking()
+    assert [row["ensemble_num"] for row in by_member] == [1, 0]
+    assert by_member[1]["runs"] == 2
+    assert by_member[1]["mean_ns_per_day"] == 55.
+    assert [row["host"] for row in catalog.get_throughput_ranking(by="host", limit=1)] == ["nid002"]
+    assert not catalog.get_throughput_ranking(phase="production")
+    with pytest.raises(ValueError):
+        catalog.get_throughput_ranking(by="workdir")
+
+    table = format_ranking(catalog.get_throughput_ranking(by="site_name"), "site_name").splitlines()
+    assert len(table) == 3
+    assert table[1].split()[0] == "slow"
+
+
+def test_simulation_throughput(simulation, mock_engine):
+    simulation.gmxapi.state.catalog = RunCatalog("{}/catalog.sqlite".format(simulation.gmxapi.get("ensemble_dir")))
+    simulation.run_phases(num_phases=1)
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        record = json.loads(open("{}/{}".format(simulation.member_dir, JSONL_FILENAME)).readline())
+        assert len(record["throughput"]) == len(simulation.gmxapi.state.get("test_sites"))
+        assert all(row["steps"] > 0 for row in record["throughput"])
+        ranking = simulation.gmxapi.state.catalog.get_throughput_ranking(by="site_name")
+        assert len(ranking) == len(record["throughput"])
@@ -0,0 +1,57 @@
+"""Unit and regression test for the tracing module."""
+
+import os
+import json
+from mpi4py import MPI
+from wzm_wzt.tracing import Tracer, gather_events, write_trace
+from wzm_wzt.metrics import PhaseTimer
+from wzm_wzt.run_md import Simulation
+
+
+def test_tracer(tmpdir):
+    comm = MPI.COMM_WORLD
+    tracer = Tracer(pid=3, tid=comm.Get_rank())
+    tracer.set_context(phase="training", iteration=0)
+    with tracer.span("run", site="3673_5636"):
+        pass
+    tracer.set_context(phase=None)
+    timer = PhaseTimer(tracer=tracer)
+    with timer.time("barrier"):
+        comm.Barrier()
+
+    events = tracer.get_events()
+    assert [event["name"] for event in events] == ["run", "barrier"]
+    assert events[0]["args"] == {"phase": "training", "iteration": 0, "site": "3673_5636"}
+    assert events[1]["args"] == {"iteration": 0}
+    assert events[0]["dur"] >= 0 and events[1]["ts"] >= events[0]["ts"]
+
+    merged = gather_events(events, comm)
+    filename = "{}/trace.json".format(tmpdir)
+    trace = write_trace(filename, [tracer], comm)
+    if comm.Get_rank() == 0:
+        assert len(merged) == 2 * comm.Get_size()
+        assert [event["tid"] for event in merged] == sorted(event["tid"] for event in merged)
+        assert json.load(open(filename)) == trace
+        spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+        assert len(spans) == len(merged)
+        names = {event["args"]["name"] for event in trace["traceEvents"] if event["ph"] == "M"}
+        assert {"member 3", "rank 0"} <= names
+    else:
+        assert merged is None and trace is None
+
+
+def test_simulation_trace(data_dir, tmpdir, mock_engine):
+    os.makedirs("{}/mem_0".format(tmpdir), exist_ok=True)
+    simulation = Simulation("{}/wzmwzt.tpr".format(data_dir),
+                            str(tmpdir),
+                            0,
+                            "{}/sites.json".format(data_dir),
+                            "{}/deer_data.json".format(data_dir),
+                            trace=True)
+    simulation.run_phases(num_phases=1)
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        trace = json.load(open("{}/mem_0/trace.json".format(tmpdir)))
+        spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+        runs = [event for event in spans if event["name"] == "run"]
+        assert runs and all(event["args"]["phase"] == "training" for event in runs)
+        assert {"barrier", "read_logs", "training_pp"} <= {event["name"] for event in spans}
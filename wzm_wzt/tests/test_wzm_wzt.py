@@ -5,8 +5,19 @@ Unit and regression test for the wzm_wzt package.
 # Import package, test suite, and other packages as needed
 import wzm_wzt
 import pytest
+import os
 import sys
+import subprocess
 
 def test_wzm_wzt_imported():
     """Sample test, will always pass so long as import statement worked"""
     assert "wzm_wzt" in sys.modules
+
+
+def test_lazy_imports():
+    """The analysis modules can be imported without MPI or GROMACS"""
+    code = ("import sys, wzm_wzt.run_md, wzm_wzt.ensemble, wzm_wzt.cli; "
+            "print('mpi4py' in sys.modules, 'gmx' in sys.modules)")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(wzm_wzt.__file__)))
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True, cwd=root).stdout
+    assert output.decode().split() == ["False", "False"]
@@ -0,0 +1,102 @@
+"""MD throughput of every run in an ensemble.
+
+After each phase, the md.log in every phase directory is parsed for the
+performance summary GROMACS writes at the end of a run:
+
+    Hardware detected on host nid001234 (the node of MPI rank 0):
+        Statistics over 500001 steps using 5001 frames
+                   Core t (s)   Wall t (s)        (%)
+           Time:    86400.000     3600.000     2400.0
+                     (ns/day)    (hour/ns)
+    Performance:      240.000        0.100
+
+The figures go into the member's metrics (see metrics.write_metrics) and the
+run catalog, which can rank members, sites and hosts by throughput across the
+whole ensemble (see catalog.RunCatalog.get_throughput_ranking).
+"""
+
+import os
+import re
+import glob
+
+_PATTERNS = {
+    "host": re.compile(r"Hardware detected on host (\S+)"),
+    "steps": re.compile(r"Statistics over (\d+) steps"),
+    "time": re.compile(r"^\s*Time:\s+(\S+)\s+(\S+)"),
+    "performance": re.compile(r"^Performance:\s+(\S+)\s+(\S+)"),
+}
+
+
+def find_md_log(workdir):
+    """The most recent mdrun log in a working directory (md.log, or
+    md.partNNNN.log when mdrun does not append), or None."""
+    logs = glob.glob(os.path.join(str(workdir), "md*.log"))
+    if not logs:
+        return None
+    return max(logs, key=os.path.getmtime)
+
+
+def parse_md_log(path):
+    """Read the performance summary of the last run in an mdrun log.
+
+    Returns
+    -------
+    dict
+        ns_per_day, hours_per_ns, wall_time, core_time (seconds), steps and host; values missing from the log
+        (e.g. for a run that was stopped early) are None. Returns None if the log has no performance summary.
+    """
+    figures = dict.fromkeys(["ns_per_day", "hours_per_ns", "wall_time", "core_time", "steps", "host"])
+    with open(str(path)) as fh:
+        for line in fh:
+            match = _PATTERNS["host"].search(line)
+            if match:
+                figures["host"] = match.group(1)
+                continue
+            match = _PATTERNS["steps"].search(line)
+            if match:
+                figures["steps"] = int(match.group(1))
+                continue
+            match = _PATTERNS["time"].match(line)
+            if match:
+                figures["core_time"], figures["wall_time"] = float(match.group(1)), float(match.group(2))
+                continue
+            match = _PATTERNS["performance"].match(line)
+            if match:
+                figures["ns_per_day"], figures["hours_per_ns"] = float(match.group(1)), float(match.group(2))
+    if figures["ns_per_day"] is None:
+        return None
+    return figures
+
+
+def collect(workdirs):
+    """Collect the throughput of the runs in a set of working directories.
+
+    Parameters
+    ----------
+    workdirs : dict
+        {site name (or 'production'): working directory}
+
+    Returns
+    -------
+    list
+        one dictionary per run that has a performance summary: the figures from parse_md_log, plus 'site_name'
+        and 'workdir'.
+    """
+    rows = []
+    for site_name, workdir in sorted(workdirs.items()):
+        md_log = find_md_log(workdir)
+        figures = parse_md_log(md_log) if md_log else None
+        if figures is not None:
+            figures.update(site_name=site_name, workdir=os.path.abspath(str(workdir)))
+            rows.append(figures)
+    return rows
+
+
+def format_ranking(ranking, by):
+    """Format the result of RunCatalog.get_throughput_ranking as a table."""
+    lines = ["{:>20} {:>12} {:>12} {:>12} {:>6}".format(by, "mean ns/day", "min ns/day", "wall time/h", "runs")]
+    for row in ranking:
+        lines.append("{:>20} {:>12.2f} {:>12.2f} {:>12.2f} {:>6}".format(
+            str(row[by]), row["mean_ns_per_day"], row["min_ns_per_day"], (row["wall_time"] or 0.) / 3600.,
+            row["runs"]))
+    return "\n".join(lines)
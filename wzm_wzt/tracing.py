@@ -0,0 +1,166 @@
+"""Cross-rank traces in the Chrome trace-event format.
+
+A Tracer buffers spans (a name, start and end, and arguments such as the phase
+and site) in memory on each rank. ``write_trace`` gathers the spans of every
+rank to the root and writes one JSON file that chrome://tracing and
+https://ui.perfetto.dev can open, with each ensemble member as a process and
+each MPI rank as a thread. A rank that reaches a barrier late shows up as the
+other ranks' long barrier spans.
+
+Simulation(trace=True) traces every stage that its PhaseTimer times (MD runs,
+barriers, collectives, reading logs, post-processing, moving checkpoints; see
+metrics.STAGES).
+
+The spans are exchanged as JSON in a byte buffer, with one Gather of the sizes
+and one Gatherv of the data, so nothing is pickled.
+"""
+
+import os
+import json
+import time
+import threading
+import contextlib
+import numpy as np
+
+
+class Tracer():
+    def __init__(self, pid=0, tid=0):
+        """Buffers spans on one rank.
+
+        Parameters
+        ----------
+        pid : int, optional
+            the trace process, by default 0 (Simulation uses the ensemble member)
+        tid : int, optional
+            the trace thread, by default 0 (Simulation uses the rank in MPI.COMM_WORLD)
+        """
+        self.pid = pid
+        self.tid = tid
+        self.events = []
+        self.context = {}
+        self._lock = threading.Lock()
+
+    def set_context(self, **kwargs):
+        """Arguments added to every span from now on (e.g. phase=...); a value
+        of None removes the argument."""
+        with self._lock:
+            self.context.update(kwargs)
+            self.context = {key: value for key, value in self.context.items() if value is not None}
+
+    def add(self, name, start, end, category="stage", **kwargs):
+        """Record a span.
+
+        Parameters
+        ----------
+        name : str
+            what happened.
+        start, end : float
+            wall-clock times (time.time()) in seconds.
+        category : str, optional
+            by default 'stage'
+        kwargs
+            arguments shown with the span, on top of the context.
+        """
+        with self._lock:
+            args = {key: value for key, value in dict(self.context, **kwargs).items() if value is not None}
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": self.pid,
+                "tid": self.tid,
+                "args": args
+            })
+
+    @contextlib.contextmanager
+    def span(self, name, category="stage", **kwargs):
+        """Record the enclosed block as a span."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time(), category=category, **kwargs)
+
+    def get_events(self):
+        with self._lock:
+            return list(self.events)
+
+    def write(self, filename, comm, root=0):
+        """Write the spans of every rank in ``comm`` to ``filename`` (see
+        write_trace)."""
+        return write_trace(filename, [self], comm, root=root)
+
+
+def gather_events(events, comm, root=0):
+    """Gather lists of trace events to the root (a collective call).
+
+    Returns
+    -------
+    list
+        on the root, the events of every rank in rank order; None on the other ranks.
+    """
+    from mpi4py import MPI
+
+    local = np.frombuffer(json.dumps(events, default=str).encode("utf-8"), dtype=np.uint8)
+    sizes = np.zeros(comm.Get_size(), dtype=np.int64) if comm.Get_rank() == root else None
+    comm.Gather(np.array([local.size], dtype=np.int64), sizes, root=root)
+    if comm.Get_rank() != root:
+        comm.Gatherv(local, None, root=root)
+        return None
+    data = np.empty(int(sizes.sum()), dtype=np.uint8)
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    comm.Gatherv(local, [data, sizes, offsets, MPI.BYTE], root=root)
+    merged = []
+    for offset, size in zip(offsets, sizes):
+        merged.extend(json.loads(data[offset:offset + size].tobytes().decode("utf-8")))
+    return merged
+
+
+def write_trace(filename, tracers, comm, root=0):
+    """Merge the spans of ``tracers`` on every rank of ``comm`` into one trace
+    file (a collective call; only the root writes).
+
+    Parameters
+    ----------
+    filename : str
+        where to write the trace (replaced atomically).
+    tracers : list
+        this rank's tracers, e.g. one per ensemble member it ran.
+    comm : mpi4py.MPI.Comm
+        the ranks whose spans to merge.
+    root : int, optional
+        the rank that writes, by default 0
+
+    Returns
+    -------
+    dict
+        the trace on the root, None on the other ranks.
+    """
+    events = []
+    for tracer in tracers:
+        events.extend(tracer.get_events())
+    events = gather_events(events, comm, root=root)
+    if events is None:
+        return None
+
+    metadata = []
+    for pid, tid in sorted({(event["pid"], event["tid"]) for event in events}):
+        metadata.append({
+            "name": "thread_name",
+            "ph": "M",
+            "pid": pid,
+            "tid": tid,
+            "args": {
+                "name": "rank {}".format(tid)
+            }
+        })
+    for pid in sorted({event["pid"] for event in events}):
+        metadata.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "member {}".format(pid)}})
+    trace = {"traceEvents": metadata + sorted(events, key=lambda event: event["ts"]), "displayTimeUnit": "ms"}
+    tmp = "{}.tmp".format(filename)
+    with open(tmp, "w") as fh:
+        json.dump(trace, fh)
+    os.replace(tmp, str(filename))
+    return trace